@@ -10,9 +10,13 @@ if (
 # add root directory to path for relative import
 from src.sqlite.db_utils import add_or_get_user, get_assistant
 from src.streamlit_utils import get_remote_ip, init, get, set_to
-from src.chroma_utils import start_chroma_server
+from src.chroma_utils import start_chroma_server, migrate_chunk_metadata
+from src.embedding_registry import warm_up_embedding_model
+from src.ingestion import start_ingestion_workers
+from src.url_refresh import start_url_refresh_scheduler
 from src.basic_data_classes import User
-from src.sqlite.gov_db_utils import get_global_setting
+from src.sqlite.gov_db_utils import get_global_setting, add_missing_global_settings
+from src.sqlite.db_creation import migrate_database
 
 from app.mine_assistenter import mine_assistenter_page, go_to_chat_assistant_page
 from app.edit_assistant import edit_assistant_page
@@ -42,6 +46,16 @@ if get("user") is None:
     # start chroma server  for indexing assistant knwoledge base documents
     with st.spinner("Logger ind..."):
         start_chroma_server()
+        # bring databases created by older versions up to date
+        migrate_database()
+        migrate_chunk_metadata()
+        add_missing_global_settings()
+        # load the embeddings model once for all sessions, before the first question needs it
+        warm_up_embedding_model()
+        # index sources added by users in the background
+        start_ingestion_workers()
+        # keep url sources up to date
+        start_url_refresh_scheduler()
         # user is initialized by ip address
         print("initializing user")
         ip_adress = str(get_remote_ip())
@@ -1,9 +1,10 @@
 import streamlit as st
 from src.streamlit_utils import get, set_to, append
 from src.sqlite.gov_db_utils import get_global_setting
-from src.openai_utils import generate_response
-from src.sqlite.db_utils import get_llm
-from src.query_chain import generate_search_queries, add_context_from_queries
+from src.openai_utils import generate_response_stream
+from src.sqlite.db_utils import get_llm, count_assistant_sources
+from src.query_chain import build_context_pipelined
+from src.answer_cache import get_source_set_version, lookup_answer, store_answer
 import logging
 
 
@@ -39,6 +40,25 @@ def write_message(message):
 
 
 
+def stream_response(assistant, prompt, request_messages) -> str:
+    """show the response as it is generated, then render it with images"""
+    placeholder = st.empty()
+    placeholder.markdown("Skriver...")
+    response = ""
+    for delta in generate_response_stream(
+        prompt_input=prompt,
+        llm=get_llm(assistant.chat_model_name),
+        messages=request_messages,
+        max_tokens=int(get_global_setting("max_tokens").value),
+        temperature=assistant.temperature,
+    ):
+        response += delta
+        placeholder.markdown(response + "▌", unsafe_allow_html=True)
+    with placeholder.container():
+        write_message(response)
+    return response
+
+
 def chat_page():
     assistant = get("current_assistant")
 
@@ -88,44 +108,55 @@ def chat_page():
         with st.chat_message(name=names["user"], avatar=icons["user"]):
             write_message(prompt)
             # st.markdown(prompt, unsafe_allow_html=True)
-        if get("number_of_sources") > 0:
-            search_queries = generate_search_queries(
-                prompt_input=prompt, messages=get("messages")
-            )
-            str_search_queries = "- " + "\n- ".join(search_queries)
-            with st.spinner(f"Søger efter:\n {str_search_queries}"):
-                # with st.spinner("Søger..."):
-                # request_messages = add_context(
-                #     prompt=prompt,
-                #     messages=get("messages"),
-                #     assistant=assistant,
-                #     top_k=4,
-                # )
-                logging.info(f"search queries generated: {search_queries}")
-                request_messages = add_context_from_queries(
-                    messages=get("messages"),
-                    queries=search_queries,
+        # only the first question of a conversation is answered from the cache,
+        # later answers depend on the conversation
+        use_answer_cache = assistant.answer_cache and not any(
+            m["role"] == "user" for m in get("messages")
+        )
+        cached_answer = None
+        if use_answer_cache:
+            source_set_version = get_source_set_version(assistant.id)
+            cached_answer = lookup_answer(assistant.id, prompt)
+        if cached_answer is not None:
+            logging.info("answer found in answer cache")
+            with st.sidebar:
+                st.markdown("Svaret er genbrugt fra et tidligere, lignende spørgsmål.")
+        # sources are indexed in the background, so they are counted for every prompt
+        elif count_assistant_sources(assistant.id) > 0:
+            with st.spinner("Søger..."):
+                # the prompt is searched for while the search queries are generated
+                context, report = build_context_pipelined(
                     assistant=assistant,
+                    prompt_input=prompt,
+                    messages=get("messages"),
                     top_k=4,
                 )
-                context = request_messages[-1]["content"]
+                logging.info(f"searched for: {report['queries']}")
+                str_search_queries = "- " + "\n- ".join(report["queries"])
+                request_messages = get("messages") + [
+                    {"role": "user", "content": "context: " + context}
+                ]
                 with st.sidebar:
                     st.markdown(
                         "Søgte efter: \n"
                         f"{str_search_queries}"
-                        "\n\nResultater:\n\n"
+                        f"\n\nResultater ({report['passages_used']} af {report['passages_total']} tekststykker, "
+                        f"{report['tokens_used']}/{report['token_budget']} tokens):\n\n"
                         ,unsafe_allow_html=True)
-                    write_message(context)
+                    write_message("context: " + context)
         else:
             request_messages = get("messages")
-        with st.spinner("Skriver..."):
-            response = generate_response(
-                prompt_input=prompt,
-                llm=get_llm(assistant.chat_model_name),
-                messages=request_messages,
-                max_tokens=int(get_global_setting("max_tokens").value),
-                temperature=assistant.temperature,
-            )
+        with st.chat_message(
+            name=names["assistant"],
+            avatar=icons["assistant"],
+        ):
+            if cached_answer is not None:
+                response = cached_answer
+                write_message(response)
+            else:
+                response = stream_response(assistant, prompt, request_messages)
+                if use_answer_cache and response:
+                    store_answer(assistant.id, prompt, response, source_set_version)
         logging.info(
             f"assistant {assistant.name} received prompt: "
             f"{prompt[:100]}{'...' if len(prompt)>100 else ''}"
@@ -137,8 +168,3 @@ def chat_page():
         # response = "test"
         append("messages", {"role": "user", "content": prompt})
         append("messages", {"role": "assistant", "content": response})
-        with st.chat_message(
-            name=names["assistant"],
-            avatar=icons["assistant"],
-        ):
-            write_message(response)
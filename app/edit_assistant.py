@@ -7,13 +7,13 @@ from src.sqlite.db_utils import (
     add_or_update_assistant,
     get_assistant_sources,
     delete_assistant,
-    add_source,
     delete_source,
     get_active_llms,
     get_base_url,
 )
 from src.streamlit_utils import get, set_to, append
-from src.chroma_utils import create_source
+from src.chroma_utils import create_sources
+from src.ingestion import submit_source, get_assistant_jobs, retry_job, dismiss_job
 from src.basic_data_classes import Assistant
 from src.sqlite.gov_db_utils import get_global_setting
 
@@ -83,18 +83,19 @@ def go_to_chat_assistant_page(assistant: Assistant):
             {"role": "assistant", "content": assistant.welcome_message},
         ],
     )
-    set_to("number_of_sources", len(get_assistant_sources(assistant.id)))
 
 
 # edit assistant functions
 def read_text_from_files(assistant_id: str):
     """add uploaded files to sources_to_add and reset file uploader"""
     uploaded_files = get(get("temp_file_key", "2"))
-    for file in uploaded_files:
-        # st.session_state.sources_to_add.append(Source(file))
-        source = create_source(file, assistant_id)
+    # the files are parsed in parallel
+    sources, errors = create_sources(uploaded_files, assistant_id)
+    for source in sources:
         append("sources_to_add", source)
         append("session_sources", source)
+    for name in errors:
+        st.error(f"Kunne ikke indlæse {name}")
 
     # reset uploader
     st.session_state.temp_file_key = str(randint(1, 1000000))
@@ -105,17 +106,22 @@ def display_source(s):
 
 
 def add_urls(displayed_sources):
-    for source in displayed_sources:
-        # if the string does not end in  (dd/dd dd:dd):
-        if re.search(r"\(\d{2}/\d{2}\s\d{2}:\d{2}\)$", source) is None:
-            with st.spinner("Indlæser tekst fra link..."):
-                try:
-                    new_source = create_source(source, get("current_assistant").id)
-                    # remove from displayed sources
-                    append("session_sources", new_source)
-                    append("sources_to_add", new_source)
-                except Exception:
-                    st.error(f"Kunne ikke indlæse {source}")
+    # urls are the tags that do not end in  (dd/dd dd:dd):
+    urls = [
+        source
+        for source in displayed_sources
+        if re.search(r"\(\d{2}/\d{2}\s\d{2}:\d{2}\)$", source) is None
+    ]
+    if len(urls) == 0:
+        return
+    with st.spinner("Indlæser tekst fra link..."):
+        sources, errors = create_sources(urls, get("current_assistant").id)
+    for new_source in sources:
+        # remove from displayed sources
+        append("session_sources", new_source)
+        append("sources_to_add", new_source)
+    for url in errors:
+        st.error(f"Kunne ikke indlæse {url}")
 
 
 def validate_config(assistant):
@@ -145,13 +151,58 @@ def save_assistant(assistant):
     if validate_config(assistant):
         with st.spinner("Gemmer assistent..."):
             add_or_update_assistant(assistant=assistant)
+            # a source with the same name as a deleted one replaces it, the replaced source
+            # stays until the new one is indexed and its unchanged chunks are reused
+            replaced_by_name = {}
+            for source in get("sources_to_delete"):
+                replaced_by_name.setdefault(source.name, source)
+            replaced_ids = set()
+            # sources are indexed in the background
             for source in get("sources_to_add"):
-                add_source(source)
+                replaced = replaced_by_name.pop(source.name, None)
+                if replaced is not None:
+                    replaced_ids.add(replaced.id)
+                submit_source(source, replaces_source_id=replaced.id if replaced else "")
             for source in get("sources_to_delete"):
-                delete_source(source)
+                if source.id not in replaced_ids:
+                    delete_source(source)
         go_to_edit_assistant_page(assistant)
 
 
+def show_ingestion_jobs(assistant):
+    """show the progress of the sources being indexed for the assistant"""
+    jobs = get_assistant_jobs(assistant.id)
+    if not jobs:
+        return
+    for job in jobs:
+        if job.status == "failed":
+            c1, c2, c3 = st.columns([4, 1, 1])
+            c1.error(f"Kunne ikke indlæse {job.source_name}: {job.error}")
+            c2.button(
+                "Prøv igen",
+                key=f"retry_{job.id}",
+                on_click=retry_job,
+                args=(job.id,),
+                use_container_width=True,
+            )
+            c3.button(
+                "Fjern",
+                key=f"dismiss_{job.id}",
+                on_click=dismiss_job,
+                args=(job.id,),
+                use_container_width=True,
+            )
+        elif job.status == "queued":
+            st.progress(0.0, text=f"{job.source_name} venter på at blive indlæst")
+        else:
+            progress = job.chunks_done / job.chunks_total if job.chunks_total else 0.0
+            st.progress(
+                progress,
+                text=f"Indlæser {job.source_name} ({job.chunks_done}/{job.chunks_total})",
+            )
+    st.button("Opdater status", key="refresh_ingestion_jobs")
+
+
 # UI
 
 
@@ -228,6 +279,28 @@ def edit_assistant_page():
             key="temperature",
         )
 
+        st.select_slider(
+            label="Kontekst omkring fundne tekststykker",
+            options=[0, 1, 2, 3],
+            value=min(current_assistant.neighbor_window, 3),
+            help=(
+                "Hvor mange tekststykker før og efter hvert fundet tekststykke, "
+                "der sendes med til assistanten. Mere kontekst giver mere sammenhængende svar, "
+                "men bruger flere tokens."
+            ),
+            key="neighbor_window",
+        )
+        st.toggle(
+            label="Genbrug svar på ens spørgsmål",
+            value=current_assistant.answer_cache,
+            help=(
+                "Når en samtale starter med et spørgsmål, der minder meget om et tidligere, "
+                "gives det samme svar uden at spørge modellen igen. "
+                "Nyttigt for delte assistenter, hvor mange stiller de samme spørgsmål."
+            ),
+            key="answer_cache",
+        )
+
         # welcome message input
         st.text_input(
             label="Assitentens velkomstbesked*",
@@ -264,12 +337,29 @@ def edit_assistant_page():
             maxtags=10,
         )
         add_urls(displayed_sources)
+        refresh_options = {0: "Aldrig", 1: "Hver time", 24: "Dagligt", 168: "Ugentligt"}
+        st.selectbox(
+            label="Opdater links",
+            options=refresh_options.keys(),
+            format_func=lambda hours: refresh_options[hours],
+            index=(
+                list(refresh_options).index(current_assistant.url_refresh_hours)
+                if current_assistant.url_refresh_hours in refresh_options
+                else 0
+            ),
+            help="Hvor ofte assistentens links hentes igen, så ændringer på hjemmesiderne kommer med.",
+            key="url_refresh_hours",
+        )
+        show_ingestion_jobs(current_assistant)
 
     current_assistant.name = get("assistant_name", "")
     current_assistant.chat_model_name = get("chat_model_name")
     current_assistant.system_prompt = get("system_prompt", "")
     current_assistant.welcome_message = get("welcome_message", "")
     current_assistant.temperature = options_dict[get("temperature")]
+    current_assistant.url_refresh_hours = get("url_refresh_hours", 0)
+    current_assistant.neighbor_window = get("neighbor_window", 1)
+    current_assistant.answer_cache = get("answer_cache", False)
 
     # detect and handle sources removed
     # check if sources have been removed from sources is the list of sources still contains indexed sources
@@ -1,7 +1,7 @@
 """ This module contains the streamlit page for editing a LLM model. """ ""
 import streamlit as st
 from src.streamlit_utils import get, set_to
-from src.openai_utils import LLM, llm_api_test
+from src.openai_utils import LLM, llm_api_test, invalidate_client
 from src.sqlite.gov_db_utils import deploy_llm
 
 
@@ -102,6 +102,15 @@ def edit_llm_model_page():
                 placeholder=placeholders["deployment"][model["api_type"]],
                 value=model.get("deployment", ""),
             )
+            model["context_token_budget"] = st.number_input(
+                "Max tokens til kontekst",
+                min_value=100,
+                max_value=200000,
+                step=500,
+                value=model.get("context_token_budget", 3000),
+                help="Hvor mange tokens tekst fra videnskilderne der højst sendes med hvert spørgsmål. "
+                "Færre tokens giver hurtigere og billigere svar.",
+            )
         submit = st.button("Test og tilføj")
 
         if submit:
@@ -113,6 +122,7 @@ def edit_llm_model_page():
                 # add to db
                 st.success(message)
                 deploy_llm(llm)
+                invalidate_client(llm.id)
                 set_to("model", {})
                 set_to("page", "admin_home")
             else:
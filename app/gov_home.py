@@ -18,6 +18,12 @@ from src.sqlite.gov_db_utils import (
     set_global_setting,
     reset_all_global_settings,
 )
+from src.embedding_registry import evict_embedding_model
+from src.openai_utils import invalidate_client
+from src.query_generation import get_query_generation_stats, clear_query_cache
+from src.answer_cache import get_answer_cache_stats, clear_answer_cache
+from src.retrieval_cache import get_retrieval_cache_stats, clear_retrieval_cache
+from src.chroma_utils import get_chroma_client_stats
 
 from src.sqlite.db_creation import (
     backup,
@@ -44,6 +50,11 @@ def go_to_my_assistants():
 
 
 # llms
+def delete_llm_and_client(llm):
+    delete_llm(llm)
+    invalidate_client(llm.id)
+
+
 def confirm_and_delete_llm(llm):
     st.warning(
         f"Er du sikker på, at du vil slette {llm.name}? Denne handling kan ikke fortrydes."
@@ -53,7 +64,7 @@ def confirm_and_delete_llm(llm):
         c1.button(
             "Ja, slet modellen",
             key="confirm_delete",
-            on_click=delete_llm,
+            on_click=delete_llm_and_client,
             args=(llm,),
             use_container_width=True,
         )
@@ -76,16 +87,49 @@ def reset_displayed_settings():
     set_to("settings_unchanged", True)
 
 
+def evict_replaced_embeddings_model(old_model_name):
+    """free the memory of the previous embeddings model if the setting was changed"""
+    if get_global_setting_dicts()["embeddings_model"]["value"] != old_model_name:
+        evict_embedding_model(old_model_name)
+
+
+# settings used when an llm client is created
+llm_client_settings = ("llm_max_connections", "llm_timeout_seconds")
+
+
+def get_llm_client_settings():
+    global_settings = get_global_setting_dicts()
+    return {key: global_settings[key]["value"] for key in llm_client_settings if key in global_settings}
+
+
+def invalidate_clients_if_changed(old_client_settings):
+    """let new llm clients pick up changed connection pool settings"""
+    if get_llm_client_settings() != old_client_settings:
+        invalidate_client()
+
+
 def reset_global_settings():
+    old_model_name = get_global_setting_dicts()["embeddings_model"]["value"]
+    old_client_settings = get_llm_client_settings()
     reset_all_global_settings()
+    evict_replaced_embeddings_model(old_model_name)
+    invalidate_clients_if_changed(old_client_settings)
     reset_displayed_settings()
 
 
 def set_global_settings():
     keys = get("global_setting_keys")
-    for setting in get_global_setting_dicts().values():
+    global_settings = get_global_setting_dicts()
+    old_model_name = global_settings["embeddings_model"]["value"]
+    old_client_settings = get_llm_client_settings()
+    for setting in global_settings.values():
+        # skip settings that are not displayed on the page
+        if get(keys[setting["id"]]) is None:
+            continue
         setting["value"] = get(keys[setting["id"]])
         set_global_setting(setting)
+    evict_replaced_embeddings_model(old_model_name)
+    invalidate_clients_if_changed(old_client_settings)
 
 
 # ------------------------
@@ -213,6 +257,223 @@ def gov_home_page():
                 help="Navnet på den Sentence Embeddings model, der skal bruges til at indeksere kilder.",
                 key=get("global_setting_keys")["embeddings_model"],
             )
+            st.number_input(
+                "Max hukommelse til embeddings modeller (MB)",
+                min_value=256,
+                max_value=65536,
+                value=global_settings["embeddings_memory_cap_mb"]["value"],
+                step=256,
+                help=(
+                    "Indlæste embeddings modeller deles af alle brugere. "
+                    "Når grænsen overskrides, fjernes den mindst brugte model fra hukommelsen."
+                ),
+                key=get("global_setting_keys")["embeddings_memory_cap_mb"],
+            )
+            c1, c2 = st.columns([1, 1])
+            c1.number_input(
+                "Max forbindelser pr. model",
+                min_value=1,
+                max_value=200,
+                value=global_settings["llm_max_connections"]["value"],
+                help="Antallet af genbrugte forbindelser til hver models API.",
+                key=get("global_setting_keys")["llm_max_connections"],
+            )
+            c2.number_input(
+                "Timeout for modelkald (sekunder)",
+                min_value=1.0,
+                max_value=600.0,
+                value=global_settings["llm_timeout_seconds"]["value"],
+                step=5.0,
+                help="Hvor længe der ventes på svar fra modellens API.",
+                key=get("global_setting_keys")["llm_timeout_seconds"],
+            )
+            c1, c2 = st.columns([1, 1])
+            c1.number_input(
+                "Antal baggrundsjobs til indlæsning",
+                min_value=1,
+                max_value=16,
+                value=global_settings["ingestion_workers"]["value"],
+                help="Hvor mange videnskilder der indlæses samtidig. Træder i kraft ved genstart.",
+                key=get("global_setting_keys")["ingestion_workers"],
+            )
+            c2.number_input(
+                "Max forsøg pr. videnskilde",
+                min_value=1,
+                max_value=10,
+                value=global_settings["ingestion_max_attempts"]["value"],
+                help="Hvor mange gange indlæsning af en videnskilde forsøges, før den markeres som fejlet.",
+                key=get("global_setting_keys")["ingestion_max_attempts"],
+            )
+            st.number_input(
+                "Antal processer til indlæsning af filer og links",
+                min_value=1,
+                max_value=32,
+                value=global_settings["document_loader_workers"]["value"],
+                help="Hvor mange uploadede filer der læses samtidig.",
+                key=get("global_setting_keys")["document_loader_workers"],
+            )
+            c1, c2, c3 = st.columns([1, 1, 1])
+            c1.number_input(
+                "Samtidige hentninger pr. hjemmeside",
+                min_value=1,
+                max_value=32,
+                value=global_settings["url_fetch_per_host_limit"]["value"],
+                help="Hvor mange links fra samme hjemmeside der hentes samtidig. Træder i kraft ved genstart.",
+                key=get("global_setting_keys")["url_fetch_per_host_limit"],
+            )
+            c2.number_input(
+                "Max forbindelser til hjemmesider",
+                min_value=1,
+                max_value=200,
+                value=global_settings["url_fetch_max_connections"]["value"],
+                help="Antallet af genbrugte forbindelser til at hente links. Træder i kraft ved genstart.",
+                key=get("global_setting_keys")["url_fetch_max_connections"],
+            )
+            c3.number_input(
+                "Timeout for links (sekunder)",
+                min_value=1.0,
+                max_value=600.0,
+                value=global_settings["url_fetch_timeout_seconds"]["value"],
+                step=5.0,
+                help="Hvor længe der ventes på svar fra en hjemmeside. Træder i kraft ved genstart.",
+                key=get("global_setting_keys")["url_fetch_timeout_seconds"],
+            )
+            c1, c2 = st.columns([1, 1])
+            c1.number_input(
+                "Samtidige opdateringer af links",
+                min_value=1,
+                max_value=32,
+                value=global_settings["url_refresh_concurrency"]["value"],
+                help="Hvor mange links der højst hentes samtidig, når assistenternes links opdateres automatisk.",
+                key=get("global_setting_keys")["url_refresh_concurrency"],
+            )
+            c2.number_input(
+                "Tjek for links der skal opdateres (minutter)",
+                min_value=1,
+                max_value=1440,
+                value=global_settings["url_refresh_check_minutes"]["value"],
+                help="Hvor ofte der ledes efter links, der skal opdateres.",
+                key=get("global_setting_keys")["url_refresh_check_minutes"],
+            )
+            active_llms = {llm.id: llm.name for llm in get_deployed_llms() if llm.is_active}
+            query_maker_options = [""] + list(active_llms)
+            if global_settings["query_maker_llm_id"]["value"] not in query_maker_options:
+                query_maker_options.append(global_settings["query_maker_llm_id"]["value"])
+            c1, c2, c3 = st.columns([1, 1, 1])
+            c1.selectbox(
+                "Model til søgeforespørgsler",
+                options=query_maker_options,
+                index=query_maker_options.index(global_settings["query_maker_llm_id"]["value"]),
+                format_func=lambda llm_id: active_llms.get(llm_id, llm_id or "Første aktive model"),
+                help="Den model der omskriver brugerens besked til søgeforespørgsler. En lille, hurtig model anbefales.",
+                key=get("global_setting_keys")["query_maker_llm_id"],
+            )
+            c2.number_input(
+                "Max tokens til søgeforespørgsler",
+                min_value=50,
+                max_value=5000,
+                value=global_settings["query_maker_max_tokens"]["value"],
+                step=50,
+                help="Den maksimale længde af svaret med søgeforespørgsler.",
+                key=get("global_setting_keys")["query_maker_max_tokens"],
+            )
+            c3.number_input(
+                "Ventetid på søgeforespørgsler (sekunder)",
+                min_value=0.0,
+                max_value=600.0,
+                value=global_settings["query_maker_timeout_seconds"]["value"],
+                step=1.0,
+                help=(
+                    "Der søges på brugerens besked, mens søgeforespørgslerne genereres. "
+                    "Er de ikke klar inden for denne tid, bruges kun resultaterne for beskeden. 0 venter altid."
+                ),
+                key=get("global_setting_keys")["query_maker_timeout_seconds"],
+            )
+            c1, c2, c3 = st.columns([1, 1, 1])
+            c1.number_input(
+                "Gemte søgeforespørgsler",
+                min_value=1,
+                max_value=100000,
+                value=global_settings["query_cache_size"]["value"],
+                step=100,
+                help="Hvor mange samtaler der huskes søgeforespørgsler for, så de ikke genereres igen.",
+                key=get("global_setting_keys")["query_cache_size"],
+            )
+            c2.number_input(
+                "Levetid for gemte søgeforespørgsler (minutter)",
+                min_value=1,
+                max_value=10080,
+                value=global_settings["query_cache_ttl_minutes"]["value"],
+                help="Hvor længe gemte søgeforespørgsler genbruges.",
+                key=get("global_setting_keys")["query_cache_ttl_minutes"],
+            )
+            c3.number_input(
+                "Max ord i spørgsmål der søges direkte på",
+                min_value=0,
+                max_value=100,
+                value=global_settings["query_fast_path_max_words"]["value"],
+                help=(
+                    "Korte spørgsmål, der ikke henviser til samtalen, bruges direkte som søgning "
+                    "uden at generere søgeforespørgsler. 0 slår dette fra."
+                ),
+                key=get("global_setting_keys")["query_fast_path_max_words"],
+            )
+            c1, c2, c3 = st.columns([1, 1, 1])
+            c1.number_input(
+                "Gemte svar",
+                min_value=1,
+                max_value=100000,
+                value=global_settings["answer_cache_size"]["value"],
+                step=100,
+                help="Hvor mange svar der gemmes for assistenter, der genbruger svar på ens spørgsmål.",
+                key=get("global_setting_keys")["answer_cache_size"],
+            )
+            c2.number_input(
+                "Levetid for gemte svar (minutter)",
+                min_value=1,
+                max_value=43200,
+                value=global_settings["answer_cache_ttl_minutes"]["value"],
+                help="Hvor længe et gemt svar genbruges.",
+                key=get("global_setting_keys")["answer_cache_ttl_minutes"],
+            )
+            c3.number_input(
+                "Lighed for genbrug af svar",
+                min_value=0.5,
+                max_value=1.0,
+                value=global_settings["answer_cache_similarity"]["value"],
+                step=0.01,
+                help="Hvor ens to spørgsmål skal være (cosinus-lighed), før svaret genbruges.",
+                key=get("global_setting_keys")["answer_cache_similarity"],
+            )
+            st.number_input(
+                "Gemte søgeresultater",
+                min_value=1,
+                max_value=1000000,
+                value=global_settings["retrieval_cache_size"]["value"],
+                step=1000,
+                help=(
+                    "Hvor mange søgninger der huskes resultater for. "
+                    "Resultaterne genbruges, indtil assistentens videnskilder ændres."
+                ),
+                key=get("global_setting_keys")["retrieval_cache_size"],
+            )
+            c1, c2 = st.columns([1, 1])
+            c1.number_input(
+                "Tjek forbindelsen til vektordatabasen (sekunder)",
+                min_value=1,
+                max_value=3600,
+                value=global_settings["chroma_health_check_seconds"]["value"],
+                help="Hvor ofte forbindelsen til Chroma-serveren tjekkes. Svarer den ikke, oprettes en ny forbindelse.",
+                key=get("global_setting_keys")["chroma_health_check_seconds"],
+            )
+            c2.number_input(
+                "Åbne samlinger i vektordatabasen",
+                min_value=1,
+                max_value=10000,
+                value=global_settings["chroma_collection_cache_size"]["value"],
+                help="Hvor mange assistenters samlinger der holdes åbne, så de ikke skal slås op ved hver besked.",
+                key=get("global_setting_keys")["chroma_collection_cache_size"],
+            )
 
             st.markdown(
                 "<br> Nedenstående indstillinger kan ændres af brugeren for hver enkelt assistent.",
@@ -269,7 +530,48 @@ def gov_home_page():
     # ------------------------
 
     with t3:
-        st.write("Kommer snart...")
+        st.markdown("__Søgeforespørgsler__")
+        stats = get_query_generation_stats()
+        c1, c2, c3, c4 = st.columns([1, 1, 1, 1])
+        c1.metric("Beskeder", stats["prompts"])
+        c2.metric("Fundet i cache", f"{stats['cache_hit_rate']:.0%}", help=f"{stats['cache_hits']} af {stats['cache_hits'] + stats['cache_misses']} opslag")
+        c3.metric("Søgt direkte", f"{stats['fast_path_rate']:.0%}", help=f"{stats['fast_path']} korte spørgsmål")
+        c4.metric("Modelkald", stats["llm_calls"])
+        st.button(
+            "Ryd gemte søgeforespørgsler",
+            help=f"{stats['cached_entries']} samtaler er gemt. Tællerne nulstilles også.",
+            on_click=clear_query_cache,
+        )
+        st.markdown("__Søgeresultater__")
+        stats = get_retrieval_cache_stats()
+        c1, c2, c3 = st.columns([1, 1, 1])
+        c1.metric("Søgninger", stats["hits"] + stats["misses"])
+        c2.metric("Fundet i cache", f"{stats['hit_rate']:.0%}", help=f"{stats['hits']} søgninger genbrugt")
+        c3.metric("Gemte søgninger", stats["cached_entries"])
+        st.button(
+            "Ryd gemte søgeresultater",
+            help="Tællerne nulstilles også.",
+            on_click=clear_retrieval_cache,
+        )
+        st.markdown("__Vektordatabase__")
+        stats = get_chroma_client_stats()
+        c1, c2, c3, c4 = st.columns([1, 1, 1, 1])
+        c1.metric("Genbrugte samlinger", f"{stats['handle_hit_rate']:.0%}", help=f"{stats['handle_hits']} af {stats['handle_hits'] + stats['handle_misses']} opslag")
+        c2.metric("Åbne samlinger", stats["cached_handles"])
+        c3.metric("Forbindelsestjek", stats["health_checks"])
+        c4.metric("Genoprettede forbindelser", stats["reconnects"])
+        st.markdown("__Genbrugte svar__")
+        stats = get_answer_cache_stats()
+        c1, c2, c3, c4 = st.columns([1, 1, 1, 1])
+        c1.metric("Opslag", stats["hits"] + stats["misses"])
+        c2.metric("Genbrugt", f"{stats['hit_rate']:.0%}", help=f"{stats['hits']} svar genbrugt")
+        c3.metric("Gemte svar", stats["cached_entries"], help=f"{stats['evictions']} fjernet pga. pladsmangel")
+        c4.metric("Ryddet ved ændrede kilder", stats["invalidations"])
+        st.button(
+            "Ryd gemte svar",
+            help="Tællerne nulstilles også.",
+            on_click=clear_answer_cache,
+        )
         # stats = [dict(r) for r in  get_user_stats()] # stats is a list of sqlite3.Row objects
         # display stats in a table
         # st.table(stats)
@@ -92,7 +92,6 @@ def go_to_chat_assistant_page(assistant: Assistant):
             {"role": "assistant", "content": assistant.welcome_message},
         ],
     )
-    set_to("number_of_sources", len(get_assistant_sources(assistant.id)))
 
 
 # UI
@@ -0,0 +1,71 @@
+""" micro-benchmark of assembling the context from retrieved chunks
+run with: python scripts/benchmark_context_merging.py
+"""
+import os
+import sys
+import timeit
+
+# ensure that the import below works when running python scripts\benchmark_context_merging.py
+if (
+    path := os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+) not in sys.path:
+    sys.path.append(path)
+from src.query_chain import merge_overlapping_strings, merge_multiple_strings, stitch_chunks
+from src.chunking import iter_chunks
+from src.basic_data_classes import RetrievalResult
+
+
+def quadratic_merge(strings: list):
+    """the word by word merge used before, for comparison"""
+    str1, str2 = strings
+    str1_words = str1.split(" ")
+    str2_words = str2.split(" ")[1:]
+    overlap = []
+    for i in range(max(len(str1_words) - 4, 0)):
+        if str1_words[i:] == str2_words[: len(str1_words[i:])]:
+            overlap = str1_words[i:]
+            break
+    if overlap:
+        return " ".join(str1_words + str2_words[len(overlap) :])
+    return None
+
+
+def make_text(n_sentences: int) -> str:
+    return " ".join(
+        f"Sætning {i} beskriver trin {i % 17} i vejledningen om jazzens historie."
+        for i in range(n_sentences)
+    )
+
+
+def legacy_chunks(chunks: list) -> list:
+    """chunks with chained_content as indexed by older versions: the chunk, the next two
+    and the previous chunk without its last 200 characters"""
+    legacy = []
+    for i, chunk in enumerate(chunks):
+        chained = " ".join(c.page_content for c in chunks[i : i + 3])
+        if i > 0:
+            chained = " ".join(["...", chunks[i - 1].page_content[:-200], chained])
+        metadata = {**chunk.metadata, "chained_content": chained}
+        legacy.append(RetrievalResult.from_chunk(chunk.page_content, metadata))
+    return legacy
+
+
+def report(name: str, statement, number: int):
+    seconds = min(timeit.repeat(statement, number=number, repeat=5)) / number
+    print(f"  {name:<40} {seconds * 1e6:>10.1f} µs")
+
+
+if __name__ == "__main__":
+    text = make_text(3000)
+    for chunk_size in (400, 1000, 2000):
+        chunks = list(iter_chunks(text, "source1", "bench.txt", chunk_size=chunk_size))
+        legacy = legacy_chunks(chunks)
+        # a run of 8 adjacent hits, as retrieved with several queries
+        hits = legacy[20:28]
+        pair = [legacy[20].chained_content, legacy[21].chained_content]
+        print(f"chunk size {chunk_size} ({len(chunks)} chunks, pair of {len(pair[0].split())} words)")
+        report("pair: quadratic word merge", lambda: quadratic_merge(pair), 200)
+        report("pair: kmp word merge", lambda: merge_overlapping_strings(pair), 200)
+        report("8 legacy hits: merge_multiple_strings", lambda: merge_multiple_strings(hits), 50)
+        results = [RetrievalResult.from_chunk(c.page_content, c.metadata) for c in chunks]
+        report("8 hits: stitch_chunks by offsets", lambda: stitch_chunks(results[20:28]), 2000)
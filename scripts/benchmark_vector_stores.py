@@ -0,0 +1,101 @@
+""" benchmark of the vector store backends: indexing and query latency, size on disk and memory
+each backend runs in its own process, so the peak memory of one is not reported for the other
+run with: python scripts/benchmark_vector_stores.py
+"""
+import os
+import sys
+import time
+import multiprocessing
+import tempfile
+import shutil
+from pathlib import Path
+import numpy as np
+
+# ensure that the import below works when running python scripts\benchmark_vector_stores.py
+if (
+    path := os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+) not in sys.path:
+    sys.path.append(path)
+import src.chroma_utils as chroma_utils
+from src.chroma_utils import ChromaVectorStore
+from src.vector_stores import HnswVectorStore
+from src.basic_data_classes import ChunkMetadata
+import chromadb
+from chromadb.config import Settings
+
+try:
+    import resource  # peak memory, not available on windows
+except ImportError:
+    resource = None
+
+DIM = 768  # intfloat/multilingual-e5-base
+BATCH = 100  # index_source adds chunks in batches of 100
+
+
+def chunks(n: int, rng):
+    embeddings = rng.standard_normal((n, DIM)).astype(np.float32)
+    metadatas = [
+        ChunkMetadata(
+            source_id=f"source{i // 500}", name=f"source{i // 500}.txt", chunk_id=i % 500, content_hash=str(i)
+        ).model_dump()
+        for i in range(n)
+    ]
+    return [str(i) for i in range(n)], embeddings, [f"chunk {i}" for i in range(n)], metadatas
+
+
+def directory_size(directory: Path) -> int:
+    return sum(f.stat().st_size for f in Path(directory).rglob("*") if f.is_file())
+
+
+def peak_memory_mb() -> float:
+    if resource is None:
+        return float("nan")
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def benchmark(name: str, store, directory: str, n: int, rng):
+    ids, embeddings, documents, metadatas = chunks(n, rng)
+    started = time.perf_counter()
+    for i in range(0, n, BATCH):
+        store.add(ids[i : i + BATCH], embeddings[i : i + BATCH].tolist(), documents[i : i + BATCH], metadatas[i : i + BATCH])
+    store.flush()
+    indexing = time.perf_counter() - started
+    queries = rng.standard_normal((50, DIM)).astype(np.float32).tolist()
+    started = time.perf_counter()
+    for query in queries:
+        store.query([query], k=4)
+    query = (time.perf_counter() - started) / len(queries)
+    started = time.perf_counter()
+    for i in range(50):
+        store.get(source_id=f"source{i % (n // 500)}", chunk_ranges=[(10, 12)])
+    neighbors = (time.perf_counter() - started) / 50
+    print(
+        f"  {name:<20} index {indexing:>7.2f} s   query {query * 1e3:>7.2f} ms   "
+        f"neighbors {neighbors * 1e3:>6.2f} ms   disk {directory_size(directory) / 2**20:>7.1f} MB   "
+        f"peak rss {peak_memory_mb():>7.0f} MB"
+    )
+
+
+def run_backend(backend: str, n: int):
+    """benchmark one backend, called in a new process"""
+    directory = tempfile.mkdtemp()
+    if backend == "chroma":
+        client = chromadb.PersistentClient(path=directory, settings=Settings(anonymized_telemetry=False))
+        chroma_utils.start_chroma_client = lambda: client
+        chroma_utils.get_embedding_function = lambda: None
+        chroma_utils.get_global_setting_value = lambda setting_id: 100
+        name, store = "chroma (persistent)", ChromaVectorStore(f"benchmark{n}")
+    else:
+        name, store = "hnswlib", HnswVectorStore(directory)
+    benchmark(name, store, directory, n, np.random.default_rng(1))
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    context = multiprocessing.get_context("spawn")
+    for n in (5000, 20000):
+        print(f"{n} chunks of {DIM} dimensions", flush=True)
+        for backend in ("chroma", "hnswlib"):
+            process = context.Process(target=run_backend, args=(backend, n))
+            process.start()
+            process.join()
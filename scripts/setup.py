@@ -15,6 +15,7 @@ from src.sqlite.db_creation import (
     reset_table_for_dataclass,
     execute_query,
 )
+from src.sqlite.gov_db_utils import add_missing_global_settings
 from src.logging_config import configure_logging
 
 
@@ -42,6 +43,7 @@ def populate_global_settings():
             id=k, value=str(v), default_value=str(v), type=type(v).__name__
         )
         insert_row(global_setting)
+    add_missing_global_settings()
 
 
 def create_views():
@@ -67,6 +69,10 @@ def set_env_variables():
     temp_file_location = data_directory / "temp_files"
     chromadb_host = "localhost"
     chromadb_port = 8051
+    # http runs chroma as a separate server, persistent runs it inside the app process
+    chromadb_mode = "http"
+    # chroma stores the chunks in chroma, hnswlib in a local index per assistant
+    vector_store_backend = "chroma"
     chromadb_telemetry = False
 
     # set the environment variables to .env file
@@ -108,6 +114,16 @@ def set_env_variables():
         key_to_set="CHROMADB_PORT",
         value_to_set=str(chromadb_port),
     )
+    de.set_key(
+        dotenv_path=env_path,
+        key_to_set="CHROMADB_MODE",
+        value_to_set=chromadb_mode,
+    )
+    de.set_key(
+        dotenv_path=env_path,
+        key_to_set="VECTOR_STORE_BACKEND",
+        value_to_set=vector_store_backend,
+    )
     de.set_key(
         dotenv_path=env_path,
         key_to_set="ANONYMIZED_TELEMETRY",
@@ -0,0 +1,122 @@
+""" semantic cache of answers to the first question of a conversation with an assistant"""
+from src.embedding_registry import get_embedding_function
+from src.sqlite.gov_db_utils import get_global_setting, get_global_setting_value
+from collections import OrderedDict
+from functools import lru_cache
+import numpy as np
+import threading
+import itertools
+import time
+import logging
+
+"""
+many users of a shared assistant open with near-identical questions.
+for assistants with answer_cache enabled, the answer to the first question of a conversation
+is stored with the embedding of the question and returned for later questions whose
+embedding is at least answer_cache_similarity similar (cosine).
+entries are keyed by assistant id and the version of the assistant's source set, the version
+is bumped by invalidate_answer_cache when a source is added or deleted or the assistant
+is edited, so answers built on other sources or settings are never returned. entries expire after answer_cache_ttl_minutes and the
+least recently used entries are evicted over answer_cache_size
+"""
+
+# entry id -> {"assistant_id", "version", "embedding", "answer", "time"}, least recently used first
+_entries = OrderedDict()
+# assistant id -> version of its source set
+_versions = {}
+# guards _entries, _versions and _stats
+_cache_lock = threading.Lock()
+_entry_ids = itertools.count()
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0}
+
+
+@lru_cache(maxsize=256)
+def _embed_question(model_name: str, question: str) -> np.ndarray:
+    """the normalized embedding of a question, cached so lookup and store embed once"""
+    embedding = np.asarray(get_embedding_function(model_name).embed_query(question), dtype=float)
+    return embedding / (np.linalg.norm(embedding) or 1.0)
+
+
+def embed_question(question: str) -> np.ndarray:
+    return _embed_question(get_global_setting("embeddings_model").value, question.strip())
+
+
+def get_source_set_version(assistant_id: str) -> int:
+    """the version of an assistant's sources, taken before answering and passed to store_answer"""
+    with _cache_lock:
+        return _versions.get(assistant_id, 0)
+
+
+def invalidate_answer_cache(assistant_id: str):
+    """forget the answers of an assistant, called when it or its sources change"""
+    with _cache_lock:
+        _versions[assistant_id] = _versions.get(assistant_id, 0) + 1
+        for entry_id in [i for i, e in _entries.items() if e["assistant_id"] == assistant_id]:
+            del _entries[entry_id]
+        _stats["invalidations"] += 1
+    logging.info(f"answer cache of assistant {assistant_id} invalidated")
+
+
+def lookup_answer(assistant_id: str, question: str) -> str | None:
+    """the stored answer to the most similar question asked to the assistant, None if no
+    stored question is similar enough. counts hits and misses"""
+    embedding = embed_question(question)
+    ttl = get_global_setting_value("answer_cache_ttl_minutes") * 60
+    threshold = get_global_setting_value("answer_cache_similarity")
+    now = time.monotonic()
+    with _cache_lock:
+        version = _versions.get(assistant_id, 0)
+        for entry_id in [i for i, e in _entries.items() if now - e["time"] > ttl]:
+            del _entries[entry_id]
+        candidates = [
+            (i, e)
+            for i, e in _entries.items()
+            if e["assistant_id"] == assistant_id and e["version"] == version
+        ]
+        if candidates:
+            similarities = np.stack([e["embedding"] for _, e in candidates]) @ embedding
+            best = int(np.argmax(similarities))
+            if similarities[best] >= threshold:
+                entry_id, entry = candidates[best]
+                _entries.move_to_end(entry_id)
+                _stats["hits"] += 1
+                return entry["answer"]
+        _stats["misses"] += 1
+        return None
+
+
+def store_answer(assistant_id: str, question: str, answer: str, version: int):
+    """store the answer to a question, unless the sources changed since version was taken"""
+    embedding = embed_question(question)
+    size = get_global_setting_value("answer_cache_size")
+    with _cache_lock:
+        if _versions.get(assistant_id, 0) != version:
+            return
+        _entries[next(_entry_ids)] = {
+            "assistant_id": assistant_id,
+            "version": version,
+            "embedding": embedding,
+            "answer": answer,
+            "time": time.monotonic(),
+        }
+        _stats["stores"] += 1
+        while len(_entries) > size:
+            _entries.popitem(last=False)
+            _stats["evictions"] += 1
+
+
+def get_answer_cache_stats() -> dict:
+    """counters of the answer cache since start, with the hit rate"""
+    with _cache_lock:
+        stats = dict(_stats, cached_entries=len(_entries))
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    return stats
+
+
+def clear_answer_cache():
+    """empty the answer cache and reset the counters"""
+    with _cache_lock:
+        _entries.clear()
+        for event in _stats:
+            _stats[event] = 0
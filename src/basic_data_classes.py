@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, field_validator, EmailStr
-from typing import Literal
+from typing import Literal, Optional
 from datetime import datetime
 from uuid import uuid4
 
@@ -44,9 +44,12 @@ class LLM(BaseModel, validate_assignment=True):
     enpoint_or_base_url: str
     api_key: str = "not-needed"
     description: str = ""
-    is_active: bool = True
+    # indexed for get_active_llms
+    is_active: bool = Field(default=True, json_schema_extra={"index": True})
     created_at: datetime = Field(default_factory=datetime.now)
     updated_at: datetime = Field(default_factory=datetime.now)
+    # max number of tokens of retrieved text sent to the model with a question
+    context_token_budget: int = Field(ge=100, default=3000)
 
 
 # input to source
@@ -59,7 +62,75 @@ class Source(BaseModel, validate_assignment=True):
     creation_time: datetime = Field(default_factory=datetime.now)
     content_type: Literal["txt", "pdf", "csv", "docx", "doc", "md", "url"] = "txt"
     content: str = Field(min_length=1, max_length=500000)
-    collection_name_and_assistant_id: str = Field(min_length=1, max_length=100)
+    collection_name_and_assistant_id: str = Field(
+        min_length=1, max_length=100, json_schema_extra={"index": True}
+    )
+    # validators sent by the server of a url source, to re-fetch it only if it changed
+    etag: str = ""
+    last_modified: str = ""
+    # hash of the full content and when a url source was last fetched, for scheduled refreshes
+    content_hash: str = ""
+    last_fetched: datetime = Field(default_factory=datetime.now)
+
+
+class SourceSummary(BaseModel):
+    """data class for listing sources without loading their content, read from the sources table"""
+
+    id: str
+    name: str
+    source_type: Literal["url", "file path", "uploaded file"]
+    creation_time: datetime
+    collection_name_and_assistant_id: str
+    last_fetched: datetime
+
+
+class ChunkMetadata(BaseModel):
+    """metadata stored with each chunk in a collection,
+    the chunk refers to its source by id, the full text is only stored in the sources table"""
+
+    source_id: str
+    name: str
+    chunk_id: int
+    # position of the chunk in the source content, -1 if unknown
+    start: int = -1
+    end: int = -1
+    content_hash: str
+    # the chunk joined with its neighbors, only set for chunks indexed by older versions
+    chained_content: str = ""
+
+
+class RetrievalResult(BaseModel):
+    """a chunk retrieved from a collection,
+    chunk ids are only unique within a source, so a result is identified by (source_id, chunk_id)"""
+
+    source_id: str
+    name: str = ""
+    chunk_id: int
+    text: str
+    start: int = -1
+    end: int = -1
+    chained_content: str = ""
+    # distance to the closest query, lower is more similar, None for added neighbors
+    score: Optional[float] = None
+
+    @property
+    def key(self) -> tuple:
+        return (self.source_id, self.chunk_id)
+
+    @classmethod
+    def from_chunk(cls, text: str, metadata: dict, score: float = None):
+        """make a result from the text and metadata of a chunk in a collection"""
+        return cls(
+            # chunks that are not migrated yet refer to their source by id
+            source_id=metadata.get("source_id", metadata.get("id", "")),
+            name=metadata.get("name", ""),
+            chunk_id=metadata["chunk_id"],
+            text=text,
+            start=metadata.get("start", -1),
+            end=metadata.get("end", -1),
+            chained_content=metadata.get("chained_content", ""),
+            score=score,
+        )
 
 
 # each assistant has one owner indicated in the owner_id field
@@ -78,5 +149,44 @@ class Assistant(BaseModel):
     welcome_message: str = ""
     creation_time: datetime = datetime.now()
     last_updated: datetime = datetime.now()
-    owner_id: str = Field(min_length=1, max_length=30)
+    owner_id: str = Field(
+        min_length=1, max_length=30, json_schema_extra={"index": True}
+    )
     is_active: bool = True
+    # hours between refreshes of the assistant's url sources, 0 means never
+    url_refresh_hours: int = Field(ge=0, default=0)
+    # number of neighboring chunks before and after each retrieved chunk added to the context
+    neighbor_window: int = Field(ge=0, le=5, default=1)
+    # reuse the answer to a similar first question in a conversation (see answer_cache)
+    answer_cache: bool = False
+
+
+class IngestionJob(BaseModel, validate_assignment=True):
+    """data class for a background job indexing a source into an assistant's collection"""
+
+    id: str = Field(default_factory=lambda: uuid4().hex)
+    source_id: str
+    source_name: str
+    assistant_id: str = Field(json_schema_extra={"index": True})
+    status: Literal["queued", "running", "done", "failed"] = Field(
+        default="queued", json_schema_extra={"index": True}
+    )
+    chunks_done: int = 0
+    chunks_total: int = 0
+    attempts: int = 0
+    error: str = ""
+    # the source to index as json, cleared when the job is done
+    source_json: str = ""
+    # the source the new one replaces, deleted once the new one is indexed
+    replaces_source_id: str = ""
+    created_at: datetime = Field(default_factory=datetime.now)
+    updated_at: datetime = Field(default_factory=datetime.now)
+
+
+class CollectionVersion(BaseModel, validate_assignment=True):
+    """data class counting the changes to an assistant's collection, used to invalidate cached retrievals"""
+
+    # the collection name, which is the assistant id
+    id: str
+    version: int = 0
+    updated_at: datetime = Field(default_factory=datetime.now)
@@ -1,18 +1,10 @@
 """ utility functions for indexing and retrieval of documents using chroma"""
-from langchain_community.embeddings import SentenceTransformerEmbeddings
 from langchain.vectorstores.chroma import Chroma
 import chromadb
 import os
 import subprocess
 import requests
-from langchain_community.document_loaders import (
-    UnstructuredFileLoader,
-    WebBaseLoader,
-)
 from langchain_core.documents import Document
-from langchain.text_splitter import (
-    RecursiveCharacterTextSplitter,
-)
 import streamlit as st  # for caching
 from pydantic import BaseModel, ConfigDict
 from pydantic.types import FilePath  # , Literal
@@ -21,12 +13,28 @@ from pathlib import WindowsPath
 from typing import Union
 from pydantic_core import Url
 from streamlit.runtime.uploaded_file_manager import UploadedFile
-from uuid import uuid4
-from src.basic_data_classes import Source
+from uuid import uuid4, uuid5, NAMESPACE_URL
+from src.basic_data_classes import Source, ChunkMetadata, RetrievalResult
+from src.sqlite.queries import select_one, insert
 from pathlib import Path
 import dotenv as de
-from src.sqlite.gov_db_utils import get_global_setting
+from src.embedding_registry import get_embedding_function
+from src.document_loading import load_file_source, load_sources, content_hash
+from src.chunking import iter_chunks, estimate_chunk_count, SEPARATORS
+from src.url_fetching import load_url_sources
+from src.sqlite.gov_db_utils import get_global_setting_value
+from src.vector_stores import VectorStore, HnswVectorStore
+from src.retrieval_cache import (
+    get_collection_version,
+    bump_collection_version,
+    get_cached_hits,
+    cache_hits,
+)
 from chromadb.config import Settings
+from itertools import islice
+from collections import OrderedDict
+import threading
+import time
 import logging
 # ---------------------------
 
@@ -44,8 +52,31 @@ env_path = Path(".") / ".env"
 de.load_dotenv(dotenv_path=env_path)
 temp_file_location = os.getenv("TEMP_FILE_LOCATION")
 chromadb_host = os.getenv("CHROMADB_HOST")
-chromadb_port = int(os.getenv("CHROMADB_PORT"))
+chromadb_port = int(os.getenv("CHROMADB_PORT", "8051"))
 vector_db_location = os.getenv("VECTOR_DB_LOCATION")
+# http: a chroma server started by start_chroma_server, persistent: chroma runs in this process
+chromadb_mode = os.getenv("CHROMADB_MODE", "http").lower()
+if chromadb_mode not in ("http", "persistent"):
+    raise ValueError(f"CHROMADB_MODE must be http or persistent, not {chromadb_mode}")
+# chroma: chunks are stored in chroma, hnswlib: in a local HnswVectorStore per assistant
+vector_store_backend = os.getenv("VECTOR_STORE_BACKEND", "chroma").lower()
+if vector_store_backend not in ("chroma", "hnswlib"):
+    raise ValueError(f"VECTOR_STORE_BACKEND must be chroma or hnswlib, not {vector_store_backend}")
+
+_persistent_client = None
+_persistent_client_lock = threading.Lock()
+# the http client is created once, its connection is checked at most every
+# chroma_health_check_seconds (global setting) and it is replaced when the check fails
+_http_client = None
+_http_client_checked_at = 0.0
+_http_client_lock = threading.Lock()
+# collection name -> (embedding function, langchain collection), least recently used first
+_collection_handles = OrderedDict()
+_collection_handles_lock = threading.Lock()
+_client_stats = {"health_checks": 0, "reconnects": 0, "handle_hits": 0, "handle_misses": 0}
+# collection name -> open HnswVectorStore
+_hnsw_stores = {}
+_hnsw_stores_lock = threading.Lock()
 
 # ----------------------------
 # chroma client operations
@@ -53,7 +84,14 @@ vector_db_location = os.getenv("VECTOR_DB_LOCATION")
 
 @st.cache_resource(show_spinner=False)
 def start_chroma_server():
-    """start chroma http server if it's not already running"""
+    """start chroma http server if it's not already running
+    in persistent mode and with the hnswlib backend there is no server to start"""
+    if vector_store_backend == "hnswlib":
+        logging.info("chunks are stored in local hnswlib indexes, chroma is not started")
+        return
+    if chromadb_mode == "persistent":
+        logging.info(f"chroma runs in process with the data in {vector_db_location}")
+        return
     # run command chroma run --path data/db --port 8000
     db_path = vector_db_location
     port = str(chromadb_port)
@@ -73,13 +111,66 @@ def start_chroma_server():
     return p
 
 
+def get_persistent_client():
+    """the in-process chroma client of the vector database, shared by all sessions"""
+    global _persistent_client
+    with _persistent_client_lock:
+        if _persistent_client is None:
+            _persistent_client = chromadb.PersistentClient(
+                path=vector_db_location,
+                settings=Settings(anonymized_telemetry=False),
+            )
+        return _persistent_client
+
+
 def start_chroma_client():
-    client = chromadb.HttpClient(
-        host=chromadb_host,
-        port=chromadb_port,
-        settings=Settings(anonymized_telemetry=False),
-    )
-    return client
+    """the shared chroma client for the mode set in CHROMADB_MODE
+    the http client is reconnected when its periodic health check fails"""
+    global _http_client, _http_client_checked_at
+    if chromadb_mode == "persistent":
+        return get_persistent_client()
+    interval = get_global_setting_value("chroma_health_check_seconds")
+    with _http_client_lock:
+        now = time.monotonic()
+        if _http_client is not None and now - _http_client_checked_at < interval:
+            return _http_client
+        if _http_client is not None:
+            _client_stats["health_checks"] += 1
+            try:
+                _http_client.heartbeat()
+                _http_client_checked_at = now
+                return _http_client
+            except Exception as e:
+                logging.warning(f"chroma server not reachable, reconnecting: {e}")
+                _client_stats["reconnects"] += 1
+                # handles of the old client are not reused
+                clear_collection_handles()
+        # creating the client checks that the server is reachable
+        _http_client = chromadb.HttpClient(
+            host=chromadb_host,
+            port=chromadb_port,
+            settings=Settings(anonymized_telemetry=False),
+        )
+        _http_client_checked_at = now
+        return _http_client
+
+
+def clear_collection_handles(collection_name: str = None):
+    """forget the cached handle of a collection, or of all collections"""
+    with _collection_handles_lock:
+        if collection_name is None:
+            _collection_handles.clear()
+        else:
+            _collection_handles.pop(collection_name, None)
+
+
+def get_chroma_client_stats() -> dict:
+    """counters of the shared chroma client and the collection handle cache since start"""
+    with _collection_handles_lock:
+        stats = dict(_client_stats, cached_handles=len(_collection_handles))
+    lookups = stats["handle_hits"] + stats["handle_misses"]
+    stats["handle_hit_rate"] = stats["handle_hits"] / lookups if lookups else 0.0
+    return stats
 
 def stop_chroma_server(p):
     """stop chroma http server"""
@@ -93,23 +184,49 @@ def stop_chroma_server(p):
 # a collection contain zero or more chunks of text from sources
 
 
+def get_chroma_collection(collection_name):
+    """get or create the chromadb collection with the given name
+    handles are cached for the chroma_collection_cache_size (global setting) most recently
+    used collections. they hold no embedding function, chunks and queries are embedded
+    by the caller, so a cached handle never keeps an evicted embeddings model in memory"""
+    with _collection_handles_lock:
+        cached = _collection_handles.get(collection_name)
+        if cached is not None:
+            _collection_handles.move_to_end(collection_name)
+            _client_stats["handle_hits"] += 1
+            return cached
+        _client_stats["handle_misses"] += 1
+    client = start_chroma_client()
+    collection = client.get_or_create_collection(name=collection_name, embedding_function=None)
+    size = get_global_setting_value("chroma_collection_cache_size")
+    with _collection_handles_lock:
+        _collection_handles[collection_name] = collection
+        _collection_handles.move_to_end(collection_name)
+        while len(_collection_handles) > size:
+            _collection_handles.popitem(last=False)
+    return collection
+
+
 def get_or_create_collection(collection_name):
-    """create a collection with the given name and client"""
-    # create a collection
+    """create a langchain collection with the given name and client,
+    using the current embeddings model"""
     client = start_chroma_client()
-    emb_model_name = get_global_setting("embeddings_model").value
-    embedding_function = SentenceTransformerEmbeddings(model_name=emb_model_name)
-    print(f"embeddings model {emb_model_name} loaded")
     collection = Chroma(
         collection_name=collection_name,
         client=client,
-        embedding_function=embedding_function,
+        embedding_function=get_embedding_function(),
     )
     return collection
 
 
 def get_collection(collection_name):
-    """get a collection with the given name and client"""
+    """get a collection with the given name and client, raises if it does not exist"""
+    with _collection_handles_lock:
+        cached = _collection_handles.get(collection_name)
+        if cached is not None:
+            _collection_handles.move_to_end(collection_name)
+            _client_stats["handle_hits"] += 1
+            return cached
     client = start_chroma_client()
     collection = client.get_collection(name=collection_name)
     return collection
@@ -117,9 +234,83 @@ def get_collection(collection_name):
 
 def delete_collection(collection_name):
     """delete a collection with the given name and client"""
-    # create a collection
-    client = start_chroma_client()
-    client.delete_collection(name=collection_name)
+    if vector_store_backend == "hnswlib":
+        with _hnsw_stores_lock:
+            store = _hnsw_stores.pop(collection_name, None) or _open_hnsw_store(collection_name)
+        store.drop()
+    else:
+        client = start_chroma_client()
+        clear_collection_handles(collection_name)
+        client.delete_collection(name=collection_name)
+    bump_collection_version(collection_name)
+
+
+class ChromaVectorStore(VectorStore):
+    """the chunks of a chroma collection, through the cached collection handle"""
+
+    def __init__(self, collection_name: str):
+        self.collection_name = collection_name
+        # like an hnswlib store, the collection exists once its store is opened
+        get_chroma_collection(collection_name)
+
+    @property
+    def _collection(self):
+        return get_chroma_collection(self.collection_name)
+
+    def add(self, ids: list, embeddings: list, documents: list, metadatas: list):
+        self._collection.add(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def update_metadatas(self, ids: list, metadatas: list):
+        self._collection.update(ids=ids, metadatas=metadatas)
+
+    def get(self, source_id: str = None, name: str = None, chunk_ranges: list = None) -> dict:
+        filters = []
+        if source_id is not None:
+            filters.append({"source_id": source_id})
+        if name is not None:
+            filters.append({"name": name})
+        if chunk_ranges:
+            range_filters = [
+                {"$and": [{"chunk_id": {"$gte": first}}, {"chunk_id": {"$lte": last}}]}
+                for first, last in chunk_ranges
+            ]
+            filters.append(range_filters[0] if len(range_filters) == 1 else {"$or": range_filters})
+        where = None
+        if filters:
+            where = filters[0] if len(filters) == 1 else {"$and": filters}
+        response = self._collection.get(where=where, include=["documents", "metadatas"])
+        return {key: response[key] for key in ("ids", "documents", "metadatas")}
+
+    def delete(self, ids: list):
+        self._collection.delete(ids=ids)
+
+    def query(self, query_embeddings: list, k: int) -> dict:
+        response = self._collection.query(
+            query_embeddings=query_embeddings,
+            n_results=k,
+            include=["documents", "metadatas", "distances"],
+        )
+        return {key: response[key] for key in ("ids", "documents", "metadatas", "distances")}
+
+    def count(self) -> int:
+        return self._collection.count()
+
+    def drop(self):
+        delete_collection(self.collection_name)
+
+
+def _open_hnsw_store(collection_name: str) -> HnswVectorStore:
+    return HnswVectorStore(Path(vector_db_location) / "hnswlib" / collection_name)
+
+
+def get_vector_store(collection_name: str) -> VectorStore:
+    """the vector store of a collection for the backend set in VECTOR_STORE_BACKEND"""
+    if vector_store_backend == "chroma":
+        return ChromaVectorStore(collection_name)
+    with _hnsw_stores_lock:
+        if collection_name not in _hnsw_stores:
+            _hnsw_stores[collection_name] = _open_hnsw_store(collection_name)
+        return _hnsw_stores[collection_name]
 
 
 def delete_all_collections():
@@ -132,10 +323,93 @@ def delete_all_collections():
         f"Are you sure you want to delete {len(collections)} collections? (y/n)"
     )
     if response == "y":
+        clear_collection_handles()
         for collection in collections:
             client.delete_collection(name=collection.name)
 
 
+_chunks_migrated = False
+
+
+def _migrate_chunk(text: str, metadata: dict) -> dict:
+    """convert the metadata of a chunk indexed by an older version to ChunkMetadata"""
+    start, end = metadata.get("start", -1), metadata.get("end", -1)
+    if start == -1 and "content" in metadata:
+        start = metadata["content"].find(text)
+        end = start + len(text) if start != -1 else -1
+    return ChunkMetadata(
+        source_id=metadata["id"],
+        name=metadata["name"],
+        chunk_id=metadata["chunk_id"],
+        start=start,
+        end=end,
+        content_hash=metadata.get("content_hash") or content_hash(text),
+        chained_content=metadata.get("chained_content", ""),
+    ).model_dump()
+
+
+def _restore_source_content(metadata: dict, restored: set):
+    """older versions only kept the first 500 characters of a source in the sources table,
+    the full content is taken from the chunk metadata that is being migrated"""
+    if "content" not in metadata or metadata["id"] in restored:
+        return
+    restored.add(metadata["id"])
+    source = select_one(Source, metadata["id"])
+    if source is not None and len(source.content) < len(metadata["content"]):
+        source.content = metadata["content"]
+        source.content_hash = content_hash(source.content)
+        insert(source, operation="replace")
+
+
+def _migrated_chunk_id(id: str) -> str:
+    """the id of the migrated copy of a chunk, the same on every run"""
+    return str(uuid5(NAMESPACE_URL, f"migrated-chunk:{id}"))
+
+
+def migrate_chunk_metadata(batch_size: int = 100):
+    """
+    rewrite the chunks indexed by older versions, which stored the whole source
+    with its content in the metadata of every chunk, to the compact ChunkMetadata.
+    the chunks keep their embeddings and get new ids. Chunks of older versions are found by
+    their "id" key, so this does nothing once all collections are migrated
+    """
+    global _chunks_migrated
+    if vector_store_backend == "hnswlib":
+        # hnswlib stores were never written with the old metadata
+        return
+    if _chunks_migrated:
+        return
+    client = start_chroma_client()
+    restored = set()
+    for collection in client.list_collections():
+        migrated = 0
+        while True:
+            ids = collection.get(where={"id": {"$ne": ""}}, limit=batch_size, include=[])["ids"]
+            if len(ids) == 0:
+                break
+            old = collection.get(ids=ids, include=["embeddings", "documents", "metadatas"])
+            metadatas = []
+            for text, metadata in zip(old["documents"], old["metadatas"]):
+                _restore_source_content(metadata, restored)
+                metadatas.append(_migrate_chunk(text, metadata))
+            # updating would keep the old keys, so the chunks are added again under new ids
+            # derived from the old ones and the old chunks are only deleted afterwards.
+            # an interrupted migration leaves both, and the next run writes the same copies again
+            collection.upsert(
+                ids=[_migrated_chunk_id(id) for id in old["ids"]],
+                embeddings=old["embeddings"],
+                documents=old["documents"],
+                metadatas=metadatas,
+            )
+            collection.delete(ids=old["ids"])
+            migrated += len(ids)
+        if migrated > 0:
+            # cached results refer to the old chunk ids
+            bump_collection_version(collection.name)
+            logging.info(f"migrated the metadata of {migrated} chunks in {collection.name}")
+    _chunks_migrated = True
+
+
 def get_or_create_retriever(
     collection_name: str,
     k: int = 6,
@@ -149,6 +423,102 @@ def get_or_create_retriever(
     return retriever
 
 
+def query_collection(collection_name: str, queries: list, k: int = 4):
+    """
+    search the named collection for several queries at once
+    the queries are embedded in one batch and sent in a single query call,
+    duplicate queries (ignoring case and whitespace) are embedded and searched once
+    and queries searched before in the unchanged collection are taken from the retrieval cache
+    returns the hits for each query and a merged ranking of all unique hits,
+    hits are (document, distance) tuples where a lower distance is more similar
+    """
+    if len(queries) == 0:
+        return [], []
+    # map each normalized query to the first query it was written as
+    unique_queries = {}
+    for query in queries:
+        unique_queries.setdefault(" ".join(query.lower().split()), query)
+    version = get_collection_version(collection_name)
+    # normalized query -> [(id, text, metadata, distance)]
+    raw_hits_by_query = {}
+    for normalized_query in unique_queries:
+        cached = get_cached_hits(collection_name, version, k, normalized_query)
+        if cached is not None:
+            raw_hits_by_query[normalized_query] = cached
+    missing_queries = [q for q in unique_queries if q not in raw_hits_by_query]
+    if missing_queries:
+        query_embeddings = get_embedding_function().embed_documents(
+            [unique_queries[q] for q in missing_queries]
+        )
+        response = get_vector_store(collection_name).query(query_embeddings, k=k)
+        for i, normalized_query in enumerate(missing_queries):
+            raw_hits = list(
+                zip(
+                    response["ids"][i],
+                    response["documents"][i],
+                    response["metadatas"][i],
+                    response["distances"][i],
+                )
+            )
+            raw_hits_by_query[normalized_query] = raw_hits
+            cache_hits(collection_name, version, k, normalized_query, raw_hits)
+    hits_by_query = {}
+    best_hits = {}
+    for normalized_query, raw_hits in raw_hits_by_query.items():
+        hits = []
+        for id, text, metadata, distance in raw_hits:
+            # new documents, so the cached hits are not changed by the caller
+            hit = (Document(page_content=text, metadata=dict(metadata)), distance)
+            hits.append(hit)
+            # keep the closest hit for each chunk across all queries
+            if id not in best_hits or distance < best_hits[id][1]:
+                best_hits[id] = hit
+        hits_by_query[normalized_query] = hits
+    per_query_hits = [hits_by_query[" ".join(q.lower().split())] for q in queries]
+    merged_hits = sorted(best_hits.values(), key=lambda hit: hit[1])
+    return per_query_hits, merged_hits
+
+
+def _merge_ranges(ranges: list) -> list:
+    """merge overlapping or adjacent (first, last) ranges"""
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def get_neighbor_chunks(collection_name: str, results: list, window: int = 1) -> list:
+    """
+    expand retrieval results with the chunks up to window chunk ids before and after them
+    in the same source, with one lookup by chunk id range per source.
+    returns the results and their neighbors once each, ordered by source and chunk id
+    """
+    if window == 0 or len(results) == 0:
+        return sorted(results, key=lambda result: result.key)
+    scores = {result.key: result.score for result in results}
+    ranges_by_source = {}
+    for result in results:
+        ranges_by_source.setdefault(result.source_id, []).append(
+            (max(result.chunk_id - window, 0), result.chunk_id + window)
+        )
+    store = get_vector_store(collection_name)
+    expanded = []
+    for source_id, ranges in ranges_by_source.items():
+        response = store.get(source_id=source_id, chunk_ranges=_merge_ranges(ranges))
+        neighbors = [
+            RetrievalResult.from_chunk(text, metadata)
+            for text, metadata in zip(response["documents"], response["metadatas"])
+        ]
+        # the retrieved chunks keep their score
+        for neighbor in neighbors:
+            neighbor.score = scores.get(neighbor.key)
+        expanded += neighbors
+    return sorted(expanded, key=lambda result: result.key)
+
+
 def format_docs(docs):
     "takes a list of documents and returns a string of the page content of each document."
     return "\n\n---------".join(doc.metadata["chained_content"] for doc in docs)
@@ -180,64 +550,93 @@ class Input(BaseModel):
     input: Union[UploadedFile, AnyHttpUrl, FilePath]
 
 
-# this function takes an input and return a source object.
-def create_source(input, c_a_id: str) -> Source:
+def _save_uploaded_file(input: UploadedFile) -> str:
+    """save an uploaded file to the temp directory so it can be loaded from disk"""
+    path_url = os.path.join(temp_file_location, uuid4().hex + input.name)
+    with open(path_url, "wb") as f:
+        f.write(input.getvalue())
+        f.close()
+    return path_url
+
+
+def _loading_task(input, c_a_id: str):
     """
-    input: a url, file path or streamlit fileuploader file
-    c_a_id: a collection and assistant id
-    returns an in memmory source object
+    validate a file input and return the (name, function, args) to load it
+    and the temp file to delete afterwards
     """
     validated_input = Input(input=input).input
 
     if isinstance(validated_input, UploadedFile):
         # save the file to temp directory data/temp
-        path_url = os.path.join(temp_file_location, uuid4().hex + input.name)
-        with open(path_url, "wb") as f:
-            f.write(input.getvalue())
-            f.close()
-        loader = UnstructuredFileLoader(path_url, encoding="utf-8")
-        source = Source(
-            name=input.name,
-            source_type="uploaded file",
-            content_type=input.name.split(".")[-1],
-            content=loader.load()[0].page_content,
-            collection_name_and_assistant_id=c_a_id,
-        )
-        # delete the file from temp directory
-        os.remove(path_url)
-
-    elif isinstance(validated_input, Url):
-        loader = WebBaseLoader(input)
-        source = Source(
-            name=input,
-            source_type="url",
-            content_type="url",
-            content=loader.load()[0].page_content,
-            collection_name_and_assistant_id=c_a_id,
-        )
+        path_url = _save_uploaded_file(input)
+        task = (input.name, load_file_source, (path_url, input.name, "uploaded file", c_a_id))
+        return task, path_url
     elif isinstance(validated_input, WindowsPath):
-        loader = UnstructuredFileLoader(input, encoding="utf-8")
-        source = Source(
-            name=validated_input.name,
-            source_type="file path",
-            content_type=validated_input.suffix[1:],
-            content=loader.load()[0].page_content,
-            collection_name_and_assistant_id=c_a_id,
+        task = (
+            validated_input.name,
+            load_file_source,
+            (str(input), validated_input.name, "file path", c_a_id),
         )
-
+        return task, None
     else:
         raise ValueError(f"source {input} is not a valid url or file path")
 
-    # clean up the source content, strip and remove duplicate spaces
-    source.content = " ".join(source.content.split())
-    return source
+
+# this function takes an input and return a source object.
+def create_source(input, c_a_id: str) -> Source:
+    """
+    input: a url, file path or streamlit fileuploader file
+    c_a_id: a collection and assistant id
+    returns an in memmory source object
+    """
+    sources, errors = create_sources([input], c_a_id)
+    for error in errors.values():
+        raise error
+    return sources[0]
+
+
+def create_sources(inputs: list, c_a_id: str):
+    """
+    load several urls, file paths or uploaded files at once,
+    files are parsed in worker processes and urls fetched concurrently
+    returns the loaded sources and a dict of the names that failed with their error
+    """
+    tasks, urls, temp_paths, errors = [], [], [], {}
+    for input in inputs:
+        try:
+            if isinstance(Input(input=input).input, Url):
+                urls.append(input)
+                continue
+            task, temp_path = _loading_task(input, c_a_id)
+        except Exception as e:
+            errors[getattr(input, "name", str(input))] = e
+            continue
+        tasks.append(task)
+        if temp_path is not None:
+            temp_paths.append(temp_path)
+    try:
+        results = load_url_sources(urls, c_a_id) + load_sources(
+            tasks, max_workers=get_global_setting_value("document_loader_workers")
+        )
+    finally:
+        # delete the files from temp directory
+        for temp_path in temp_paths:
+            os.remove(temp_path)
+    sources = []
+    for name, result in results:
+        if isinstance(result, Exception):
+            errors[name] = result
+        else:
+            sources.append(result)
+    return sources, errors
 
 
 def source_to_document(source: Source) -> Document:
     """given a source object, convert the source to a langchain document"""
-    # copy the source object
-    src = source.model_copy()
-    document = Document(page_content=src.content, metadata=src.model_dump())
+    # the content is not repeated in the metadata
+    document = Document(
+        page_content=source.content, metadata=source.model_dump(exclude={"content"})
+    )
     # convert any document metdata that is not str, int, float or bool to str
     for k, v in document.metadata.items():
         if not isinstance(v, (str, int, float, bool)):
@@ -245,30 +644,6 @@ def source_to_document(source: Source) -> Document:
     return document
 
 
-def add_chunk_id(chunks):
-    for i, chunk in enumerate(chunks):
-        chunk.metadata["chunk_id"] = i
-        chunk.metadata["chunk_count"] = len(chunks)
-    return chunks
-
-
-def chain_chunks(chunks, chain_length=3):
-    """add the content of the next chunk to the current chunk"""
-    chunks = add_chunk_id(chunks)
-    for i, chunk in enumerate(chunks):
-        chunk.metadata["chained_content"] = " ".join(
-            [chunk.page_content]
-            + [c.page_content for c in chunks[i + 1 : i + chain_length]]
-        )
-        # add previous chunk content to current chunk
-        if i > 0:
-            chunk.metadata["chained_content"] = " ".join(
-                ["...", chunks[i - 1].page_content[:-200]]
-                + [chunk.metadata["chained_content"]]
-            )
-    return chunks
-
-
 # deprecated
 # def split_document(document: object) -> list:
 #     """given a langhchain document, split the document into chunks (list of sentences)"""
@@ -278,51 +653,94 @@ def chain_chunks(chunks, chain_length=3):
 #     return chunks
 
 
-def split_document(document: object , chunk_size= 400, separators=["\\n\\n","\\n","\\."] ) -> list:
+def split_document(document: object , chunk_size= 400, separators=SEPARATORS ) -> list:
     """given a langhchain document, split the document into chunks (list of sentences)"""
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=100,
-        separators=separators,
-        is_separator_regex=True,
-        keep_separator=True,
+    return list(
+        iter_chunks(
+            document.page_content,
+            source_id=document.metadata["id"],
+            source_name=document.metadata["name"],
+            chunk_size=chunk_size,
+            separators=separators,
+        )
     )
-    chunks = splitter.split_documents([document])
-    chunks_to_index = chain_chunks(chunks, chain_length=3)
-    return chunks_to_index
-
-
-def index_source(source: Source):
-    """given a source, load the source, split the source,
-    and index the source in the named collection using a chroma client"""
-    # convert to langchain document
-    document = source_to_document(source)
-    # split the document
-    chunks = split_document(document)
-    f"{source.name} split into {len(chunks)} chunks"
-    # index the document
-    collection = get_or_create_collection(
-        collection_name=source.collection_name_and_assistant_id
-        
+
+
+def index_source(source: Source, replaces_source_id: str = None, progress_callback=None):
+    """given a source, split the source one batch of chunks at a time,
+    and index the chunks in the named collection using a chroma client.
+    Chunks already indexed for the source (an earlier version with the same id, or an
+    interrupted attempt) or for the source it replaces (replaces_source_id) that are unchanged
+    keep their embeddings, only new or changed chunks are embedded and stale ones deleted.
+    The earlier chunks are only taken over and deleted once all new chunks were added,
+    so a failed attempt leaves the replaced source searchable as it was.
+    progress_callback is called with the number of chunks processed and the (estimated) total"""
+    store = get_vector_store(source.collection_name_and_assistant_id)
+    # find the chunks already indexed for the source by their content hash
+    indexed_ids_by_hash = {}
+    for source_id in dict.fromkeys([source.id, replaces_source_id]):
+        if source_id is None:
+            continue
+        indexed = store.get(source_id=source_id)
+        for id, metadata in zip(indexed["ids"], indexed["metadatas"]):
+            indexed_ids_by_hash.setdefault(metadata.get("content_hash"), []).append(id)
+    estimated_total = estimate_chunk_count(source.content)
+    if progress_callback is not None:
+        progress_callback(0, estimated_total)
+    try:
+        chunks = iter_chunks(source.content, source_id=source.id, source_name=source.name)
+        chunk_count, embedded_count = 0, 0
+        kept_ids, kept_metadatas = [], []
+        # split, compare and add chunks in batches of 100
+        while batch := list(islice(chunks, 100)):
+            new_chunks = []
+            for chunk in batch:
+                ids = indexed_ids_by_hash.get(chunk.metadata["content_hash"])
+                if ids:
+                    kept_ids.append(ids.pop())
+                    kept_metadatas.append(chunk.metadata)
+                else:
+                    new_chunks.append(chunk)
+            if new_chunks:
+                texts = [chunk.page_content for chunk in new_chunks]
+                store.add(
+                    ids=[str(uuid4()) for _ in new_chunks],
+                    embeddings=get_embedding_function().embed_documents(texts),
+                    documents=texts,
+                    metadatas=[chunk.metadata for chunk in new_chunks],
+                )
+                logging.info(f"added {len(new_chunks)} chunks to col id {source.collection_name_and_assistant_id}")
+            chunk_count += len(batch)
+            embedded_count += len(new_chunks)
+            if progress_callback is not None:
+                progress_callback(chunk_count, max(chunk_count, estimated_total))
+        # unchanged chunks only get their metadata updated, e.g. the new source id
+        if kept_ids:
+            store.update_metadatas(kept_ids, kept_metadatas)
+        stale_ids = [id for ids in indexed_ids_by_hash.values() for id in ids]
+        if len(stale_ids) > 0:
+            store.delete(stale_ids)
+    finally:
+        # also after a failure, the chunks added so far are kept and change the search results
+        store.flush()
+        bump_collection_version(source.collection_name_and_assistant_id)
+    if progress_callback is not None:
+        progress_callback(chunk_count, chunk_count)
+    logging.info(
+        f"{source.name}: {embedded_count} chunks embedded, "
+        f"{len(kept_ids)} unchanged, {len(stale_ids)} stale chunks deleted"
     )
-    # add chunks in batches of 100
-    for batch in range(0, len(chunks), 100):
-        collection.add_documents(
-            chunks[batch : batch + 100],
-            
-        )
-        logging.info(f"added {len(chunks[batch : batch + 100])} chunks to col id {source.collection_name_and_assistant_id}") 
-    print(f"{source.name} indexed into {len(chunks)} chunks")
+    print(f"{source.name} indexed into {chunk_count} chunks")
 
 
 def remove_source(source: Source):
-    """given a source, remove the source chunks from the named collection using a chroma http client"""
-    where = {"id": source.id}
-    collection = get_collection(collection_name=source.collection_name_and_assistant_id)
-    remove_ids = collection.get(where=where)["ids"]
+    """given a source, remove the source chunks from the named collection"""
     try:
-        collection.delete(remove_ids)
+        store = get_vector_store(source.collection_name_and_assistant_id)
+        store.delete_source(source.id)
+        store.flush()
     except Exception:
         print(
             f"{source.name} not found in collection {source.collection_name_and_assistant_id}"
         )
+    bump_collection_version(source.collection_name_and_assistant_id)
@@ -0,0 +1,88 @@
+""" split source texts into chunks one window at a time"""
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+from src.basic_data_classes import ChunkMetadata
+from src.document_loading import content_hash
+from typing import Iterator
+
+"""
+the text is split a window of a few dozen chunks at a time, and chunks are yielded
+one by one, so the chunks of a large document are never all in memory at once.
+each chunk only carries a small metadata dict: the source id and name,
+its position in the source and the hash of its text
+"""
+
+# number of chunk sizes of text split at a time
+WINDOW_CHUNKS = 50
+# regexes the text is split at, tried in order: paragraphs, lines and sentences
+SEPARATORS = ("\\n\\n", "\\n", "\\.")
+
+
+def iter_text_chunks(
+    text: str,
+    chunk_size: int = 400,
+    chunk_overlap: int = 100,
+    separators: tuple = SEPARATORS,
+) -> Iterator[tuple]:
+    """yield (start, end, chunk text) for the chunks of a text in order"""
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=list(separators),
+        is_separator_regex=True,
+        keep_separator=True,
+    )
+    window = WINDOW_CHUNKS * chunk_size
+    position = 0
+    while position < len(text):
+        window_end = min(position + window, len(text))
+        segment = text[position:window_end]
+        pieces = splitter.split_text(segment)
+        starts = []
+        cursor = 0
+        for piece in pieces:
+            start = segment.find(piece, cursor)
+            if start == -1:
+                start = segment.find(piece)
+            starts.append(start)
+            cursor = start + 1
+        is_last_window = window_end == len(text)
+        # the last piece of a window may be cut off, it is split again with the next window
+        if not is_last_window and len(pieces) > 1 and starts[-1] > 0:
+            pieces, next_position = pieces[:-1], position + starts[-1]
+        else:
+            next_position = window_end
+        for piece, start in zip(pieces, starts):
+            yield position + start, position + start + len(piece), piece
+        position = next_position
+
+
+def iter_chunks(
+    text: str,
+    source_id: str,
+    source_name: str,
+    chunk_size: int = 400,
+    separators: tuple = SEPARATORS,
+) -> Iterator[Document]:
+    """
+    yield the chunks of a source text as langchain documents with compact metadata,
+    neighboring chunks are found by their chunk_id when retrieving
+    """
+    text_chunks = iter_text_chunks(text, chunk_size=chunk_size, separators=separators)
+    for chunk_id, (start, end, chunk_text) in enumerate(text_chunks):
+        yield Document(
+            page_content=chunk_text,
+            metadata=ChunkMetadata(
+                source_id=source_id,
+                name=source_name,
+                chunk_id=chunk_id,
+                start=start,
+                end=end,
+                content_hash=content_hash(chunk_text),
+            ).model_dump(),
+        )
+
+
+def estimate_chunk_count(text: str, chunk_size: int = 400, chunk_overlap: int = 100) -> int:
+    """roughly how many chunks a text is split into, for progress reporting"""
+    return max(1, round(len(text) / (chunk_size - chunk_overlap / 2)))
@@ -0,0 +1,73 @@
+""" pack retrieved passages into the context token budget of a model"""
+from src.basic_data_classes import LLM
+from functools import lru_cache
+import logging
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken is optional, tokens are then estimated from the text length
+    tiktoken = None
+
+"""
+passages are ranked by the score of their best retrieved chunk and added to the context
+until the model's context_token_budget is used. tokens are counted with the tiktoken
+encoding of the model when tiktoken is installed, otherwise estimated as 4 characters per token
+"""
+
+CHARACTERS_PER_TOKEN = 4
+PASSAGE_SEPARATOR = "\n\n-----------"
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model_name: str):
+    """the tiktoken encoding of a model, or None if tokens are estimated"""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        # models unknown to tiktoken, e.g. local models, are counted like gpt-3.5 and gpt-4
+        pass
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logging.warning(f"could not load a tiktoken encoding, estimating tokens: {e}")
+        return None
+
+
+def count_tokens(text: str, llm: LLM = None) -> int:
+    """the number of tokens of a text for a model"""
+    encoding = get_encoding(llm.deployment if llm else "")
+    if encoding is None:
+        return -(-len(text) // CHARACTERS_PER_TOKEN)
+    return len(encoding.encode(text))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, llm: LLM = None) -> str:
+    """the beginning of a text that fits in max_tokens"""
+    encoding = get_encoding(llm.deployment if llm else "")
+    if encoding is None:
+        return text[: max_tokens * CHARACTERS_PER_TOKEN]
+    return encoding.decode(encoding.encode(text)[:max_tokens])
+
+
+def pack_passages(passages: list, token_budget: int, llm: LLM = None):
+    """
+    select the best passages that fit in the token budget
+    :param passages: (text, score) tuples, a lower score is more relevant, None is least relevant
+    returns the packed passage texts, most relevant first, and the number of tokens used.
+    passages that do not fit are skipped for smaller ones,
+    if not even the most relevant passage fits it is cut to the budget
+    """
+    ranked = sorted(passages, key=lambda p: (p[1] is None, p[1] or 0.0))
+    separator_tokens = count_tokens(PASSAGE_SEPARATOR, llm)
+    packed, tokens_used = [], 0
+    for text, _ in ranked:
+        tokens = count_tokens(text, llm) + (separator_tokens if packed else 0)
+        if tokens_used + tokens <= token_budget:
+            packed.append(text)
+            tokens_used += tokens
+    if not packed and ranked:
+        text = truncate_to_tokens(ranked[0][0], token_budget, llm)
+        packed, tokens_used = [text], count_tokens(text, llm)
+    return packed, tokens_used
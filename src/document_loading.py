@@ -0,0 +1,93 @@
+""" load the text of uploaded files into sources, in parallel worker processes"""
+from langchain_community.document_loaders import UnstructuredFileLoader
+from src.basic_data_classes import Source
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import hashlib
+import threading
+import logging
+
+"""
+parsing pdf and docx files is cpu bound, so several files are parsed at once in a
+process pool shared by all sessions. the loading functions only import the loaders,
+so starting a worker process does not load the rest of the app
+"""
+
+_pool = None
+_pool_workers = None
+_pool_lock = threading.Lock()
+
+
+def clean_content(content: str) -> str:
+    """strip and remove duplicate spaces"""
+    return " ".join(content.split())
+
+
+def content_hash(text: str) -> str:
+    """hash of a text, used to find chunks that are already indexed and sources that changed"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def load_file_source(
+    path: str, name: str, source_type: str, c_a_id: str
+) -> Source:
+    """load a file from disk into a source"""
+    loader = UnstructuredFileLoader(path, encoding="utf-8")
+    content = clean_content(loader.load()[0].page_content)
+    return Source(
+        name=name,
+        source_type=source_type,
+        content_type=name.split(".")[-1],
+        content=content,
+        content_hash=content_hash(content),
+        collection_name_and_assistant_id=c_a_id,
+    )
+
+
+def get_loader_pool(max_workers: int) -> ProcessPoolExecutor:
+    """get the shared process pool, recreated if the number of workers changed or it broke"""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != max_workers or _pool._broken:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            # spawn fresh processes, forking the threads of the app is not safe
+            _pool = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            _pool_workers = max_workers
+            logging.info(f"started document loader pool with {max_workers} processes")
+        return _pool
+
+
+def load_sources(tasks: list, max_workers: int) -> list:
+    """
+    run loading tasks in parallel
+    :param tasks: (name, function, args) tuples, e.g. ("report.pdf", load_file_source, (...))
+    returns a (name, source or exception) tuple for each task in the same order,
+    so one file failing does not stop the others
+    """
+    if len(tasks) <= 1 or max_workers <= 1:
+        results = []
+        for name, function, args in tasks:
+            try:
+                results.append((name, function(*args)))
+            except Exception as e:
+                results.append((name, e))
+        return results
+    pool = get_loader_pool(max_workers)
+    futures = [(name, pool.submit(function, *args)) for name, function, args in tasks]
+    results = []
+    for name, future in futures:
+        try:
+            results.append((name, future.result()))
+        except BrokenProcessPool as e:
+            # a worker died, e.g. out of memory, the pool is recreated on the next call
+            logging.error(f"document loader pool broke while loading {name}: {e}")
+            results.append((name, e))
+        except Exception as e:
+            logging.error(f"could not load {name}: {e}")
+            results.append((name, e))
+    return results
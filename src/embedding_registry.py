@@ -0,0 +1,98 @@
+""" process-wide registry of sentence transformer embedding models"""
+from langchain_community.embeddings import SentenceTransformerEmbeddings
+from src.sqlite.gov_db_utils import get_global_setting, get_global_setting_value
+from collections import OrderedDict
+import threading
+import logging
+
+"""
+load embedding models lazily and share them between all sessions,
+keep several models in memory under a memory cap (global setting embeddings_memory_cap_mb),
+evict the least recently used model when the cap is exceeded
+"""
+
+# model name -> {"embedding_function": ..., "size": bytes}, least recently used first
+_models = OrderedDict()
+# guards _models and _loading_locks
+_registry_lock = threading.Lock()
+# one lock per model name, so a model is only loaded once even if requested concurrently
+_loading_locks = {}
+
+
+def _model_size(embedding_function) -> int:
+    """estimate the memory used by a loaded model in bytes from its parameters and buffers"""
+    try:
+        model = embedding_function.client
+        tensors = list(model.parameters()) + list(model.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+    except Exception:
+        return 0
+
+
+def _load_model(model_name: str):
+    """load a sentence transformer model from disk (or download it)"""
+    return SentenceTransformerEmbeddings(model_name=model_name)
+
+
+def _evict_over_cap(keep: str):
+    """evict least recently used models until the loaded models fit under the memory cap
+    the model named keep is never evicted. Must be called holding _registry_lock"""
+    cap = get_global_setting_value("embeddings_memory_cap_mb") * 1024 * 1024
+    for name in list(_models.keys()):
+        if sum(m["size"] for m in _models.values()) <= cap:
+            break
+        if name != keep:
+            _models.pop(name)
+            logging.info(f"embeddings model {name} evicted to stay under memory cap")
+
+
+def get_embedding_function(model_name: str = None):
+    """
+    get the shared embedding function for model_name
+    defaults to the model in the embeddings_model global setting
+    the model is loaded on first use and reused afterwards
+    """
+    if model_name is None:
+        model_name = get_global_setting("embeddings_model").value
+    with _registry_lock:
+        if model_name in _models:
+            _models.move_to_end(model_name)
+            return _models[model_name]["embedding_function"]
+        loading_lock = _loading_locks.setdefault(model_name, threading.Lock())
+    with loading_lock:
+        # another thread may have loaded the model while we were waiting
+        with _registry_lock:
+            if model_name in _models:
+                _models.move_to_end(model_name)
+                return _models[model_name]["embedding_function"]
+        embedding_function = _load_model(model_name)
+        size = _model_size(embedding_function)
+        with _registry_lock:
+            _models[model_name] = {
+                "embedding_function": embedding_function,
+                "size": size,
+            }
+            _evict_over_cap(keep=model_name)
+    logging.info(f"embeddings model {model_name} loaded ({size / 1024**2:.0f} MB)")
+    print(f"embeddings model {model_name} loaded")
+    return embedding_function
+
+
+def warm_up_embedding_model():
+    """load the model from the embeddings_model global setting before the first request needs it"""
+    return get_embedding_function()
+
+
+def evict_embedding_model(model_name: str) -> bool:
+    """remove a model from the registry, returns True if the model was loaded"""
+    with _registry_lock:
+        evicted = _models.pop(model_name, None) is not None
+    if evicted:
+        logging.info(f"embeddings model {model_name} evicted")
+    return evicted
+
+
+def get_loaded_embedding_models() -> dict:
+    """get the names of the loaded models and their estimated memory use in MB"""
+    with _registry_lock:
+        return {name: m["size"] / 1024**2 for name, m in _models.items()}
@@ -0,0 +1,159 @@
+""" background ingestion of sources into the assistants' collections"""
+from src.basic_data_classes import IngestionJob, Source
+from src.sqlite.queries import select, select_one, insert, delete
+from src.sqlite.db_utils import add_source, get_assistant, delete_assistant
+from src.chroma_utils import remove_source
+from src.sqlite.gov_db_utils import get_global_setting_value
+from datetime import datetime
+import threading
+import queue
+import logging
+
+"""
+sources are indexed by worker threads instead of the user's streamlit session,
+each source gets a job in the ingestionjobs table with its status and progress,
+so the edit page can poll the jobs and unfinished jobs are resumed after a restart
+"""
+
+_queue = queue.Queue()
+_workers = []
+_workers_lock = threading.Lock()
+
+
+def _save_job(job: IngestionJob):
+    job.updated_at = datetime.now()
+    insert(job, operation="replace")
+
+
+def submit_source(source: Source, replaces_source_id: str = "") -> IngestionJob:
+    """queue a source for indexing and return its job
+    the source replaces_source_id is kept until the new source is indexed"""
+    job = IngestionJob(
+        source_id=source.id,
+        source_name=source.name,
+        assistant_id=source.collection_name_and_assistant_id,
+        source_json=source.model_dump_json(),
+        replaces_source_id=replaces_source_id,
+    )
+    _save_job(job)
+    _queue.put(job.id)
+    logging.info(f"queued ingestion job {job.id} for {source.name}")
+    return job
+
+
+def get_job(job_id: str) -> IngestionJob:
+    """get an ingestion job by id"""
+    return select_one(IngestionJob, job_id)
+
+
+def get_assistant_jobs(assistant_id: str, unfinished_only: bool = True) -> list:
+    """get the ingestion jobs of an assistant, by default only queued, running and failed jobs"""
+    jobs = select(IngestionJob, assistant_id=assistant_id, order_by="created_at")
+    if unfinished_only:
+        jobs = [job for job in jobs if job.status != "done"]
+    return jobs
+
+
+def retry_job(job_id: str):
+    """queue a failed job again"""
+    job = get_job(job_id)
+    job.status = "queued"
+    job.attempts = 0
+    _save_job(job)
+    _queue.put(job.id)
+
+
+def dismiss_job(job_id: str):
+    """delete a failed job and the chunks its attempts added,
+    a source it was to replace keeps its chunks and stays in the assistant"""
+    job = get_job(job_id)
+    if job is None or job.status != "failed":
+        return
+    # a refreshed url source keeps its id, its chunks then belong to the existing source
+    if select_one(Source, job.source_id) is None:
+        remove_source(Source.model_validate_json(job.source_json))
+    delete(IngestionJob, id=job.id)
+    logging.info(f"dismissed failed ingestion job {job.id} for {job.source_name}")
+
+
+def run_job(job_id: str):
+    """index the source of a job, retrying with a delay if it fails"""
+    job = get_job(job_id)
+    if job is None or job.status not in ("queued", "running"):
+        return
+    if get_assistant(job.assistant_id) is None:
+        logging.info(f"dropped ingestion job {job.id}, assistant {job.assistant_id} was deleted")
+        delete(IngestionJob, id=job.id)
+        return
+    job.status = "running"
+    job.attempts += 1
+    _save_job(job)
+
+    def report_progress(chunks_done, chunks_total):
+        job.chunks_done = chunks_done
+        job.chunks_total = chunks_total
+        _save_job(job)
+
+    try:
+        source = Source.model_validate_json(job.source_json)
+        add_source(
+            source,
+            replaces_source_id=job.replaces_source_id or None,
+            progress_callback=report_progress,
+        )
+    except Exception as e:
+        logging.error(f"ingestion job {job.id} for {job.source_name} failed: {e}")
+        job.error = str(e)
+        if job.attempts < get_global_setting_value("ingestion_max_attempts"):
+            job.status = "queued"
+            _save_job(job)
+            # wait a little longer after each failed attempt
+            timer = threading.Timer(10 * 2**job.attempts, _queue.put, args=(job.id,))
+            timer.daemon = True
+            timer.start()
+        else:
+            job.status = "failed"
+            _save_job(job)
+        return
+    if get_assistant(job.assistant_id) is None:
+        # the assistant was deleted while the source was indexed
+        logging.info(f"assistant {job.assistant_id} was deleted while running ingestion job {job.id}")
+        delete_assistant(job.assistant_id)
+        return
+    job.status = "done"
+    job.error = ""
+    job.source_json = ""
+    _save_job(job)
+    logging.info(f"ingestion job {job.id} for {job.source_name} done")
+
+
+def _work():
+    while True:
+        job_id = _queue.get()
+        try:
+            run_job(job_id)
+        except Exception as e:
+            logging.error(f"ingestion worker could not run job {job_id}: {e}")
+        finally:
+            _queue.task_done()
+
+
+def start_ingestion_workers():
+    """
+    start the background ingestion threads once per process
+    and resume the jobs left queued or running by a previous process
+    """
+    with _workers_lock:
+        if len(_workers) > 0:
+            return
+        for job in select(IngestionJob, status="running") + select(
+            IngestionJob, status="queued"
+        ):
+            job.status = "queued"
+            _save_job(job)
+            _queue.put(job.id)
+        for _ in range(get_global_setting_value("ingestion_workers")):
+            worker = threading.Thread(target=_work, daemon=True)
+            worker.start()
+            _workers.append(worker)
+    logging.info(f"started {len(_workers)} ingestion workers")
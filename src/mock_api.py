@@ -15,7 +15,9 @@ curl http://10.10.1.13:8123/chat/completions ^
    }'
 """
 from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+import json
 from src.basic_data_classes import LLM
 import subprocess
 import uvicorn
@@ -70,10 +72,29 @@ response = {
 }
 
 
+
+def stream_response():
+    """server-sent events with the response content split into one chunk per word"""
+    content = response["choices"][0]["message"]["content"]
+    for word in content.split(" "):
+        chunk = {
+            "id": response["id"],
+            "object": "chat.completion.chunk",
+            "created": response["created"],
+            "model": response["model"],
+            "choices": [
+                {"delta": {"content": word + " "}, "finish_reason": None, "index": 0}
+            ],
+        }
+        yield f"data: {json.dumps(chunk)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
 class Data(BaseModel):
     model: str
     messages: list
     temperature: float
+    stream: bool = False
 
 
 # Define a root `/` endpoint
@@ -84,6 +105,8 @@ async def root():
 
 @app.post("/chat/completions")
 async def completions(Data: Data):
+    if Data.stream:
+        return StreamingResponse(stream_response(), media_type="text/event-stream")
     return response
 
 
@@ -2,26 +2,75 @@
 from openai import AzureOpenAI, OpenAI
 from src.basic_data_classes import LLM, Assistant
 from src.sqlite.db_utils import get_llm
+from src.sqlite.gov_db_utils import get_global_setting_value
+import threading
+import httpx
+import logging
 
+# clients are reused across requests to keep their connection pools alive
+# they are keyed by llm id and updated_at, so an edited llm gets a new client
+_clients = {}
+_clients_lock = threading.Lock()
 
-def connect_to_client(llm: LLM):
-    """Connect to OpenAI API and return client."""
+
+def create_client(llm: LLM):
+    """Create a new OpenAI API client with its own keep-alive connection pool."""
+    max_connections = get_global_setting_value("llm_max_connections")
+    http_client = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        ),
+        timeout=httpx.Timeout(get_global_setting_value("llm_timeout_seconds")),
+    )
     api_type = llm.api_type
     if api_type == "azure":
         client = AzureOpenAI(
             api_key=llm.api_key,
             api_version="2023-07-01-preview",
             azure_endpoint=llm.enpoint_or_base_url,
+            http_client=http_client,
         )
     else:
         client = OpenAI(
             api_key=llm.api_key,
             base_url=llm.enpoint_or_base_url,
+            http_client=http_client,
         )
-    # if successful, log and return client
     return client
 
 
+def connect_to_client(llm: LLM):
+    """Connect to OpenAI API and return client, reusing the cached client for the llm."""
+    key = (llm.id, llm.updated_at)
+    with _clients_lock:
+        if key in _clients:
+            return _clients[key]
+    client = create_client(llm)
+    with _clients_lock:
+        if key in _clients:
+            # another thread created a client for the llm in the meantime
+            client.close()
+            return _clients[key]
+        # forget clients for previous versions of the llm, without closing them
+        # as other sessions may still be streaming a response through them
+        for old_key in [k for k in _clients if k[0] == llm.id]:
+            del _clients[old_key]
+        _clients[key] = client
+    logging.info(f"created client for llm {llm.name} ({llm.id})")
+    return client
+
+
+def invalidate_client(llm_id: str = None):
+    """Forget the cached clients for an llm, e.g. after it was edited or deleted.
+    If no llm_id is given, all cached clients are forgotten.
+    The clients are not closed, requests in flight in other sessions finish
+    and the connections are released when the clients are garbage collected."""
+    with _clients_lock:
+        for key in [k for k in _clients if llm_id is None or k[0] == llm_id]:
+            del _clients[key]
+
+
 # Function for generating LLM response
 def generate_response(
     prompt_input: str,
@@ -41,6 +90,28 @@ def generate_response(
     return response.choices[0].message.content
 
 
+def generate_response_stream(
+    prompt_input: str,
+    llm: LLM,
+    messages=[],
+    max_tokens=1000,
+    temperature=0.7,
+):
+    """Generate response from LLM model, yielding the text deltas as they arrive."""
+    client = connect_to_client(llm=llm)
+    stream = client.chat.completions.create(
+        model=llm.deployment,
+        messages=messages + [{"role": "user", "content": prompt_input}],
+        max_tokens=max_tokens,
+        temperature=temperature,
+        stream=True,
+    )
+    for chunk in stream:
+        # azure sends chunks without choices, e.g. with content filter results
+        if len(chunk.choices) > 0 and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
 def get_response_from_assistant(
     prompt_input: str,
     assistant: Assistant,
@@ -60,10 +131,16 @@ def get_response_from_assistant(
 
 
 def llm_api_test(llm):
-    """test the LLM model by generating a response to a prompt."""
+    """test the LLM model by generating a response to a prompt.
+    A new client is used, so edited settings are tested instead of a cached client."""
     prompt_input = "repeat after me: 'All systems go!'"
     try:
-        generate_response(prompt_input, llm=llm)
+        with create_client(llm) as client:
+            client.chat.completions.create(
+                model=llm.deployment,
+                messages=[{"role": "user", "content": prompt_input}],
+                max_tokens=1000,
+            )
         return True, "All systems go! Modellen virker som den skal."
     # if exception is similar to Error code: 404 - {'error': {'code': 'DeploymentNotFound', 'message': 'The API deployment for this resource does not exist. If you created the deployment within the last 5 minutes, please wait a moment and try again.'}}
     # then return a message that the deployment does not exist
@@ -4,15 +4,31 @@ from src.openai_utils import (
     generate_response,
     connect_to_client,
 )
-from src.sqlite.db_utils import get_assistant, get_llm, get_active_llms
-from src.chroma_utils import start_chroma_server, get_or_create_retriever
+from src.sqlite.db_utils import get_assistant, get_llm
+from src.chroma_utils import start_chroma_server, query_collection, get_neighbor_chunks
 import json
 from jinja2 import Template
 import copy
 import json
 import re
+from src.basic_data_classes import RetrievalResult, LLM
+from src.context_packing import pack_passages, PASSAGE_SEPARATOR
+from src.query_generation import (
+    is_self_contained,
+    get_query_maker,
+    cache_key,
+    get_cached_queries,
+    cache_queries,
+    count,
+)
+from src.sqlite.gov_db_utils import get_global_setting_value
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import threading
 import logging
 
+_query_maker_pool = None
+_query_maker_pool_lock = threading.Lock()
+
 # Define the query building template with placeholders
 template_string = (
     '[{"role": "system","content": "Du er en hjælpsom assistent, der hjælper med:\\n '
@@ -109,15 +125,25 @@ def generate_search_queries(prompt_input: str, messages: list):
     takes a prompt input and a list of messages and generates a list of search queries
     the prompt input is the prompt for the query maker assistant
     the messages list is the conversation between the user and the main assistant
+    short self-contained questions are searched for as they are,
+    generated queries are cached by the normalized tail of the conversation
     """
-    if get_active_llms() == []:
+    if is_self_contained(prompt_input, messages):
+        count("fast_path")
+        logging.info("query generation skipped for self-contained question")
+        return [prompt_input]
+    llm = get_query_maker()
+    if llm is None:
         print("no active llms found")
         return [prompt_input]
+    key = cache_key(prompt_input, messages, llm)
+    if (queries := get_cached_queries(key)) is not None:
+        logging.info(f"search queries found in cache: {queries}")
+        return queries
     agent = {
     "temperature": 1.0,  # higher temperature to generate more diverse queries
-    "max_tokens": 2500,
-    # from the list of active llms use the llm the was first created
-    "llm": get_active_llms()[0],
+    "max_tokens": get_global_setting_value("query_maker_max_tokens"),
+    "llm": llm,
     }
 
     msgs = copy.deepcopy(messages)
@@ -128,6 +154,7 @@ def generate_search_queries(prompt_input: str, messages: list):
     # prepend qm system message to qm prompt
     # drop main_assistants system message from messages and append prompt user message
     client = connect_to_client(llm=agent["llm"])
+    count("llm_calls")
     response = client.chat.completions.create(
         model=agent["llm"].deployment,
         messages=agent_messages,
@@ -150,102 +177,252 @@ def generate_search_queries(prompt_input: str, messages: list):
     except Exception as e:
         print(f"An error occurred while parsing the response: {e}")
         # fail safe, return the prompt input as a query
-        queries = [prompt_input]
+        return [prompt_input]
+    cache_queries(key, queries)
     return queries
 
 
 def retrieve_results(assistant, queries: list, top_k: int = 4) -> list:
     """
-    retireves unique results from main assistants retriever
-    sorted by result.metadata['chunk_id']
+    retireves unique results from main assistants collection
+    all queries are embedded and searched in one batch
+    results are RetrievalResults, unique by (source_id, chunk_id) with the best score,
+    sorted by source and chunk id
     """
     if len(queries) == 0:
         return []
-    retriever = get_or_create_retriever(assistant.id, k=top_k)
-    results = []
-    for query in queries:
-        query_results = retriever.get_relevant_documents(query=query)
-        logging.info(f"{len(query_results)} results retrieved for query: {query}")
-        results = results + query_results
-    # dedeuplicate results based on result.metadata['chunk_id']
-    test_result = results[0]
-    print(type(test_result), len(test_result.metadata),test_result.metadata.keys())   
-    unique_results = list(
-        {result.metadata["chunk_id"]: result for result in results}.values()
-    )  # ; 
-    # sort results by result.metadata['chunk_id']
-    unique_results.sort(key=lambda result: result.metadata["chunk_id"])
-    logging.info(f'{len(unique_results)} unique results retieved in total')
+    per_query_hits, merged_hits = query_collection(
+        collection_name=assistant.id, queries=queries, k=top_k
+    )
+    for query, hits in zip(queries, per_query_hits):
+        logging.info(f"{len(hits)} results retrieved for query: {query}")
+    unique_results = merge_results(
+        [
+            RetrievalResult.from_chunk(document.page_content, document.metadata, score=distance)
+            for document, distance in merged_hits
+        ]
+    )
+    logging.info(f"{len(unique_results)} unique results retieved in total")
     return unique_results
 
 
-def merge_overlapping_strings(strings: list):
+def merge_results(*result_lists: list) -> list:
+    """
+    merges lists of RetrievalResults into results unique by (source_id, chunk_id)
+    chunk ids are only unique within a source, the closest hit of each chunk is kept
+    """
+    unique_results = {}
+    for results in result_lists:
+        for result in results:
+            if result.key not in unique_results or result.score < unique_results[result.key].score:
+                unique_results[result.key] = result
+    return sorted(unique_results.values(), key=lambda result: result.key)
+
+
+def group_by_source(results: list) -> dict:
+    """group retrieval results by source id, keeping their order"""
+    groups = {}
+    for result in results:
+        groups.setdefault(result.source_id, []).append(result)
+    return groups
+
+
+def longest_overlap(words1: list, words2: list) -> int:
+    """
+    the number of words in the longest suffix of words1 that is also a prefix of words2,
+    found in linear time with the prefix function of knuth-morris-pratt
+    over words2 + [separator] + words1
+    """
+    sequence = words2 + [None] + words1
+    prefix = [0] * len(sequence)
+    for i in range(1, len(sequence)):
+        k = prefix[i - 1]
+        while k > 0 and sequence[i] != sequence[k]:
+            k = prefix[k - 1]
+        if sequence[i] == sequence[k]:
+            k += 1
+        prefix[i] = k
+    return prefix[-1]
+
+
+def merge_overlapping_strings(strings: list, min_overlap: int = 5):
     """
     takes two strings, evaluates if they overlap and stiches them together if they do
-    string overlap if 1st string ends with the same words the 2nd string begins with
+    string overlap if 1st string ends with the same (at least min_overlap) words the 2nd string begins with
     """
     str1, str2 = strings
     str1_words = str1.split(" ")
     # drop the '...' prepended to the 2nd string
     str2_words = str2.split(" ")[1:]
-    # find overlap
-    overlap = []
-    # chheck fo overlap of at least 4 words
-    for i in range(max(len(str1_words) - 4, 0)):
-        if str1_words[i:] == str2_words[: len(str1_words[i:])]:
-            overlap = str1_words[i:]
-            break
+    overlap = longest_overlap(str1_words, str2_words)
     # stich strings together
-    if overlap:
-        merged_string = " ".join(str1_words + str2_words[len(overlap) :])
-    else:
-        merged_string = None
-    return merged_string
+    if overlap >= min_overlap:
+        return " ".join(str1_words + str2_words[overlap:])
+    return None
 
 
-def merge_multiple_strings(chunks: list):
+def best_score(score, other_score):
+    """the lower of two retrieval scores, None if neither chunk was retrieved"""
+    scores = [s for s in (score, other_score) if s is not None]
+    return min(scores) if scores else None
+
+
+def merge_multiple_strings(results: list):
     """
-    takes a list of strings (chunks) and merges them together if they overlap
+    takes a list of retrieval results and merges their chained contents in one pass,
+    a result is merged into the previous passage if it is from the same source,
+    at most 3 chunks further and its content overlaps the end of the passage
+    returns (text, score) passages with the best score of their results
     """
-    contents = [chunk.metadata["chained_content"] for chunk in chunks]
-    chunk_ids = [chunk.metadata["chunk_id"] for chunk in chunks]
-    i = 0
-    while i < len(chunk_ids):
-        if i == len(chunk_ids) - 1:
-            break
-        else:
-            ID1, ID2 = chunk_ids[i], chunk_ids[i + 1]
-            # print("comparing chunks", ID1, ID2)
-            if ID1 >= ID2 - 3:
-                merged_content = merge_overlapping_strings(
-                    [contents[i], contents[i + 1]]
-                )
-                # print(f"chunk ID {ID1} merged with {ID2}")
+    passages = []
+    for group in group_by_source(sorted(results, key=lambda r: r.key)).values():
+        previous_chunk_id = None
+        for result in group:
+            if previous_chunk_id is not None and previous_chunk_id >= result.chunk_id - 3:
+                text, score = passages[-1]
+                merged_content = merge_overlapping_strings([text, result.chained_content])
                 if merged_content:
-                    contents[i] = merged_content
-                    _ = contents.pop(i + 1)
-                    _ = chunk_ids.pop(i + 1)
-                else:
-                    i += 1
+                    passages[-1] = (merged_content, best_score(score, result.score))
+                    previous_chunk_id = result.chunk_id
+                    continue
+            passages.append((result.chained_content, result.score))
+            previous_chunk_id = result.chunk_id
+    return passages
+
+
+def stitch_chunks(results: list) -> list:
+    """
+    takes retrieval results ordered by source and chunk id and joins runs of neighboring
+    chunks of the same source into one passage each,
+    the overlap between neighbors is cut off by their offsets,
+    a chunk lying entirely within the passage so far is left out
+    returns (text, score) passages with the best score of their results
+    """
+    passages = []
+    for group in group_by_source(results).values():
+        previous_chunk_id, passage_end = None, -1
+        for result in group:
+            if previous_chunk_id is not None and result.chunk_id == previous_chunk_id + 1:
+                text, score = passages[-1]
+                # the offsets of chunks indexed by older versions may be unknown (-1)
+                overlap = passage_end - result.start if passage_end >= 0 and result.start >= 0 else 0
+                if overlap <= 0:
+                    text += " " + result.text
+                elif overlap < len(result.text):
+                    text += result.text[overlap:]
+                passages[-1] = (text, best_score(score, result.score))
+                passage_end = max(passage_end, result.end)
             else:
-                i += 1
-    return contents
+                passages.append((result.text, result.score))
+                passage_end = result.end
+            previous_chunk_id = result.chunk_id
+    return passages
 
 
-def add_context_from_queries(
-    messages: list, queries: list, assistant: object, top_k: int = 4
-):
+def build_context(assistant, queries: list, top_k: int = 4):
     """
-    takes a list of queries, messages and an assistant
-    retrieves results from main assistants retriever
-    and adds the context from the results to the messages
+    retrieves results for the queries and builds the context from them
+    (see build_context_from_results)
+    returns the context and a report of the tokens and passages used
     """
     # retrieve results from main assistants retriever
     unique_results = retrieve_results(assistant=assistant, queries=queries, top_k=top_k)
+    return build_context_from_results(assistant, unique_results)
+
+
+def build_context_from_results(assistant, unique_results: list):
+    """
+    expands retrieved results with their neighboring chunks,
+    merges them into passages and packs the most relevant passages
+    into the context token budget of the assistant's model
+    returns the context and a report of the tokens and passages used
+    """
     logging.info(f"{len(unique_results)} unique results retrieved")
+    # chunks indexed by older versions have no offsets but carry their neighbors in chained_content
+    legacy_results = [r for r in unique_results if r.start == -1]
+    results = [r for r in unique_results if r.start != -1]
+    expanded_results = get_neighbor_chunks(
+        collection_name=assistant.id, results=results, window=assistant.neighbor_window
+    )
     # merge results
-    contents = merge_multiple_strings(unique_results)
-    context = "\n\n-----------".join(contents)
+    passages = merge_multiple_strings(legacy_results) + stitch_chunks(expanded_results)
+    llm = get_llm(assistant.chat_model_name)
+    token_budget = (
+        llm.context_token_budget if llm else LLM.model_fields["context_token_budget"].default
+    )
+    packed, tokens_used = pack_passages(passages, token_budget=token_budget, llm=llm)
+    report = {
+        "tokens_used": tokens_used,
+        "token_budget": token_budget,
+        "passages_used": len(packed),
+        "passages_total": len(passages),
+    }
+    logging.info(
+        f"context of {tokens_used}/{token_budget} tokens "
+        f"with {len(packed)} of {len(passages)} passages"
+    )
+    return PASSAGE_SEPARATOR.join(packed), report
+
+
+def get_query_maker_pool() -> ThreadPoolExecutor:
+    """the threads generating search queries while the prompt is searched for,
+    shared by all sessions and sized by the llm_max_connections global setting"""
+    global _query_maker_pool
+    with _query_maker_pool_lock:
+        if _query_maker_pool is None:
+            _query_maker_pool = ThreadPoolExecutor(
+                max_workers=get_global_setting_value("llm_max_connections"),
+                thread_name_prefix="query_maker",
+            )
+        return _query_maker_pool
+
+
+def build_context_pipelined(
+    assistant, prompt_input: str, messages: list, top_k: int = 4, timeout: float = None
+):
+    """
+    builds the context for a chat turn without waiting for the query maker before retrieving:
+    the raw prompt is searched for while the search queries are generated in the background,
+    then the generated queries are searched for and both result sets are merged.
+    if the queries are not ready within timeout seconds (global setting query_maker_timeout_seconds
+    when None, 0 waits) the context is built from the prompt's results alone.
+    returns the context and a report of the queries, tokens and passages used
+    """
+    if timeout is None:
+        timeout = get_global_setting_value("query_maker_timeout_seconds")
+    # a copy of the messages, the session may append to them while the queries are generated
+    future = get_query_maker_pool().submit(
+        generate_search_queries, prompt_input=prompt_input, messages=list(messages)
+    )
+    prompt_results = retrieve_results(assistant=assistant, queries=[prompt_input], top_k=top_k)
+    timed_out = False
+    try:
+        queries = future.result(timeout=timeout or None)
+    except FutureTimeoutError:
+        # the queries are still cached when they arrive
+        logging.info(f"search queries not ready after {timeout} seconds, using the prompt only")
+        queries, timed_out = [], True
+    except Exception as e:
+        logging.error(f"search queries could not be generated: {e}")
+        queries = []
+    extra_queries = [q for q in queries if q.strip() and q != prompt_input]
+    query_results = retrieve_results(assistant=assistant, queries=extra_queries, top_k=top_k)
+    context, report = build_context_from_results(
+        assistant, merge_results(prompt_results, query_results)
+    )
+    report["queries"] = [prompt_input] + extra_queries
+    report["query_maker_timed_out"] = timed_out
+    return context, report
+
+
+def add_context_from_queries(
+    messages: list, queries: list, assistant: object, top_k: int = 4
+):
+    """
+    takes a list of queries, messages and an assistant
+    builds the context from the results (see build_context) and adds it to the messages
+    """
+    context, _ = build_context(assistant=assistant, queries=queries, top_k=top_k)
     # add context to prompt
     request_messages = messages + [{"role": "user", "content": "context: " + context}]
     return request_messages
@@ -297,34 +474,32 @@ if __name__ == "__main__":
     contents = merge_multiple_strings(unique_results)
     print(len(contents))
 
-    chunk_ids = [result.metadata["chunk_id"] for result in unique_results]
-    print(chunk_ids)
-    # count number of words in each result.metadata['content']
+    keys = [result.key for result in unique_results]
+    print(keys)
+    # count number of words in each result's chained content and text
 
     sum_chain = 0
     sum_page = 0
     for result in unique_results:
-        sum_chain += len(result.metadata["chained_content"].split(" "))
-        sum_page += len(result.page_content.split(" "))
+        sum_chain += len(result.chained_content.split(" "))
+        sum_page += len(result.text.split(" "))
     print(sum_chain, sum_page)
 
     sum_content = 0
-    for c in contents:
+    for c, _ in contents:
         sum_content += len(c.split(" "))
     print(sum_content)
 
-    class Result:
-        def __init__(self, metadata: dict):
-            self.metadata = metadata
-
     # create a test list og three overlapping results
     results = [
-        Result(metadata={"chunk_id": 1, "chained_content": "this is the first result"}),
-        Result(
-            metadata={"chunk_id": 2, "chained_content": "first result second result"}
+        RetrievalResult(
+            source_id="s", chunk_id=1, text="", chained_content="this is the first result"
+        ),
+        RetrievalResult(
+            source_id="s", chunk_id=2, text="", chained_content="first result second result"
         ),
-        Result(
-            metadata={"chunk_id": 3, "chained_content": "second result third result"}
+        RetrievalResult(
+            source_id="s", chunk_id=3, text="", chained_content="second result third result"
         ),
     ]
     # set chained_content
@@ -0,0 +1,132 @@
+""" cache, fast-path and model selection for the query maker"""
+from src.basic_data_classes import LLM
+from src.sqlite.db_utils import get_llm, get_active_llms
+from src.sqlite.gov_db_utils import get_global_setting_value
+from collections import OrderedDict
+import hashlib
+import threading
+import time
+import re
+
+"""
+generating search queries costs an llm round trip before retrieval can start.
+queries are cached by the normalized tail of the conversation (global setting query_cache_size
+and query_cache_ttl_minutes), and short questions that do not refer back to the conversation
+are searched for directly (global setting query_fast_path_max_words, 0 disables the fast-path).
+the query maker model and its max tokens are set with query_maker_llm_id and query_maker_max_tokens
+"""
+
+# the number of messages before the prompt that make up the cache key
+CACHE_TAIL_MESSAGES = 4
+# words that refer back to the conversation, a question holding one is not self-contained
+REFERRING_WORDS = {
+    "det", "den", "dette", "denne", "disse", "de", "dem", "deres", "dens", "dets",
+    "han", "hun", "ham", "hende", "hans", "hendes", "samme", "ovenstående", "førnævnte",
+    "it", "its", "this", "that", "these", "those", "they", "them", "their",
+    "he", "she", "him", "her", "his", "same", "above",
+}
+# words that continue the previous turn when they open a question
+FOLLOW_UP_OPENERS = {"og", "men", "også", "hvad med", "and", "but", "also", "what about"}
+
+# cache key -> (time cached, queries), least recently used first
+_cache = OrderedDict()
+# guards _cache and _stats
+_cache_lock = threading.Lock()
+_stats = {"cache_hits": 0, "cache_misses": 0, "fast_path": 0, "llm_calls": 0}
+
+
+def _words(text: str) -> list:
+    return re.findall(r"\w+", text.lower())
+
+
+def normalize_conversation_tail(prompt_input: str, messages: list) -> str:
+    """the prompt and the last messages before it, lowercased and with whitespace collapsed"""
+    tail = [m for m in messages if m["role"] != "system"][-CACHE_TAIL_MESSAGES:]
+    tail.append({"role": "user", "content": prompt_input})
+    return "\n".join(f"{m['role']}: {' '.join(_words(m['content']))}" for m in tail)
+
+
+def cache_key(prompt_input: str, messages: list, llm: LLM) -> str:
+    """the cache key of a prompt in a conversation for a query maker model"""
+    tail = normalize_conversation_tail(prompt_input, messages)
+    return hashlib.sha256(f"{llm.id}\n{tail}".encode("utf-8")).hexdigest()
+
+
+def is_self_contained(prompt_input: str, messages: list) -> bool:
+    """
+    true if the prompt is a short question that can be searched for as it is:
+    at most query_fast_path_max_words words and, unless it is the first question
+    in the conversation, no words referring back to it
+    """
+    max_words = get_global_setting_value("query_fast_path_max_words")
+    words = _words(prompt_input)
+    if not words or len(words) > max_words:
+        return False
+    if not any(m["role"] == "user" for m in messages):
+        return True
+    opener = " ".join(words[:2])
+    if words[0] in FOLLOW_UP_OPENERS or opener in FOLLOW_UP_OPENERS:
+        return False
+    return not REFERRING_WORDS.intersection(words)
+
+
+def get_query_maker() -> LLM | None:
+    """the model generating search queries: the query_maker_llm_id global setting if it is active,
+    otherwise the first active model. None if no model is active"""
+    llm_id = get_global_setting_value("query_maker_llm_id")
+    if llm_id:
+        llm = get_llm(llm_id)
+        if llm is not None and llm.is_active:
+            return llm
+    active_llms = get_active_llms()
+    return active_llms[0] if active_llms else None
+
+
+def get_cached_queries(key: str) -> list | None:
+    """the cached queries of a key, None if missing or expired. counts hits and misses"""
+    ttl = get_global_setting_value("query_cache_ttl_minutes") * 60
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None and time.monotonic() - entry[0] <= ttl:
+            _cache.move_to_end(key)
+            _stats["cache_hits"] += 1
+            return list(entry[1])
+        _cache.pop(key, None)
+        _stats["cache_misses"] += 1
+        return None
+
+
+def cache_queries(key: str, queries: list):
+    """cache the queries of a key, evicting the least recently used over query_cache_size"""
+    size = get_global_setting_value("query_cache_size")
+    with _cache_lock:
+        _cache[key] = (time.monotonic(), list(queries))
+        _cache.move_to_end(key)
+        while len(_cache) > size:
+            _cache.popitem(last=False)
+
+
+def count(event: str):
+    """count a query generation event: fast_path or llm_calls"""
+    with _cache_lock:
+        _stats[event] += 1
+
+
+def get_query_generation_stats() -> dict:
+    """counters of query generation since start, with the cache and fast-path hit rates"""
+    with _cache_lock:
+        stats = dict(_stats, cached_entries=len(_cache))
+    prompts = stats["cache_hits"] + stats["cache_misses"] + stats["fast_path"]
+    lookups = stats["cache_hits"] + stats["cache_misses"]
+    stats["prompts"] = prompts
+    stats["cache_hit_rate"] = stats["cache_hits"] / lookups if lookups else 0.0
+    stats["fast_path_rate"] = stats["fast_path"] / prompts if prompts else 0.0
+    return stats
+
+
+def clear_query_cache():
+    """empty the query cache and reset the counters"""
+    with _cache_lock:
+        _cache.clear()
+        for event in _stats:
+            _stats[event] = 0
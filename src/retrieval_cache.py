@@ -0,0 +1,73 @@
+""" cache of search results per collection, invalidated by a version counter in the database"""
+from src.basic_data_classes import CollectionVersion
+from src.sqlite.queries import select_one, increment
+from src.sqlite.gov_db_utils import get_global_setting_value
+from collections import OrderedDict
+import threading
+import logging
+
+"""
+follow-up questions and regenerated answers often search for the same queries again.
+the hits of a query in a collection are cached in memory under the collection's version,
+a counter stored in the collectionversions table and bumped by index_source and remove_source,
+so results from before the collection changed are never returned.
+the least recently used queries are evicted over the global setting retrieval_cache_size
+"""
+
+# (collection name, version, k, normalized query) -> hits, least recently used first
+_cache = OrderedDict()
+# guards _cache and _stats
+_cache_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+
+def get_collection_version(collection_name: str) -> int:
+    """the number of changes to a collection, 0 if it was never changed"""
+    version = select_one(CollectionVersion, collection_name)
+    return version.version if version else 0
+
+
+def bump_collection_version(collection_name: str) -> int:
+    """count a change to a collection, its cached results are no longer used"""
+    version = increment(CollectionVersion, collection_name, "version")
+    logging.info(f"collection {collection_name} is now at version {version}")
+    return version
+
+
+def get_cached_hits(collection_name: str, version: int, k: int, query: str) -> list | None:
+    """the cached hits of a normalized query, None if not cached. counts hits and misses"""
+    key = (collection_name, version, k, query)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            _stats["hits"] += 1
+            return _cache[key]
+        _stats["misses"] += 1
+        return None
+
+
+def cache_hits(collection_name: str, version: int, k: int, query: str, hits: list):
+    """cache the hits of a normalized query, evicting the least recently used over the size"""
+    size = get_global_setting_value("retrieval_cache_size")
+    with _cache_lock:
+        _cache[(collection_name, version, k, query)] = hits
+        _cache.move_to_end((collection_name, version, k, query))
+        while len(_cache) > size:
+            _cache.popitem(last=False)
+
+
+def get_retrieval_cache_stats() -> dict:
+    """counters of the retrieval cache since start, with the hit rate"""
+    with _cache_lock:
+        stats = dict(_stats, cached_entries=len(_cache))
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    return stats
+
+
+def clear_retrieval_cache():
+    """empty the retrieval cache and reset the counters"""
+    with _cache_lock:
+        _cache.clear()
+        for event in _stats:
+            _stats[event] = 0
@@ -7,11 +7,24 @@ from sqlite3 import Connection
 import shutil
 import datetime
 from pathlib import Path
-from src.basic_data_classes import GlobalSetting, LLM, Source, Assistant, User
+from src.basic_data_classes import (
+    GlobalSetting,
+    LLM,
+    Source,
+    Assistant,
+    User,
+    IngestionJob,
+    CollectionVersion,
+)
 from pydantic import BaseModel
 import dotenv as de
+import threading
+import atexit
 import logging
-data_classes = [GlobalSetting, Source, Assistant, User, LLM]
+data_classes = [GlobalSetting, Source, Assistant, User, LLM, IngestionJob, CollectionVersion]
+# bump when the tables generated from the data classes change,
+# existing databases are then migrated by migrate_database
+SCHEMA_VERSION = 9
 
 def get_env(name):
     # Load the variables from the .env file into the environment
@@ -34,6 +47,73 @@ def get_or_create_database(db_name) -> Connection:
     return conn
 
 
+# connections to the main database are kept open and reused per thread,
+# streamlit runs each script run on a thread of its own
+_local = threading.local()
+_connections = {}  # thread id -> open connection
+_connections_lock = threading.Lock()
+_database_location = None
+# bumped by close_connections so threads reopen their closed connections
+_generation = 0
+
+
+def get_database_location() -> Path:
+    """resolve the main database location from .env once"""
+    global _database_location
+    if _database_location is None:
+        _database_location = Path(get_env("MAIN_DATABASE_LOCATION"))
+    return _database_location
+
+
+def _open_connection(db_name) -> Connection:
+    """open a connection to the database in WAL mode with a larger page cache"""
+    db_name.parent.mkdir(exist_ok=True)
+    # connections may be closed from other threads by close_connections
+    conn = sqlite3.connect(db_name, check_same_thread=False, cached_statements=256)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL;")
+    # NORMAL is safe in WAL mode and avoids an fsync on every commit
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute("PRAGMA cache_size=-16000;")  # 16 MB
+    return conn
+
+
+def get_connection() -> Connection:
+    """get the open connection to the main database for the current thread"""
+    if getattr(_local, "generation", None) == _generation:
+        return _local.connection
+    conn = _open_connection(get_database_location())
+    with _connections_lock:
+        # close connections left behind by finished threads
+        alive = {t.ident for t in threading.enumerate()}
+        for thread_id in [t for t in _connections if t not in alive]:
+            _connections.pop(thread_id).close()
+        old_conn = _connections.pop(threading.get_ident(), None)
+        if old_conn is not None:
+            old_conn.close()
+        _connections[threading.get_ident()] = conn
+        _local.connection = conn
+        _local.generation = _generation
+    return conn
+
+
+def close_connections():
+    """
+    close all open connections to the main database
+    the database location is resolved again on next use
+    """
+    global _database_location, _generation
+    with _connections_lock:
+        for conn in _connections.values():
+            conn.close()
+        _connections.clear()
+        _database_location = None
+        _generation += 1
+
+
+atexit.register(close_connections)
+
+
 def backup(sources: list | str = None):
     """
     :param sources: a list of file or directory paths to backup
@@ -50,6 +130,9 @@ def backup(sources: list | str = None):
     logging.info(f"backup attempt started at {current_datetime}")
     if sources is None:
         sources = [database_location, vector_db_location]
+    # move the write-ahead log into the main database file before copying it
+    if database_location.exists():
+        get_connection().execute("PRAGMA wal_checkpoint(FULL);")
 
     for src in list(sources):
         # Source file path
@@ -105,8 +188,7 @@ def get_backups():
 
 
 def execute_query(query: str, fetchall=True):
-    database_location = Path(get_env("MAIN_DATABASE_LOCATION"))
-    conn = get_or_create_database(database_location)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute(query)
     conn.commit()
@@ -136,17 +218,33 @@ def create_table_from_dict(conn: Connection, table: dict):
     conn.commit()
 
 
-def create_table_from_dataclass(dataclass: BaseModel, table_name=None):
+# booleans are stored as 0/1 and datetimes as microseconds since 1970-01-01
+_epoch = datetime.datetime(1970, 1, 1)
+
+
+def to_db_value(value):
+    """convert a field value to the value stored in the database"""
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone().replace(tzinfo=None)
+        return (value - _epoch) // datetime.timedelta(microseconds=1)
+    return value
+
+
+def from_db_value(value, annotation):
+    """convert a value stored in the database to a value for a field with the given type"""
+    if annotation is datetime.datetime and isinstance(value, int):
+        return _epoch + datetime.timedelta(microseconds=value)
+    return value
+
+
+def get_table_schema(dataclass: BaseModel, table_name=None) -> list[str]:
     """
-    create a table in the database from a pydantic dataclass
-    :param conn: an sqlite connection object
-    :param dataclass: a pydantic dataclass
-        id field is expected to exist in the dataclass is set to primary key
-    :param table_name: (optional) the name of the table to create
+    get the statements creating the table and its indexes for a pydantic dataclass
+    fields declared with json_schema_extra={"index": True} get a secondary index
     """
-    database_location = Path(get_env("MAIN_DATABASE_LOCATION"))
-    conn = get_or_create_database(database_location)
-    cursor = conn.cursor()
     if table_name is None:
         table_name = (dataclass.__name__ + "s").lower()
     # map pydantic data types to sqlite data types
@@ -155,7 +253,7 @@ def create_table_from_dataclass(dataclass: BaseModel, table_name=None):
         "int": "INTEGER",
         "float": "REAL",
         "bool": "INTEGER",
-        "datetime": "TEXT",
+        "datetime": "INTEGER",
     }
     fields = ", ".join(
         [
@@ -164,11 +262,32 @@ def create_table_from_dataclass(dataclass: BaseModel, table_name=None):
             if field != "id"
         ]
     )
-    query = f"CREATE TABLE {table_name} (id TEXT NOT NULL UNIQUE, {fields}, PRIMARY KEY (id))"
-    print(query)
-    cursor.execute(query)
+    statements = [f"CREATE TABLE {table_name} (id TEXT NOT NULL PRIMARY KEY, {fields})"]
+    for field, info in dataclass.model_fields.items():
+        if (info.json_schema_extra or {}).get("index"):
+            statements.append(
+                f"CREATE INDEX IF NOT EXISTS {table_name}_{field}_idx "
+                f"ON {table_name} ({field})"
+            )
+    return statements
+
+
+def create_table_from_dataclass(dataclass: BaseModel, table_name=None):
+    """
+    create a table in the database from a pydantic dataclass
+    :param conn: an sqlite connection object
+    :param dataclass: a pydantic dataclass
+        id field is expected to exist in the dataclass is set to primary key
+    :param table_name: (optional) the name of the table to create
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    if table_name is None:
+        table_name = (dataclass.__name__ + "s").lower()
+    for query in get_table_schema(dataclass, table_name):
+        print(query)
+        cursor.execute(query)
     conn.commit()
-    conn.close()
     logging.info(f"created table {table_name}")
 
 
@@ -185,8 +304,7 @@ def create_tables_from_dataclasses(dataclasses: list[BaseModel]):
 
 
 def delete_table(table_name):
-    database_location = Path(get_env("MAIN_DATABASE_LOCATION"))
-    conn = get_or_create_database(database_location)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute(f"DROP TABLE {table_name};")
     conn.commit()
@@ -243,6 +361,97 @@ def migrate_table(from_table: str, to_table: str):
     execute_query(query)
 
 
+def get_schema_version() -> int:
+    """get the schema version of the main database"""
+    return get_connection().execute("PRAGMA user_version;").fetchone()[0]
+
+
+def set_schema_version(version: int = SCHEMA_VERSION):
+    """set the schema version of the main database"""
+    conn = get_connection()
+    conn.execute(f"PRAGMA user_version={int(version)};")
+    conn.commit()
+
+
+def _legacy_to_db_value(value, annotation):
+    """convert a value stored by an older schema, e.g. 'True' or '2024-01-31 12:00:00'"""
+    if isinstance(value, str) and annotation is bool:
+        return int(value == "True")
+    if isinstance(value, str) and annotation is datetime.datetime:
+        if value.isdigit():
+            return int(value)
+        return to_db_value(datetime.datetime.fromisoformat(value))
+    return value
+
+
+def migrate_database(dataclasses: list[BaseModel] = data_classes):
+    """
+    bring an existing main database up to date with the dataclasses
+    tables are rebuilt with the current columns, types and indexes and their rows copied,
+    columns missing in the old table get the field default.
+    Does nothing if the database already has the current schema version
+    """
+    if get_schema_version() >= SCHEMA_VERSION:
+        return
+    conn = get_connection()
+    # views would block renaming the tables, they are dropped and recreated
+    views = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type='view';"
+    ).fetchall()
+    table_names = get_table_names(conn)
+    try:
+        conn.execute("BEGIN;")
+        for view in views:
+            conn.execute(f"DROP VIEW {view['name']};")
+        for dataclass in dataclasses:
+            table_name = (dataclass.__name__ + "s").lower()
+            if table_name not in table_names:
+                for query in get_table_schema(dataclass, table_name):
+                    conn.execute(query)
+                continue
+            for query in get_table_schema(dataclass, table_name + "_new"):
+                conn.execute(query)
+            fields = dataclass.model_fields
+            for row in conn.execute(f"SELECT * FROM {table_name};").fetchall():
+                old_values = dict(row)
+                values = []
+                for field, info in fields.items():
+                    if field in old_values:
+                        values.append(
+                            _legacy_to_db_value(old_values[field], info.annotation)
+                        )
+                    elif info.is_required():
+                        values.append(None)
+                    else:
+                        values.append(
+                            to_db_value(info.get_default(call_default_factory=True))
+                        )
+                conn.execute(
+                    f"INSERT INTO {table_name}_new ({', '.join(fields)}) "
+                    f"VALUES ({', '.join('?' for _ in fields)})",
+                    values,
+                )
+            conn.execute(f"DROP TABLE {table_name};")
+            conn.execute(f"ALTER TABLE {table_name}_new RENAME TO {table_name};")
+            # the indexes keep the names they were created with for the _new table
+            for index in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type='index' AND tbl_name=?;",
+                (table_name,),
+            ).fetchall():
+                if index["name"].startswith(f"{table_name}_new_"):
+                    conn.execute(f"DROP INDEX {index['name']};")
+            for query in get_table_schema(dataclass, table_name)[1:]:
+                conn.execute(query)
+        for view in views:
+            conn.execute(view["sql"])
+        conn.execute(f"PRAGMA user_version={SCHEMA_VERSION};")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    logging.info(f"main database migrated to schema version {SCHEMA_VERSION}")
+
+
 def delete_vector_db():
     """delete the vector database"""
     directory =  Path(get_env("VECTOR_DB_LOCATION"))
@@ -268,7 +477,8 @@ def initialize_database_from_dataclasses(dataclasses: list[BaseModel] = data_cla
     backup([database_location, vector_db_location])
     delete_vector_db()
 
-    conn = get_or_create_database(database_location)  # create the database
+    close_connections()  # the database location is resolved again
+    conn = get_connection()  # create the database
     try:
         # check if database already exists
         table_names = get_table_names(conn)
@@ -277,10 +487,9 @@ def initialize_database_from_dataclasses(dataclasses: list[BaseModel] = data_cla
 
         for dataclass in dataclasses:
             create_table_from_dataclass(dataclass)
-        conn.close()
+        set_schema_version()
     except Exception as e:
         print(e)
-        conn.close()
         return
 
 
@@ -316,8 +525,11 @@ def recreate_db_from_backup(time: str):
         bak_file_path = bak_file_paths[-1]
         bak_files.append(bak_file_path)
 
-    # delete the database file if it exists
+    # close open connections and delete the database file if it exists
+    close_connections()
     database_location.unlink(missing_ok=True)
+    Path(f"{database_location}-wal").unlink(missing_ok=True)
+    Path(f"{database_location}-shm").unlink(missing_ok=True)
     print(f"Deleted database: {database_location}")
     # delete the vector database if it exists
     delete_vector_db(vector_db_location)
@@ -340,20 +552,16 @@ def insert_row(
     insert the row into the corresponding table
     the table must first be created from the dataclass using create_table_from_dataclass
     """
-    database_location = Path(get_env("MAIN_DATABASE_LOCATION"))
-    conn = get_or_create_database(database_location)
+    conn = get_connection()
     cursor = conn.cursor()
     if table_name is None:
         table_name = (type(dataobject).__name__ + "s").lower()
     fields = ", ".join(dataobject.model_fields.keys())
-    values = dataobject.model_dump().values()
-    # escape single quotes in values by replacing ' with ''
-    values = [v.replace("'", "''") if isinstance(v, str) else v for v in values]
-    values = ", ".join([f"'{v}'" for v in values])
-    query = f"INSERT INTO {table_name} ({fields}) VALUES ({values})"
-    cursor.execute(query)
+    values = [to_db_value(v) for v in dataobject.model_dump().values()]
+    placeholders = ", ".join("?" for _ in values)
+    query = f"INSERT INTO {table_name} ({fields}) VALUES ({placeholders})"
+    cursor.execute(query, values)
     conn.commit()
-    conn.close()
     logging.info(f"inserted row with id: {dataobject.id} into {table_name} table")
 
 
@@ -365,20 +573,16 @@ def add_or_update_row(
     insert the row into the corresponding table
     the table must first be created from the dataclass using create_table_from_dataclass
     """
-    database_location = Path(get_env("MAIN_DATABASE_LOCATION"))
-    conn = get_or_create_database(database_location)
+    conn = get_connection()
     cursor = conn.cursor()
     if table_name is None:
         table_name = (type(dataobject).__name__ + "s").lower()
     fields = ", ".join(dataobject.model_fields.keys())
-    values = dataobject.model_dump().values()
-    # escape single quotes in values by replacing ' with ''
-    values = [v.replace("'", "''") if isinstance(v, str) else v for v in values]
-    values = ", ".join([f"'{v}'" for v in values])
-    query = f"REPLACE INTO {table_name} ({fields}) VALUES ({values})"
-    cursor.execute(query)
+    values = [to_db_value(v) for v in dataobject.model_dump().values()]
+    placeholders = ", ".join("?" for _ in values)
+    query = f"REPLACE INTO {table_name} ({fields}) VALUES ({placeholders})"
+    cursor.execute(query, values)
     conn.commit()
-    conn.close()
     logging.info(
         f"inserted or updated row with id: {dataobject.id} into {table_name} table"
     )
@@ -386,8 +590,8 @@ def add_or_update_row(
 
 def get_row(id: str, table_name: str):
     """get a row from the given table with the given id"""
-    query = f"SELECT * FROM {table_name} WHERE id='{id}';"
-    result = execute_query(query)
+    query = f"SELECT * FROM {table_name} WHERE id=?;"
+    result = get_connection().execute(query, (id,)).fetchall()
     return result
 
 
@@ -400,7 +604,16 @@ def get_rows(table_name: str):
 
 def results_to_data_objects(results: list, dataclass):
     """convert a result from a query to a data object"""
-    objects = [dataclass(**dict(r)) for r in results]
+    fields = dataclass.model_fields
+    objects = [
+        dataclass(
+            **{
+                k: from_db_value(v, fields[k].annotation) if k in fields else v
+                for k, v in dict(r).items()
+            }
+        )
+        for r in results
+    ]
     return objects
 
 
@@ -410,7 +623,6 @@ def delete_row(dataobject_or_id: object | str, table_name: str = None):
     dataclass must have an id field
     a table must exist for the dataclass
     """
-    database_location = Path(get_env("MAIN_DATABASE_LOCATION"))
     if isinstance(dataobject_or_id, str):
         id = dataobject_or_id
         if table_name is None:
@@ -420,10 +632,9 @@ def delete_row(dataobject_or_id: object | str, table_name: str = None):
             # infer table name from dataclass
             table_name = (type(dataobject_or_id).__name__ + "s").lower()
         id = dataobject_or_id.id
-    conn = get_or_create_database(database_location)
+    conn = get_connection()
     cursor = conn.cursor()
-    query = f"DELETE FROM {table_name} WHERE id='{id}';"
-    cursor.execute(query)
+    query = f"DELETE FROM {table_name} WHERE id=?;"
+    cursor.execute(query, (id,))
     conn.commit()
-    conn.close()
     logging.info(f"deleted row-id {id} from {table_name} table")
@@ -3,21 +3,27 @@ import os
 from datetime import datetime
 from src.sqlite.db_creation import (
     execute_query,
-    insert_row,
-    delete_row,
     add_or_update_row,
-    get_row,
-    results_to_data_objects,
 )
+from src.sqlite.queries import select, select_one, insert, delete, count
 from src.chroma_utils import (
-    start_chroma_client,
-    get_or_create_collection,
+    get_collection,
+    get_vector_store,
     delete_collection,
     create_source,
     index_source,
     remove_source,
 )
-from src.basic_data_classes import Assistant, User, Source, LLM
+from src.basic_data_classes import (
+    Assistant,
+    User,
+    Source,
+    SourceSummary,
+    LLM,
+    GlobalSetting,
+    IngestionJob,
+)
+from src.answer_cache import invalidate_answer_cache
 from pathlib import Path
 import logging
 
@@ -34,24 +40,18 @@ logging.basicConfig(
 # llm level operations
 def get_active_llms():
     """get all llms from the database where is_active is True"""
-    results = execute_query("SELECT * FROM llms WHERE is_active='True';")
-    # sort results by name key
-    results = sorted(results, key=lambda x: x["name"])
-    llms = results_to_data_objects(results, LLM)
+    llms = select(LLM, is_active=True, order_by="name")
     return llms
 
 
 def get_llm(llm_id):
     """get an llm from the database"""
-    llm_row = get_row(llm_id, "llms")
-    llm = results_to_data_objects(llm_row, LLM)
-    if len(llm) == 1:
-        return llm[0]
+    return select_one(LLM, llm_id)
 
 
 def get_base_url():
     """get the base url for the llm"""
-    return execute_query("SELECT * FROM globalsettings WHERE id='base_url';")[0][1]
+    return select_one(GlobalSetting, "base_url").value
 
 
 # ------------------------
@@ -59,22 +59,32 @@ def get_base_url():
 # each source belongs to one assistant indicated in the assistant_id field
 
 
-def add_source(source):
-    """index source to chroma and add sources table"""
+def add_source(source, replaces_source_id=None, progress_callback=None):
+    """index source to chroma and add sources table
+    replaces_source_id is the source the new one replaces, its unchanged chunks are reused
+    and it is deleted once the new source is indexed"""
     # index source to chroma
-    index_source(source)
+    index_source(source, replaces_source_id=replaces_source_id, progress_callback=progress_callback)
     # add source to sources table
     src = source.model_copy()
-    src.content = src.content.strip()[:500]
-    insert_row(src)
+    src.content = src.content.strip()
+    # a refreshed url source replaces its earlier version
+    insert(src, operation="replace")
+    invalidate_answer_cache(source.collection_name_and_assistant_id)
+    if replaces_source_id and replaces_source_id != source.id:
+        replaced = select_one(Source, replaces_source_id)
+        if replaced is not None:
+            delete_source(replaced)
 
 
 def delete_source(source):
-    """remove source from chroma and delete from sources table"""
+    """remove source from chroma and delete from sources table
+    the source can be a Source or a SourceSummary"""
     # remove source from chroma
     remove_source(source)
     # delete source from sources table
-    delete_row(source)
+    delete(Source, id=source.id)
+    invalidate_answer_cache(source.collection_name_and_assistant_id)
 
 
 # ------------------------
@@ -89,45 +99,46 @@ def add_or_update_assistant(assistant: Assistant):
     # update the assistant
     assistant.last_updated = datetime.now()
     add_or_update_row(assistant)
+    # answers given with the earlier prompt, model or temperature are not reused
+    invalidate_answer_cache(assistant.id)
     # create the collection for the assistant in the vector database
-    get_or_create_collection(assistant.id)
+    get_vector_store(assistant.id)
     print(f"Updated assistant {assistant.id}")
 
 
 def get_assistant(assistant_id):
     """get an assistant from the database"""
-    assistant_row = get_row(assistant_id, "assistants")
-    assistant = results_to_data_objects(assistant_row, Assistant)
-    if len(assistant) == 1:
-        return assistant[0]
+    return select_one(Assistant, assistant_id)
+
+
+def count_assistant_sources(assistant_id):
+    """the number of indexed sources of an assistant"""
+    return count(Source, collection_name_and_assistant_id=assistant_id)
 
 
 def get_assistant_sources(assistant_id):
-    """get all sources for an assistant"""
-    source_rows = execute_query(
-        f"SELECT * FROM sources WHERE collection_name_and_assistant_id='{assistant_id}';"
+    """get all sources for an assistant as SourceSummary, without their content"""
+    sources = select(
+        SourceSummary, table_name="sources", collection_name_and_assistant_id=assistant_id
     )
-    sources = results_to_data_objects(source_rows, Source)
     return sources
 
 
 def delete_assistant(assistant_id):
     """delete an assistant from the database"""
-    execute_query(f"DELETE FROM assistants WHERE id='{assistant_id}';")
+    delete(Assistant, id=assistant_id)
+    # jobs not yet picked up by a worker are dropped, running jobs clean up after themselves
+    delete(IngestionJob, assistant_id=assistant_id)
     # delete the collection
     delete_collection(assistant_id)
     # delete the sources using collection_name_and_assistant_id column in sources table
-    execute_query(
-        f"DELETE FROM sources WHERE collection_name_and_assistant_id='{assistant_id}';"
-    )
+    delete(Source, collection_name_and_assistant_id=assistant_id)
     print(f"Deleted assistant {assistant_id}")
 
 
 def get_assistant_collection(assistant_id):
     """get the collection for an assistant"""
-    client = start_chroma_client()
-    collection = client.get_collection(name=assistant_id)
-    return collection
+    return get_collection(assistant_id)
 
 
 # ------------------------
@@ -141,21 +152,13 @@ def add_or_get_user(user: User | dict):
         user = User(**user)
     elif not type(user) == User:
         raise ValueError("user must be a User class or a dict")
-    found_user = execute_query(f"SELECT * FROM users WHERE id='{user.id}';")
-    if len(found_user) == 1:
-        print(f"User {found_user[0][0]} fetched")
-        # currently user are missing email, username, and passwords
-        # to avoid validation problems (e-mail), we will remove empty fields
-        user_dict = {k: v for k, v in dict(found_user[0]).items() if v != ""}
-        user = User(**user_dict)
-        return user
-
-    columns = ", ".join(k for k in user.model_dump().keys())
-    values = ", ".join([f"'{v}'" for k, v in user.model_dump().items()])
-    execute_query(
-        f" INSERT OR IGNORE INTO users ({columns}) VALUES ({values});",
-        fetchall=False,
-    )
+    # empty fields such as a missing e-mail are left out when reading the user
+    found_user = select_one(User, user.id)
+    if found_user is not None:
+        print(f"User {found_user.id} fetched")
+        return found_user
+
+    insert(user, operation="insert or ignore")
     print(f"User {user.id} created")
     return user
 
@@ -180,7 +183,7 @@ def delete_user(user: User | dict, and_assistants=True):
         for assistant in assistants:
             delete_assistant(assistant.id)
     # delete the user
-    execute_query(f"DELETE FROM users WHERE id='{user.id}';")
+    delete(User, id=user.id)
 
 
 def get_user_assistants(user: User | dict):
@@ -189,8 +192,7 @@ def get_user_assistants(user: User | dict):
         user = User(**user)
     elif not type(user) == User:
         raise ValueError("user must be a User class or a dict")
-    assistants = execute_query(f"SELECT * FROM assistants WHERE owner_id='{user.id}';")
-    assistants = [Assistant(**a) for a in assistants]
+    assistants = select(Assistant, owner_id=user.id)
     # sort by creation_time
     assistants = sorted(assistants, key=lambda x: x.creation_time)
     return assistants
@@ -1,12 +1,12 @@
 """gov utilties for sqlite """
 from src.sqlite.db_creation import (
     execute_query,
+    insert_row,
     add_or_update_row,
-    get_row,
     get_rows,
     delete_row,
-    results_to_data_objects,
 )
+from src.sqlite.queries import select, select_one
 from src.basic_data_classes import LLM, GlobalSetting, Assistant, User
 from datetime import datetime
 
@@ -30,24 +30,22 @@ from datetime import datetime
 
 def get_deployed_llms():
     """get all llms from the database"""
-    results = get_rows("llms")
-    # sort reults by name key
-    results = sorted(results, key=lambda x: x["name"])
-    llms = results_to_data_objects(results, LLM)
+    llms = select(LLM, order_by="name")
     return llms
 
 
 def deploy_llm(llm: LLM):
     """add an llm to the database or update if it already exists"""
+    # a new updated_at also gives the llm a new api client
+    llm.updated_at = datetime.now()
     # add llm to llms table
     add_or_update_row(llm)
 
 
 def activate_llm(llm_id: str):
     """activate an llm"""
-    llm = get_row(llm_id, "llms")
-    if len(llm) == 1:
-        llm = LLM(**llm[0])  # convert to LLM object
+    llm = select_one(LLM, llm_id)
+    if llm is not None:
         llm.is_active = True
         add_or_update_row(llm)
     else:
@@ -56,9 +54,8 @@ def activate_llm(llm_id: str):
 
 def deactivate_llm(llm_id: str):
     """deactivate an llm"""
-    llm = get_row(llm_id, "llms")
-    if len(llm) == 1:
-        llm = LLM(**llm[0])
+    llm = select_one(LLM, llm_id)
+    if llm is not None:
         llm.is_active = False
         add_or_update_row(llm)
     else:
@@ -83,19 +80,64 @@ def delete_llm(llm_or_id: LLM | str):
 # }
 
 
+# global settings that were added after the first release of MyGPTs
+# these are inserted with their default value when missing from an existing database
+optional_global_settings = {
+    "embeddings_memory_cap_mb": 2048,  # max memory used by loaded embedding models
+    "llm_max_connections": 20,  # connection pool size per llm client
+    "llm_timeout_seconds": 60.0,  # timeout for llm api requests
+    "ingestion_workers": 2,  # background threads indexing sources
+    "ingestion_max_attempts": 3,  # attempts before an ingestion job fails
+    "document_loader_workers": 4,  # processes parsing uploaded files
+    "url_fetch_per_host_limit": 4,  # concurrent requests to the same host
+    "url_fetch_max_connections": 20,  # open connections of the shared url client
+    "url_fetch_timeout_seconds": 30.0,
+    "url_refresh_concurrency": 2,  # url sources refreshed at a time by the scheduler
+    "url_refresh_check_minutes": 15,  # how often the scheduler looks for sources due
+    "query_maker_llm_id": "",  # model generating search queries, empty for the first active model
+    "query_maker_max_tokens": 400,
+    "query_cache_size": 1000,  # generated queries kept in memory
+    "query_cache_ttl_minutes": 60,
+    "query_fast_path_max_words": 12,  # longest question searched for without the query maker
+    "query_maker_timeout_seconds": 10.0,  # wait for generated queries, 0 waits until they are ready
+    "answer_cache_size": 500,  # answers kept for assistants with the answer cache enabled
+    "answer_cache_ttl_minutes": 1440,
+    "answer_cache_similarity": 0.95,  # cosine similarity of questions sharing an answer
+    "retrieval_cache_size": 5000,  # search results of queries kept in memory
+    "chroma_health_check_seconds": 30,  # how often the shared chroma http client is checked
+    "chroma_collection_cache_size": 200,  # collection handles kept open
+}
+
+
 def get_global_setting(setting_id: str) -> GlobalSetting:
     """get a global setting from the database"""
-    result = get_row(setting_id, "globalsettings")
-    setting = results_to_data_objects(result, GlobalSetting)[0]
-    # using setting.type convert setting.value to proper type
-
+    setting = select_one(GlobalSetting, setting_id)
+    if setting is None:
+        raise IndexError(f"global setting {setting_id} not found")
     return setting
 
 
+def get_global_setting_value(setting_id: str):
+    """get the value of a global setting converted to its proper type
+    falls back to the default of optional global settings missing from the database
+    """
+    setting = select_one(GlobalSetting, setting_id)
+    if setting is None:
+        if setting_id in optional_global_settings:
+            return optional_global_settings[setting_id]
+        raise IndexError(f"global setting {setting_id} not found")
+    if setting.type == "int":
+        return int(setting.value)
+    elif setting.type == "float":
+        return float(setting.value)
+    elif setting.type == "bool":
+        return setting.value == "True"
+    return setting.value
+
+
 def get_global_settings() -> list[GlobalSetting]:
     """get all llms from the database"""
-    result = get_rows("globalsettings")
-    settings = results_to_data_objects(result, GlobalSetting)
+    settings = select(GlobalSetting)
     return settings
 
 
@@ -125,6 +167,18 @@ def set_global_setting(global_setting: GlobalSetting | dict):
     add_or_update_row(global_setting)
 
 
+def add_missing_global_settings(defaults: dict = optional_global_settings):
+    """insert the global settings in defaults that do not exist in the database yet"""
+    existing_ids = [setting.id for setting in get_global_settings()]
+    for k, v in defaults.items():
+        if k not in existing_ids:
+            insert_row(
+                GlobalSetting(
+                    id=k, value=str(v), default_value=str(v), type=type(v).__name__
+                )
+            )
+
+
 def reset_global_setting(setting_id: str):
     """reset global settings to default"""
     # set value to default_value
@@ -144,8 +198,7 @@ def reset_all_global_settings():
 # 1 - assistant level operations
 def get_all_assistants():
     """get all assistants from the database"""
-    results = get_rows("assistants")
-    assistants = results_to_data_objects(results, Assistant)
+    assistants = select(Assistant)
     return assistants
 
 
@@ -161,8 +214,7 @@ def get_all_assistants():
 
 def get_all_users():
     """get all users from the database"""
-    results = get_rows("users")
-    users = results_to_data_objects(results, User)
+    users = select(User)
     return users
 
 
@@ -0,0 +1,147 @@
+""" typed queries for the pydantic data classes using bound parameters """
+from src.sqlite.db_creation import get_connection, to_db_value, from_db_value
+from pydantic import BaseModel
+from functools import lru_cache
+import logging
+
+"""
+select, insert and delete rows of the tables created from the data classes
+sql statements are built once per data class and operation and use bound parameters,
+so sqlite can reuse the compiled statement from its statement cache
+"""
+
+
+def get_table_name(dataclass: type[BaseModel]) -> str:
+    """the table name of a data class, e.g. Assistant -> assistants"""
+    return (dataclass.__name__ + "s").lower()
+
+
+@lru_cache(maxsize=None)
+def build_statement(
+    dataclass: type[BaseModel],
+    operation: str,
+    table_name: str,
+    where: tuple = (),
+    order_by: str = None,
+) -> str:
+    """
+    build the sql statement for an operation on the table of a data class
+    :param operation: one of select, count, insert, insert or ignore, replace, delete
+    :param where: the names of the columns to filter on with bound parameters
+    """
+    fields = list(dataclass.model_fields)
+    for column in where + ((order_by,) if order_by else ()):
+        if column not in fields:
+            raise ValueError(f"{column} is not a field of {dataclass.__name__}")
+    if operation == "select":
+        statement = f"SELECT {', '.join(fields)} FROM {table_name}"
+    elif operation == "count":
+        statement = f"SELECT COUNT(*) FROM {table_name}"
+    elif operation in ("insert", "insert or ignore", "replace"):
+        placeholders = ", ".join("?" for _ in fields)
+        return (
+            f"{operation.upper()} INTO {table_name} "
+            f"({', '.join(fields)}) VALUES ({placeholders})"
+        )
+    elif operation == "delete":
+        statement = f"DELETE FROM {table_name}"
+    else:
+        raise ValueError(f"unknown operation {operation}")
+    if where:
+        statement += " WHERE " + " AND ".join(f"{column}=?" for column in where)
+    if order_by:
+        statement += f" ORDER BY {order_by}"
+    return statement
+
+
+def select(
+    dataclass: type[BaseModel], table_name: str = None, order_by: str = None, **filters
+) -> list:
+    """
+    get the rows of a data class table as data objects
+    keyword arguments filter on column values, e.g. select(Assistant, owner_id=user.id)
+    """
+    table_name = table_name or get_table_name(dataclass)
+    statement = build_statement(
+        dataclass, "select", table_name, tuple(filters), order_by
+    )
+    annotations = [
+        (f, info.annotation, not info.is_required())
+        for f, info in dataclass.model_fields.items()
+    ]
+    cursor = get_connection().cursor()
+    # convert each row directly to a data object, missing values and empty values of
+    # fields with a default are left out so the default applies (e.g. a user without email)
+    cursor.row_factory = lambda _, row: dataclass.model_validate(
+        {
+            field: from_db_value(value, annotation)
+            for (field, annotation, has_default), value in zip(annotations, row)
+            if value is not None and (value != "" or not has_default)
+        }
+    )
+    cursor.execute(statement, [to_db_value(v) for v in filters.values()])
+    return cursor.fetchall()
+
+
+def count(dataclass: type[BaseModel], table_name: str = None, **filters) -> int:
+    """count the rows of a data class table matching all filters"""
+    table_name = table_name or get_table_name(dataclass)
+    statement = build_statement(dataclass, "count", table_name, tuple(filters))
+    cursor = get_connection().execute(statement, [to_db_value(v) for v in filters.values()])
+    return cursor.fetchone()[0]
+
+
+def select_one(dataclass: type[BaseModel], id: str, table_name: str = None):
+    """get the data object with the given id, or None if it does not exist"""
+    results = select(dataclass, table_name=table_name, id=id)
+    if len(results) == 1:
+        return results[0]
+
+
+def insert(dataobject: BaseModel, operation: str = "insert", table_name: str = None):
+    """
+    insert a data object into the table of its data class
+    :param operation: insert, insert or ignore or replace (insert or update)
+    """
+    dataclass = type(dataobject)
+    table_name = table_name or get_table_name(dataclass)
+    statement = build_statement(dataclass, operation, table_name)
+    conn = get_connection()
+    conn.execute(
+        statement, [to_db_value(v) for v in dataobject.model_dump().values()]
+    )
+    conn.commit()
+    logging.info(f"{operation} row with id: {dataobject.id} into {table_name} table")
+
+
+def delete(dataclass: type[BaseModel], table_name: str = None, **filters):
+    """delete the rows of a data class table matching all filters, returns the number of deleted rows"""
+    if not filters:
+        raise ValueError("at least one filter is required to delete rows")
+    table_name = table_name or get_table_name(dataclass)
+    statement = build_statement(dataclass, "delete", table_name, tuple(filters))
+    conn = get_connection()
+    cursor = conn.execute(statement, [to_db_value(v) for v in filters.values()])
+    conn.commit()
+    logging.info(f"deleted {cursor.rowcount} rows from {table_name} table")
+    return cursor.rowcount
+
+
+def increment(dataclass: type[BaseModel], id: str, field: str, table_name: str = None) -> int:
+    """
+    add one to an integer field of a row in one transaction and return the new value
+    a row with the field defaults is inserted first if the id does not exist
+    """
+    if field not in dataclass.model_fields:
+        raise ValueError(f"{field} is not a field of {dataclass.__name__}")
+    table_name = table_name or get_table_name(dataclass)
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            build_statement(dataclass, "insert or ignore", table_name),
+            [to_db_value(v) for v in dataclass(id=id).model_dump().values()],
+        )
+        (value,) = conn.execute(
+            f"UPDATE {table_name} SET {field} = {field} + 1 WHERE id=? RETURNING {field}", [id]
+        ).fetchone()
+    return value
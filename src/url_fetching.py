@@ -0,0 +1,184 @@
+""" fetch url sources concurrently with a shared pooled http client"""
+from src.basic_data_classes import Source
+from src.sqlite.gov_db_utils import get_global_setting_value
+from src.document_loading import clean_content, content_hash
+from bs4 import BeautifulSoup
+from collections import defaultdict
+from urllib.parse import urlparse
+from pydantic import BaseModel
+import asyncio
+import threading
+import httpx
+import logging
+
+"""
+urls are fetched on one event loop running in a background thread,
+so all sessions share the same http client and its open connections.
+requests to the same host are limited to a few at a time,
+and sources store the etag and last-modified headers of the response,
+so refreshing a source that has not changed only costs a 304 response
+"""
+
+_loop = None
+_client = None
+_host_semaphores = defaultdict(lambda: asyncio.Semaphore(_per_host_limit))
+_per_host_limit = 4
+_loop_lock = threading.Lock()
+
+
+class FetchResult(BaseModel):
+    """the outcome of fetching one url"""
+
+    url: str
+    status_code: int = 0
+    text: str = ""
+    etag: str = ""
+    last_modified: str = ""
+    error: str = ""
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status_code == 304
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """start the event loop thread and the shared http client once per process"""
+    global _loop, _client, _per_host_limit
+    with _loop_lock:
+        if _loop is None:
+            _per_host_limit = get_global_setting_value("url_fetch_per_host_limit")
+            timeout = get_global_setting_value("url_fetch_timeout_seconds")
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, daemon=True).start()
+
+            async def create_client():
+                return httpx.AsyncClient(
+                    timeout=httpx.Timeout(timeout),
+                    limits=httpx.Limits(
+                        max_connections=get_global_setting_value(
+                            "url_fetch_max_connections"
+                        ),
+                        max_keepalive_connections=_per_host_limit,
+                    ),
+                    follow_redirects=True,
+                    headers={"User-Agent": "MyGPTs"},
+                )
+
+            _client = asyncio.run_coroutine_threadsafe(create_client(), loop).result()
+            _loop = loop
+        return _loop
+
+
+def html_to_text(html: str) -> str:
+    """the visible text of a web page, like langchain's WebBaseLoader"""
+    return BeautifulSoup(html, "html.parser").get_text()
+
+
+async def fetch_url(url: str, etag: str = "", last_modified: str = "") -> FetchResult:
+    """get a url, conditionally if validators from an earlier fetch are given"""
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    async with _host_semaphores[urlparse(url).netloc]:
+        try:
+            response = await _client.get(url, headers=headers)
+        except httpx.HTTPError as e:
+            logging.error(f"could not fetch {url}: {e}")
+            return FetchResult(url=url, error=str(e) or type(e).__name__)
+    result = FetchResult(
+        url=url,
+        status_code=response.status_code,
+        etag=response.headers.get("ETag", etag),
+        last_modified=response.headers.get("Last-Modified", last_modified),
+    )
+    if response.status_code == 304:
+        return result
+    if response.status_code >= 400:
+        result.error = f"{response.status_code} {response.reason_phrase}"
+        return result
+    if "html" in response.headers.get("Content-Type", "html"):
+        result.text = clean_content(html_to_text(response.text))
+    else:
+        result.text = clean_content(response.text)
+    return result
+
+
+async def _fetch_all(requests: list) -> list:
+    return await asyncio.gather(*(fetch_url(*request) for request in requests))
+
+
+def fetch_urls(requests: list) -> list:
+    """
+    fetch several urls at once
+    :param requests: (url, etag, last_modified) tuples, the validators may be empty strings
+    returns a FetchResult for each request in the same order
+    """
+    if len(requests) == 0:
+        return []
+    loop = _get_loop()
+    return asyncio.run_coroutine_threadsafe(_fetch_all(requests), loop).result()
+
+
+def _result_to_source(result: FetchResult, c_a_id: str) -> Source:
+    if result.error:
+        raise ConnectionError(f"could not fetch {result.url}: {result.error}")
+    if not result.text:
+        raise ValueError(f"{result.url} has no text")
+    return Source(
+        name=result.url,
+        source_type="url",
+        content_type="url",
+        content=result.text,
+        content_hash=content_hash(result.text),
+        collection_name_and_assistant_id=c_a_id,
+        etag=result.etag,
+        last_modified=result.last_modified,
+    )
+
+
+def load_url_sources(urls: list, c_a_id: str) -> list:
+    """
+    load several urls into sources at once
+    returns a (url, source or exception) tuple for each url in the same order
+    """
+    results = []
+    for result in fetch_urls([(url, "", "") for url in urls]):
+        try:
+            results.append((result.url, _result_to_source(result, c_a_id)))
+        except Exception as e:
+            results.append((result.url, e))
+    return results
+
+
+def refresh_url_sources(sources: list) -> list:
+    """
+    re-fetch url sources conditionally
+    returns a new version of each source, or None if the page has not changed
+    (or could not be fetched, which is logged).
+    the new version keeps the id of the source, so it replaces it when added.
+    the validators received for an unchanged page are set on the source, for the caller to save
+    """
+    results = fetch_urls([(s.name, s.etag, s.last_modified) for s in sources])
+    refreshed = []
+    for source, result in zip(sources, results):
+        if result.not_modified or result.error:
+            refreshed.append(None)
+            continue
+        try:
+            new_source = _result_to_source(result, source.collection_name_and_assistant_id)
+        except ValueError as e:
+            logging.error(f"could not refresh {source.name}: {e}")
+            refreshed.append(None)
+            continue
+        if new_source.content_hash == (source.content_hash or content_hash(source.content)):
+            # the server sent no or other validators, but the page is unchanged.
+            # the new validators make the next refresh a conditional request
+            source.etag = new_source.etag
+            source.last_modified = new_source.last_modified
+            refreshed.append(None)
+        else:
+            new_source.id = source.id
+            refreshed.append(new_source)
+    return refreshed
@@ -0,0 +1,84 @@
+""" refresh the url sources of assistants on a schedule"""
+from src.basic_data_classes import Assistant, Source, SourceSummary
+from src.sqlite.queries import select, select_one, insert
+from src.sqlite.gov_db_utils import get_global_setting_value
+from src.url_fetching import refresh_url_sources
+from src.ingestion import submit_source
+from datetime import datetime, timedelta
+import threading
+import time
+import logging
+
+"""
+a background thread checks regularly for url sources that are due for a refresh
+according to the refresh interval of their assistant. the pages are fetched a few
+at a time (url_refresh_concurrency) so refreshing never takes the connections of
+interactive users, and changed pages are indexed by the ingestion workers,
+where only their new or changed chunks are embedded
+"""
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_sources_due(now: datetime = None) -> list:
+    """get the url sources of active assistants that are due for a refresh,
+    the content is only loaded for the sources that are due"""
+    now = now or datetime.now()
+    due = []
+    for assistant in select(Assistant, is_active=True):
+        if assistant.url_refresh_hours == 0:
+            continue
+        refresh_before = now - timedelta(hours=assistant.url_refresh_hours)
+        due += [
+            select_one(Source, summary.id)
+            for summary in select(
+                SourceSummary,
+                table_name="sources",
+                collection_name_and_assistant_id=assistant.id,
+                source_type="url",
+            )
+            if summary.last_fetched <= refresh_before
+        ]
+    return due
+
+
+def refresh_due_sources(now: datetime = None) -> int:
+    """re-fetch the url sources that are due and queue the changed ones, returns the number changed"""
+    now = now or datetime.now()
+    sources = get_sources_due(now)
+    batch_size = get_global_setting_value("url_refresh_concurrency")
+    changed = 0
+    for i in range(0, len(sources), batch_size):
+        batch = sources[i : i + batch_size]
+        for source, new_source in zip(batch, refresh_url_sources(batch)):
+            # the stored source is marked as fetched right away,
+            # so it is not fetched again while its new version is being indexed
+            source.last_fetched = now
+            insert(source, operation="replace")
+            if new_source is not None:
+                new_source.last_fetched = now
+                submit_source(new_source)
+                changed += 1
+    if sources:
+        logging.info(f"refreshed {len(sources)} url sources, {changed} changed")
+    return changed
+
+
+def _run_scheduler():
+    while True:
+        time.sleep(get_global_setting_value("url_refresh_check_minutes") * 60)
+        try:
+            refresh_due_sources()
+        except Exception as e:
+            logging.error(f"could not refresh url sources: {e}")
+
+
+def start_url_refresh_scheduler():
+    """start the refresh thread once per process"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = threading.Thread(target=_run_scheduler, daemon=True)
+            _scheduler.start()
+            logging.info("started url refresh scheduler")
@@ -0,0 +1,272 @@
+""" the vector store interface used for indexing and retrieval, and a local hnswlib backend"""
+from abc import ABC, abstractmethod
+from pathlib import Path
+import numpy as np
+import sqlite3
+import threading
+import shutil
+import json
+import os
+import logging
+
+try:
+    import hnswlib  # installed with chromadb as chroma-hnswlib
+except ImportError:  # the hnswlib backend is then unavailable
+    hnswlib = None
+
+"""
+a vector store holds the chunks of one assistant: their ids, embeddings, texts and ChunkMetadata.
+index_source, remove_source, query_collection, get_neighbor_chunks and delete_collection
+only use the operations of VectorStore, so the backend can be chosen per deployment
+(VECTOR_STORE_BACKEND in .env, see chroma_utils.get_vector_store).
+the chroma backend is ChromaVectorStore in chroma_utils, HnswVectorStore keeps an hnswlib index
+and an sqlite file with the chunks in a directory per assistant.
+distances are squared l2 distances in both backends, a lower distance is more similar
+"""
+
+
+class VectorStore(ABC):
+    """the chunks of an assistant's collection"""
+
+    @abstractmethod
+    def add(self, ids: list, embeddings: list, documents: list, metadatas: list):
+        """add chunks with their embeddings"""
+
+    @abstractmethod
+    def update_metadatas(self, ids: list, metadatas: list):
+        """replace the metadata of chunks, keeping their embeddings"""
+
+    @abstractmethod
+    def get(self, source_id: str = None, name: str = None, chunk_ranges: list = None) -> dict:
+        """
+        the chunks matching all given filters as a dict of ids, documents and metadatas
+        :param chunk_ranges: (first, last) chunk id ranges, a chunk matches if it is in any of them
+        """
+
+    @abstractmethod
+    def delete(self, ids: list):
+        """delete chunks by id"""
+
+    def delete_source(self, source_id: str) -> int:
+        """delete the chunks of a source, returns the number of deleted chunks"""
+        ids = self.get(source_id=source_id)["ids"]
+        if ids:
+            self.delete(ids)
+        return len(ids)
+
+    @abstractmethod
+    def query(self, query_embeddings: list, k: int) -> dict:
+        """
+        the k nearest chunks of each query embedding
+        as a dict of ids, documents, metadatas and distances with one list per query
+        """
+
+    @abstractmethod
+    def count(self) -> int:
+        """the number of chunks"""
+
+    def flush(self):
+        """write the changes since the last flush to disk,
+        called once at the end of indexing or removing a source.
+        backends that persist every change themselves do nothing"""
+
+    @abstractmethod
+    def drop(self):
+        """delete the collection and all its chunks"""
+
+
+class HnswVectorStore(VectorStore):
+    """
+    chunks embedded in an hnswlib index saved to index.bin, with their ids, texts and metadata
+    in chunks.db in the same directory. the chunks are looked up by the integer labels of the index,
+    the slots of deleted chunks in the index are reused by new chunks.
+    changes are kept in memory and in an open transaction until flush, which saves the index
+    and then commits the chunks, so a crash never leaves committed chunks without vectors
+    """
+
+    def __init__(self, directory: Path, m: int = 16, ef_construction: int = 200, ef: int = 64):
+        if hnswlib is None:
+            raise ImportError("the hnswlib vector store backend requires hnswlib")
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.m, self.ef_construction, self.ef = m, ef_construction, ef
+        # guards the index and the connection, which are shared by all sessions
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(self.directory / "chunks.db", check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL;")
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS chunks (label INTEGER PRIMARY KEY, id TEXT UNIQUE, "
+                "source_id TEXT, name TEXT, chunk_id INTEGER, document TEXT, metadata TEXT);"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source_id, chunk_id);")
+            self._db.execute("CREATE INDEX IF NOT EXISTS chunks_name ON chunks (name);")
+            self._db.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value);")
+        self._index = None
+        # the index or the chunks changed since the last flush
+        self._changed = False
+        dim = self._db.execute("SELECT value FROM settings WHERE key='dim';").fetchone()
+        if dim is not None and (self.directory / "index.bin").exists():
+            self._index = hnswlib.Index(space="l2", dim=int(dim[0]))
+            self._index.load_index(str(self.directory / "index.bin"), allow_replace_deleted=True)
+            self._index.set_ef(self.ef)
+
+    def _create_index(self, dim: int):
+        self._index = hnswlib.Index(space="l2", dim=dim)
+        self._index.init_index(
+            max_elements=1000, ef_construction=self.ef_construction, M=self.m, allow_replace_deleted=True
+        )
+        self._index.set_ef(self.ef)
+        self._db.execute("REPLACE INTO settings (key, value) VALUES ('dim', ?);", (dim,))
+
+    def _save_index(self):
+        """write the index next to the old one and swap them, so a crash never leaves half an index"""
+        path = self.directory / "index.bin"
+        self._index.save_index(str(path) + ".tmp")
+        os.replace(str(path) + ".tmp", path)
+
+    @staticmethod
+    def _row_values(id: str, document: str, metadata: dict) -> tuple:
+        return (
+            id,
+            metadata.get("source_id"),
+            metadata.get("name"),
+            metadata.get("chunk_id"),
+            document,
+            json.dumps(metadata),
+        )
+
+    def add(self, ids: list, embeddings: list, documents: list, metadatas: list):
+        if not ids:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        with self._lock:
+            if self._index is None:
+                self._create_index(vectors.shape[1])
+            # replacing a chunk with the same id deletes the old one first
+            self._delete(ids)
+            needed = self._index.get_current_count() + len(ids)
+            if needed > self._index.get_max_elements():
+                self._index.resize_index(max(needed, 2 * self._index.get_max_elements()))
+            # labels are never reused, a deleted element keeps its label until its slot is replaced
+            next_label = self._db.execute("SELECT value FROM settings WHERE key='next_label';").fetchone()
+            first_label = int(next_label[0]) if next_label else 0
+            labels = list(range(first_label, first_label + len(ids)))
+            self._index.add_items(vectors, labels, replace_deleted=True)
+            self._db.execute(
+                "REPLACE INTO settings (key, value) VALUES ('next_label', ?);", (labels[-1] + 1,)
+            )
+            self._db.executemany(
+                "INSERT INTO chunks (label, id, source_id, name, chunk_id, document, metadata) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?);",
+                [
+                    (label,) + self._row_values(id, document, metadata)
+                    for label, id, document, metadata in zip(labels, ids, documents, metadatas)
+                ],
+            )
+            self._changed = True
+
+    def update_metadatas(self, ids: list, metadatas: list):
+        with self._lock:
+            self._db.executemany(
+                "UPDATE chunks SET source_id=?, name=?, chunk_id=?, metadata=? WHERE id=?;",
+                [
+                    (m.get("source_id"), m.get("name"), m.get("chunk_id"), json.dumps(m), id)
+                    for id, m in zip(ids, metadatas)
+                ],
+            )
+            self._changed = True
+
+    def get(self, source_id: str = None, name: str = None, chunk_ranges: list = None) -> dict:
+        conditions, values = [], []
+        if source_id is not None:
+            conditions.append("source_id=?")
+            values.append(source_id)
+        if name is not None:
+            conditions.append("name=?")
+            values.append(name)
+        if chunk_ranges:
+            conditions.append("(" + " OR ".join("chunk_id BETWEEN ? AND ?" for _ in chunk_ranges) + ")")
+            values += [bound for chunk_range in chunk_ranges for bound in chunk_range]
+        statement = "SELECT id, document, metadata FROM chunks"
+        if conditions:
+            statement += " WHERE " + " AND ".join(conditions)
+        with self._lock:
+            rows = self._db.execute(statement + ";", values).fetchall()
+        return {
+            "ids": [row[0] for row in rows],
+            "documents": [row[1] for row in rows],
+            "metadatas": [json.loads(row[2]) for row in rows],
+        }
+
+    def _delete(self, ids: list):
+        """delete chunks from the index and the chunks table, must be called holding _lock"""
+        placeholders = ", ".join("?" for _ in ids)
+        labels = [
+            row[0]
+            for row in self._db.execute(f"SELECT label FROM chunks WHERE id IN ({placeholders});", ids)
+        ]
+        for label in labels:
+            self._index.mark_deleted(label)
+        self._db.execute(f"DELETE FROM chunks WHERE id IN ({placeholders});", ids)
+        return len(labels)
+
+    def delete(self, ids: list):
+        if not ids:
+            return
+        with self._lock:
+            if self._index is not None and self._delete(ids):
+                self._changed = True
+
+    def flush(self):
+        with self._lock:
+            if not self._changed:
+                return
+            if self._index is not None:
+                self._save_index()
+            self._db.commit()
+            self._changed = False
+
+    def query(self, query_embeddings: list, k: int) -> dict:
+        response = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        with self._lock:
+            k = min(k, self.count())
+            if k == 0 or self._index is None:
+                for key in response:
+                    response[key] = [[] for _ in query_embeddings]
+                return response
+            vectors = np.asarray(query_embeddings, dtype=np.float32)
+            self._index.set_ef(max(self.ef, k))
+            try:
+                labels, distances = self._index.knn_query(vectors, k=k)
+            except RuntimeError:
+                # too few neighbors found around deleted elements, search the whole graph
+                self._index.set_ef(self._index.get_current_count())
+                labels, distances = self._index.knn_query(vectors, k=k)
+            wanted = sorted({int(label) for label in labels.flatten()})
+            placeholders = ", ".join("?" for _ in wanted)
+            rows = {
+                row[0]: row[1:]
+                for row in self._db.execute(
+                    f"SELECT label, id, document, metadata FROM chunks WHERE label IN ({placeholders});",
+                    wanted,
+                )
+            }
+        for query_labels, query_distances in zip(labels, distances):
+            hits = [(rows[int(l)], float(d)) for l, d in zip(query_labels, query_distances) if int(l) in rows]
+            response["ids"].append([row[0] for row, _ in hits])
+            response["documents"].append([row[1] for row, _ in hits])
+            response["metadatas"].append([json.loads(row[2]) for row, _ in hits])
+            response["distances"].append([distance for _, distance in hits])
+        return response
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM chunks;").fetchone()[0]
+
+    def drop(self):
+        with self._lock:
+            self._db.close()
+            self._index = None
+            shutil.rmtree(self.directory, ignore_errors=True)
+        logging.info(f"vector store in {self.directory} deleted")
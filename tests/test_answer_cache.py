@@ -0,0 +1,65 @@
+""" test reusing answers to similar first questions without loading an embeddings model"""
+import src.answer_cache as answer_cache
+from src.answer_cache import (
+    lookup_answer,
+    store_answer,
+    get_source_set_version,
+    invalidate_answer_cache,
+    get_answer_cache_stats,
+    clear_answer_cache,
+)
+import numpy as np
+import pytest
+
+settings = {
+    "answer_cache_size": 2,
+    "answer_cache_ttl_minutes": 60,
+    "answer_cache_similarity": 0.95,
+}
+# questions embedded by topic, the second jazz question is close to the first
+embeddings = {
+    "what is jazz?": [1.0, 0.0, 0.0],
+    "what's jazz?": [0.99, 0.05, 0.0],
+    "what is blues?": [0.0, 1.0, 0.0],
+    "what is rock?": [0.0, 0.0, 1.0],
+}
+
+
+@pytest.fixture(autouse=True)
+def fake_embeddings(monkeypatch):
+    monkeypatch.setattr(
+        answer_cache, "embed_question", lambda question: np.asarray(embeddings[question]) / np.linalg.norm(embeddings[question])
+    )
+    monkeypatch.setattr(answer_cache, "get_global_setting_value", settings.get)
+    clear_answer_cache()
+    yield
+    clear_answer_cache()
+
+
+def test_similar_questions_share_an_answer():
+    assert lookup_answer("assistant1", "what is jazz?") is None
+    store_answer("assistant1", "what is jazz?", "jazz is music", get_source_set_version("assistant1"))
+    assert lookup_answer("assistant1", "what's jazz?") == "jazz is music"
+    assert lookup_answer("assistant1", "what is blues?") is None
+    # answers are not shared between assistants
+    assert lookup_answer("assistant2", "what is jazz?") is None
+    stats = get_answer_cache_stats()
+    assert (stats["hits"], stats["misses"], stats["stores"]) == (1, 3, 1)
+
+
+def test_changed_sources_invalidate_answers():
+    version = get_source_set_version("assistant1")
+    store_answer("assistant1", "what is jazz?", "jazz is music", version)
+    invalidate_answer_cache("assistant1")
+    assert lookup_answer("assistant1", "what is jazz?") is None
+    # an answer built before the sources changed is not stored
+    store_answer("assistant1", "what is jazz?", "jazz is music", version)
+    assert get_answer_cache_stats()["cached_entries"] == 0
+
+
+def test_least_recently_used_answers_are_evicted():
+    for question in ("what is jazz?", "what is blues?", "what is rock?"):
+        store_answer("assistant1", question, question.upper(), get_source_set_version("assistant1"))
+    assert lookup_answer("assistant1", "what is jazz?") is None
+    assert lookup_answer("assistant1", "what is rock?") == "WHAT IS ROCK?"
+    assert get_answer_cache_stats()["evictions"] == 1
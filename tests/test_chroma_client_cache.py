@@ -0,0 +1,102 @@
+""" test reusing the chroma client and collection handles between calls"""
+import src.chroma_utils as chroma_utils
+from src.chroma_utils import (
+    start_chroma_client,
+    get_or_create_collection,
+    get_chroma_collection,
+    get_collection,
+    delete_collection,
+    get_chroma_client_stats,
+)
+from chromadb.config import Settings
+import chromadb
+import pytest
+
+settings = {"chroma_health_check_seconds": 30, "chroma_collection_cache_size": 2}
+
+
+class FakeHttpClient:
+    """counts the clients created, the server can be taken down"""
+
+    created = 0
+    server_up = True
+
+    def __init__(self, host, port, settings):
+        FakeHttpClient.created += 1
+
+    def heartbeat(self):
+        if not FakeHttpClient.server_up:
+            raise ConnectionError("server down")
+        return 1
+
+
+@pytest.fixture
+def http_mode(monkeypatch):
+    FakeHttpClient.created, FakeHttpClient.server_up = 0, True
+    monkeypatch.setattr(chroma_utils, "chromadb_mode", "http")
+    monkeypatch.setattr(chroma_utils.chromadb, "HttpClient", FakeHttpClient)
+    monkeypatch.setattr(chroma_utils, "get_global_setting_value", settings.get)
+    monkeypatch.setattr(chroma_utils, "_http_client", None)
+    clock = [1000.0]
+    monkeypatch.setattr(chroma_utils.time, "monotonic", lambda: clock[0])
+    return clock
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """an in memory chroma client and an embedding function that is never called"""
+    client = chromadb.EphemeralClient(
+        settings=Settings(anonymized_telemetry=False, allow_reset=True)
+    )
+    client.reset()
+    embedding_function = object()
+    monkeypatch.setattr(chroma_utils, "start_chroma_client", lambda: client)
+    monkeypatch.setattr(chroma_utils, "get_embedding_function", lambda: embedding_function)
+    monkeypatch.setattr(chroma_utils, "get_global_setting_value", settings.get)
+    monkeypatch.setattr(chroma_utils, "bump_collection_version", lambda collection_name: 1)
+    monkeypatch.setattr(chroma_utils, "_collection_handles", chroma_utils.OrderedDict())
+    return client
+
+
+def test_client_is_created_once(http_mode):
+    client = start_chroma_client()
+    http_mode[0] += 60
+    assert start_chroma_client() is client
+    assert FakeHttpClient.created == 1
+    assert get_chroma_client_stats()["health_checks"] >= 1
+
+
+def test_client_reconnects_when_the_check_fails(http_mode):
+    client = start_chroma_client()
+    FakeHttpClient.server_up = False
+    # within the check interval the client is not checked
+    assert start_chroma_client() is client
+    reconnects = get_chroma_client_stats()["reconnects"]
+    http_mode[0] += 60
+    assert start_chroma_client() is not client
+    assert get_chroma_client_stats()["reconnects"] == reconnects + 1
+
+
+def test_collection_handles_are_reused(client):
+    first = get_chroma_collection("assistant1")
+    assert get_chroma_collection("assistant1") is first
+    assert get_collection("assistant1") is first
+    get_chroma_collection("assistant2")
+    get_chroma_collection("assistant3")
+    # the least recently used handle is evicted over the cache size
+    assert list(chroma_utils._collection_handles) == ["assistant2", "assistant3"]
+
+
+def test_cached_handles_do_not_keep_the_embeddings_model(client):
+    get_chroma_collection("assistant1")
+    get_or_create_collection("assistant1")
+    # the langchain collection with the embedding function is not cached
+    assert list(chroma_utils._collection_handles.values()) == [get_collection("assistant1")]
+    assert get_collection("assistant1")._embedding_function is None
+
+
+def test_deleted_collections_are_not_reused(client):
+    get_chroma_collection("assistant1")
+    delete_collection("assistant1")
+    with pytest.raises(Exception):
+        get_collection("assistant1")
@@ -0,0 +1,111 @@
+""" test rewriting chunks indexed with the whole source in their metadata"""
+import src.chroma_utils as chroma_utils
+from src.chroma_utils import migrate_chunk_metadata
+from src.basic_data_classes import Source, ChunkMetadata
+from chromadb.config import Settings
+import chromadb
+import pytest
+
+content = "The first sentence about jazz. The second sentence about blues."
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = chromadb.EphemeralClient(
+        settings=Settings(anonymized_telemetry=False, allow_reset=True)
+    )
+    client.reset()
+    monkeypatch.setattr(chroma_utils, "start_chroma_client", lambda: client)
+    monkeypatch.setattr(chroma_utils, "_chunks_migrated", False)
+    monkeypatch.setattr(chroma_utils, "bump_collection_version", lambda collection_name: 1)
+    return client
+
+
+@pytest.fixture
+def sources(monkeypatch):
+    """a sources table holding a truncated source"""
+    table = {
+        "source1": Source(
+            id="source1",
+            name="jazz.txt",
+            source_type="uploaded file",
+            content=content[:20],
+            collection_name_and_assistant_id="assistant1",
+        )
+    }
+    monkeypatch.setattr(chroma_utils, "select_one", lambda dataclass, id: table.get(id))
+    monkeypatch.setattr(
+        chroma_utils, "insert", lambda source, operation: table.update({source.id: source})
+    )
+    return table
+
+
+def legacy_metadata(chunk_id: int) -> dict:
+    return {
+        "id": "source1",
+        "name": "jazz.txt",
+        "source_type": "uploaded file",
+        "content_type": "txt",
+        "content": content,
+        "collection_name_and_assistant_id": "assistant1",
+        "creation_time": "2024-01-01 00:00:00",
+        "chunk_id": chunk_id,
+        "chunk_count": 2,
+        "chained_content": content,
+    }
+
+
+def test_legacy_chunks_are_rewritten(client, sources):
+    collection = client.create_collection("assistant1")
+    texts = ["The first sentence about jazz.", "The second sentence about blues."]
+    collection.add(
+        ids=["a", "b"],
+        embeddings=[[1.0, 0.0], [0.0, 1.0]],
+        documents=texts,
+        metadatas=[legacy_metadata(0), legacy_metadata(1)],
+    )
+    migrate_chunk_metadata(batch_size=1)
+    migrated = collection.get(include=["embeddings", "metadatas", "documents"])
+    assert len(migrated["ids"]) == 2
+    for text, embedding, metadata in zip(
+        migrated["documents"], migrated["embeddings"], migrated["metadatas"]
+    ):
+        assert set(metadata) == set(ChunkMetadata.model_fields)
+        assert metadata["source_id"] == "source1"
+        assert content[metadata["start"] : metadata["end"]] == text
+        assert embedding == ([1.0, 0.0] if metadata["chunk_id"] == 0 else [0.0, 1.0])
+    # the full content is restored in the sources table
+    assert sources["source1"].content == content
+
+
+def test_migrated_chunks_are_left_alone(client, sources):
+    collection = client.create_collection("assistant1")
+    metadata = ChunkMetadata(
+        source_id="source1", name="jazz.txt", chunk_id=0, content_hash="hash"
+    ).model_dump()
+    collection.add(ids=["a"], embeddings=[[1.0, 0.0]], documents=["text"], metadatas=[metadata])
+    migrate_chunk_metadata()
+    assert collection.get(ids=["a"])["metadatas"] == [metadata]
+
+
+def test_interrupted_migration_loses_no_chunks(client, sources, monkeypatch):
+    collection = client.create_collection("assistant1")
+    collection.add(
+        ids=["a", "b"],
+        embeddings=[[1.0, 0.0], [0.0, 1.0]],
+        documents=["The first sentence about jazz.", "The second sentence about blues."],
+        metadatas=[legacy_metadata(0), legacy_metadata(1)],
+    )
+    # the migration stops before the old chunks are deleted
+    collection_class = type(collection)
+    delete = collection_class.delete
+    monkeypatch.setattr(collection_class, "delete", lambda self, ids: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        migrate_chunk_metadata()
+    assert collection.count() == 4
+    monkeypatch.setattr(collection_class, "delete", delete)
+    monkeypatch.setattr(chroma_utils, "_chunks_migrated", False)
+    migrate_chunk_metadata()
+    migrated = collection.get(include=["metadatas"])
+    assert sorted(m["chunk_id"] for m in migrated["metadatas"]) == [0, 1]
+    assert all(m["source_id"] == "source1" for m in migrated["metadatas"])
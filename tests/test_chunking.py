@@ -0,0 +1,56 @@
+""" test splitting source texts into chunks a window at a time"""
+import src.chunking as chunking
+from src.chunking import iter_chunks, iter_text_chunks, estimate_chunk_count
+from src.basic_data_classes import ChunkMetadata
+from itertools import islice
+
+text = " ".join(
+    f"Sentence {i} tells a little more about the history of jazz music." for i in range(2000)
+)
+
+
+def test_offsets_point_to_the_chunk_text():
+    chunks = list(iter_text_chunks(text))
+    assert len(chunks) > 2 * chunking.WINDOW_CHUNKS
+    for start, end, chunk_text in chunks:
+        assert text[start:end] == chunk_text
+    # chunks follow each other and cover the whole text
+    starts = [start for start, _, _ in chunks]
+    assert starts == sorted(starts)
+    assert chunks[-1][1] >= len(text.rstrip()) - 1
+
+
+def test_chunks_have_compact_metadata():
+    chunks = list(iter_chunks(text, source_id="source1", source_name="jazz.txt"))
+    assert [c.metadata["chunk_id"] for c in chunks] == list(range(len(chunks)))
+    assert set(chunks[0].metadata) == set(ChunkMetadata.model_fields)
+    assert chunks[0].metadata["source_id"] == "source1"
+    # neighbors are found at query time, the chunk text is stored once
+    assert chunks[5].metadata["chained_content"] == ""
+
+
+def test_chunks_are_split_lazily(monkeypatch):
+    windows = []
+    split_text = chunking.RecursiveCharacterTextSplitter.split_text
+
+    def counting_split_text(self, segment):
+        windows.append(len(segment))
+        return split_text(self, segment)
+
+    monkeypatch.setattr(
+        chunking.RecursiveCharacterTextSplitter, "split_text", counting_split_text
+    )
+    first_chunks = list(islice(iter_chunks(text * 10, "source1", "jazz.txt"), 10))
+    assert len(first_chunks) == 10
+    assert len(windows) == 1
+
+
+def test_splitting_is_deterministic():
+    first = [c.metadata["content_hash"] for c in iter_chunks(text, "a", "jazz.txt")]
+    second = [c.metadata["content_hash"] for c in iter_chunks(text, "b", "jazz.txt")]
+    assert first == second
+
+
+def test_estimate_chunk_count():
+    estimate = estimate_chunk_count(text)
+    assert 0.5 < estimate / len(list(iter_text_chunks(text))) < 2
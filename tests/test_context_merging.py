@@ -0,0 +1,55 @@
+""" test merging the chained contents of chunks indexed by older versions"""
+from src.query_chain import longest_overlap, merge_overlapping_strings, merge_multiple_strings
+from src.basic_data_classes import RetrievalResult
+import random
+
+
+def quadratic_merge(strings: list):
+    """the word by word merge the linear one replaces"""
+    str1, str2 = strings
+    str1_words = str1.split(" ")
+    str2_words = str2.split(" ")[1:]
+    overlap = []
+    for i in range(max(len(str1_words) - 4, 0)):
+        if str1_words[i:] == str2_words[: len(str1_words[i:])]:
+            overlap = str1_words[i:]
+            break
+    if overlap:
+        return " ".join(str1_words + str2_words[len(overlap) :])
+    return None
+
+
+def test_longest_overlap():
+    assert longest_overlap(["a", "b", "c", "d"], ["c", "d", "e"]) == 2
+    assert longest_overlap(["a", "b", "a", "b"], ["a", "b", "a", "b", "c"]) == 4
+    assert longest_overlap(["a", "b"], ["c", "a", "b"]) == 0
+    assert longest_overlap([], ["a"]) == 0
+
+
+def test_same_result_as_quadratic_merge():
+    rng = random.Random(1)
+    for _ in range(500):
+        words = [rng.choice("abc") for _ in range(rng.randint(0, 30))]
+        cut = rng.randint(0, len(words))
+        overlap = rng.randint(0, cut)
+        str1 = " ".join(words[:cut])
+        str2 = " ".join(["..."] + words[cut - overlap :])
+        assert merge_overlapping_strings([str1, str2]) == quadratic_merge([str1, str2])
+
+
+def chunk(source_id, chunk_id, words):
+    chained = " ".join(words[max(chunk_id * 10 - 5, 0) : chunk_id * 10 + 30])
+    if chunk_id > 0:
+        chained = "... " + chained
+    return RetrievalResult(
+        source_id=source_id, chunk_id=chunk_id, text="", chained_content=chained
+    )
+
+
+def test_runs_of_adjacent_chunks_are_merged_in_one_pass():
+    words = [f"word{i}" for i in range(200)]
+    chunks = [chunk("source1", i, words) for i in (3, 0, 1, 2, 4, 12)]
+    chunks.append(chunk("source2", 1, words))
+    contents = [text for text, _ in merge_multiple_strings(chunks)]
+    assert contents[0] == " ".join(words[0:70])
+    assert len(contents) == 3
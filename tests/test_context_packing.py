@@ -0,0 +1,45 @@
+""" test packing passages into a token budget, with tokens estimated from the text length"""
+import src.context_packing as context_packing
+from src.context_packing import pack_passages, count_tokens
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def estimated_tokens(monkeypatch):
+    monkeypatch.setattr(context_packing, "tiktoken", None)
+    context_packing.get_encoding.cache_clear()
+    yield
+    context_packing.get_encoding.cache_clear()
+
+
+def passage(tokens: int, score):
+    return ("x" * tokens * 4, score)
+
+
+def test_tokens_are_estimated_without_tiktoken():
+    assert count_tokens("x" * 8) == 2
+    assert count_tokens("x" * 9) == 3
+
+
+def test_most_relevant_passages_are_packed_first():
+    separator = count_tokens(context_packing.PASSAGE_SEPARATOR)
+    passages = [passage(50, 0.9), passage(50, None), passage(50, 0.1), passage(50, 0.5)]
+    packed, tokens_used = pack_passages(passages, token_budget=100 + separator)
+    assert packed == [passages[2][0], passages[3][0]]
+    assert tokens_used == 100 + separator
+
+
+def test_smaller_passages_fill_the_rest_of_the_budget():
+    passages = [passage(60, 0.1), passage(60, 0.2), passage(20, 0.3)]
+    packed, tokens_used = pack_passages(passages, token_budget=90)
+    assert packed == [passages[0][0], passages[2][0]]
+    assert tokens_used <= 90
+
+
+def test_too_long_passage_is_cut_to_the_budget():
+    packed, tokens_used = pack_passages([passage(500, 0.1)], token_budget=100)
+    assert tokens_used == 100 and len(packed[0]) == 400
+
+
+def test_no_passages():
+    assert pack_passages([], token_budget=100) == ([], 0)
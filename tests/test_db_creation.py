@@ -4,15 +4,30 @@ from src.sqlite.db_creation import (
     get_table_names,
     delete_table,
     insert_row,
-    execute_query
+    execute_query,
+    close_connections,
+    get_connection,
+    migrate_database,
+    get_schema_version,
+    SCHEMA_VERSION,
 )
+from src.sqlite.queries import select, select_one, insert, delete, count, build_statement
+from src.sqlite.gov_db_utils import (
+    add_missing_global_settings,
+    get_global_settings,
+    get_global_setting_value,
+    optional_global_settings,
+)
+from src.basic_data_classes import GlobalSetting
 from pathlib import Path
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from datetime import datetime
 import pytest
 import os
 import dotenv as de
 import tempfile
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 
 @pytest.fixture(scope="module", autouse=True)
 def connection():
@@ -24,6 +39,7 @@ def connection():
     # change main database location to a test database in temp folder (ensure it works on windows and linux)
     test_db_location = Path(tempfile.TemporaryDirectory().name) / "test.db"
     os.environ["MAIN_DATABASE_LOCATION"] = str(test_db_location)
+    close_connections()  # resolve the database location again
     # create the database file
     test_db_location.parent.mkdir(parents=True, exist_ok=True)
 
@@ -34,6 +50,7 @@ def connection():
         
     # reset the database location
     os.environ["MAIN_DATABASE_LOCATION"] = old_value
+    close_connections()
 
 
 
@@ -69,3 +86,84 @@ def test_delete_table(connection):
     table_names = get_table_names(connection)
     assert "testclasss" not in table_names
 
+
+
+def test_connection_is_reused_per_thread():
+    conn = get_connection()
+    assert get_connection() is conn
+    assert conn.execute("PRAGMA journal_mode;").fetchone()[0] == "wal"
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        other_conn = executor.submit(get_connection).result()
+    assert other_conn is not conn
+
+
+def test_typed_queries_with_bound_parameters(connection, data_class):
+    execute_query("DROP TABLE IF EXISTS testclasss")
+    create_table_from_dataclass(data_class)
+    insert(data_class(id="o'brien", name="it's; DROP TABLE testclasss", age=12))
+    insert(data_class(id="test2", name="testname", age=13))
+    # an empty value of a field without a default is kept
+    insert(data_class(id="test3", name="", age=14))
+    assert select_one(data_class, "test3").name == ""
+    assert delete(data_class, id="test3") == 1
+    assert select_one(data_class, "o'brien").name == "it's; DROP TABLE testclasss"
+    assert select(data_class, age=13) == [data_class(id="test2", name="testname", age=13)]
+    assert [r.id for r in select(data_class, order_by="age")] == ["o'brien", "test2"]
+    assert count(data_class) == 2 and count(data_class, age=13) == 1
+    # the select statement is built once and then reused
+    hits = build_statement.cache_info().hits
+    select(data_class, age=13)
+    assert build_statement.cache_info().hits == hits + 1
+    assert delete(data_class, id="o'brien") == 1
+    assert select_one(data_class, "o'brien") is None
+    delete_table("testclasss")
+
+
+def test_migrate_legacy_table(connection):
+    class LegacyClass(BaseModel):
+        id: str
+        owner_id: str = Field(json_schema_extra={"index": True})
+        is_active: bool = True
+        created_at: datetime
+        description: str = "added later"
+
+    # a table as created by older versions, with booleans and datetimes stored as text
+    execute_query("DROP TABLE IF EXISTS legacyclasss")
+    execute_query(
+        "CREATE TABLE legacyclasss (id TEXT NOT NULL UNIQUE, owner_id TEXT,"
+        " is_active INTEGER, created_at TEXT, PRIMARY KEY (id))"
+    )
+    execute_query(
+        "INSERT INTO legacyclasss VALUES ('a', 'owner', 'False', '2024-01-31 12:00:00.000001')"
+    )
+    execute_query("PRAGMA user_version=0;")
+    migrate_database([LegacyClass])
+    assert get_schema_version() == SCHEMA_VERSION
+    row = select_one(LegacyClass, "a")
+    assert row == LegacyClass(
+        id="a",
+        owner_id="owner",
+        is_active=False,
+        created_at=datetime(2024, 1, 31, 12, 0, 0, 1),
+    )
+    raw_row = connection.execute("SELECT * FROM legacyclasss").fetchone()
+    assert raw_row["is_active"] == 0 and isinstance(raw_row["created_at"], int)
+    indexes = connection.execute("PRAGMA index_list(legacyclasss)").fetchall()
+    assert "legacyclasss_owner_id_idx" in [index["name"] for index in indexes]
+    delete_table("legacyclasss")
+
+
+def test_optional_global_settings_are_read_back(connection):
+    # seed the optional settings into an empty table, some of them default to ""
+    execute_query("DROP TABLE IF EXISTS globalsettings")
+    create_table_from_dataclass(GlobalSetting)
+    add_missing_global_settings()
+    settings = {setting.id: setting for setting in get_global_settings()}
+    assert settings.keys() == optional_global_settings.keys()
+    assert settings["query_maker_llm_id"].value == ""
+    for setting_id, default in optional_global_settings.items():
+        assert get_global_setting_value(setting_id) == default
+    # seeding again keeps the existing settings
+    add_missing_global_settings()
+    assert len(get_global_settings()) == len(optional_global_settings)
+    delete_table("globalsettings")
@@ -11,6 +11,7 @@ from src.sqlite.db_utils import (
     delete_source,
 )
 from src.chroma_utils import start_chroma_server
+from src.answer_cache import get_source_set_version
 from src.sqlite.db_creation import get_row, delete_row, execute_query
 from src.logging_config import configure_logging
 
@@ -64,9 +65,12 @@ def test_assistant_creation():
 
 
 def test_update_assistant():
+    version = get_source_set_version(cache["test_assistant"].id)
     cache["test_assistant"].name = "test_assistant_updated"
     add_or_update_assistant(cache["test_assistant"])
     assert get_assistant(cache["test_assistant"].id) == cache["test_assistant"]
+    # answers cached for the earlier version of the assistant are not reused
+    assert get_source_set_version(cache["test_assistant"].id) == version + 1
 
 
 def test_get_assistant_from_user():
@@ -0,0 +1,22 @@
+""" test loading several inputs at once in the process pool"""
+from src.document_loading import load_sources, clean_content
+
+
+def test_results_keep_order_and_errors_per_task():
+    tasks = [
+        ("a", len, ("abc",)),
+        ("b", int, ("not a number",)),
+        ("c", len, ("abcde",)),
+    ]
+    results = load_sources(tasks, max_workers=2)
+    assert [name for name, _ in results] == ["a", "b", "c"]
+    assert results[0][1] == 3 and results[2][1] == 5
+    assert isinstance(results[1][1], ValueError)
+
+
+def test_single_task_runs_without_pool():
+    assert load_sources([("a", len, ("abc",))], max_workers=4) == [("a", 3)]
+
+
+def test_clean_content():
+    assert clean_content("  some \n\n text\t here ") == "some text here"
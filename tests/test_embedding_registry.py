@@ -0,0 +1,57 @@
+""" test sharing, evicting and capping loaded embedding models without loading real models"""
+import src.embedding_registry as registry
+from src.embedding_registry import (
+    get_embedding_function,
+    evict_embedding_model,
+    get_loaded_embedding_models,
+)
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+
+MB = 1024 * 1024
+
+
+@pytest.fixture(autouse=True)
+def fake_models(monkeypatch):
+    """replace model loading with cheap objects of 100 MB each and a cap of 250 MB"""
+    loads = []
+
+    def fake_load_model(model_name):
+        loads.append(model_name)
+        return object()
+
+    monkeypatch.setattr(registry, "_load_model", fake_load_model)
+    monkeypatch.setattr(registry, "_model_size", lambda embedding_function: 100 * MB)
+    monkeypatch.setattr(registry, "get_global_setting_value", lambda setting_id: 250)
+    registry._models.clear()
+    yield loads
+    registry._models.clear()
+
+
+def test_model_is_loaded_once(fake_models):
+    first = get_embedding_function("model_a")
+    assert get_embedding_function("model_a") is first
+    assert fake_models == ["model_a"]
+
+
+def test_concurrent_requests_load_once(fake_models):
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        functions = list(executor.map(get_embedding_function, ["model_a"] * 8))
+    assert all(f is functions[0] for f in functions)
+    assert fake_models == ["model_a"]
+
+
+def test_least_recently_used_model_is_evicted_over_cap(fake_models):
+    get_embedding_function("model_a")
+    get_embedding_function("model_b")
+    get_embedding_function("model_a")  # model_b is now least recently used
+    get_embedding_function("model_c")
+    assert list(get_loaded_embedding_models().keys()) == ["model_a", "model_c"]
+
+
+def test_explicit_eviction(fake_models):
+    get_embedding_function("model_a")
+    assert evict_embedding_model("model_a")
+    assert not evict_embedding_model("model_a")
+    get_embedding_function("model_a")
+    assert fake_models == ["model_a", "model_a"]
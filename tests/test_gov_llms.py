@@ -36,14 +36,14 @@ def test_activate_llm():
     """test that we can activate an llm"""
     # activate the llm
     activate_llm(cache["llm"].id)
-    assert get_row(cache["llm"].id, "llms")[0]["is_active"] == "True"
+    assert get_row(cache["llm"].id, "llms")[0]["is_active"] == 1
 
 
 def test_deactivate_llm():
     """test that we can deactivate an llm"""
     # deactivate the llm
     deactivate_llm(cache["llm"].id)
-    assert get_row(cache["llm"].id, "llms")[0]["is_active"] == "False"
+    assert get_row(cache["llm"].id, "llms")[0]["is_active"] == 0
 
 
 def test_delete_llm():
@@ -0,0 +1,125 @@
+""" test that re-indexing a source only embeds new or changed chunks"""
+import src.chroma_utils as chroma_utils
+from src.chroma_utils import index_source
+from src.basic_data_classes import Source
+import pytest
+
+
+class FakeChromaCollection:
+    """an in memory collection counting the embedded chunks"""
+
+    def __init__(self):
+        self.store = {}
+        self.embedded = 0
+
+    def get(self, where, include):
+        (key, value), = where.items()
+        ids = [id for id, item in self.store.items() if item["metadata"][key] == value]
+        return {
+            "ids": ids,
+            "documents": [self.store[id]["text"] for id in ids],
+            "metadatas": [self.store[id]["metadata"] for id in ids],
+        }
+
+    def add(self, ids, embeddings, documents, metadatas):
+        for id, document, metadata in zip(ids, documents, metadatas):
+            self.store[id] = {"text": document, "metadata": metadata}
+        self.embedded += len(ids)
+
+    def update(self, ids, metadatas):
+        for id, metadata in zip(ids, metadatas):
+            self.store[id]["metadata"] = metadata
+
+    def delete(self, ids):
+        for id in ids:
+            self.store.pop(id)
+
+
+class FakeEmbeddings:
+    def embed_documents(self, texts):
+        return [[0.0] for _ in texts]
+
+
+@pytest.fixture
+def collection(monkeypatch):
+    collection = FakeChromaCollection()
+    monkeypatch.setattr(
+        chroma_utils, "get_chroma_collection", lambda collection_name: collection
+    )
+    monkeypatch.setattr(chroma_utils, "get_embedding_function", lambda: FakeEmbeddings())
+    # the collection versions are not written to the main database
+    monkeypatch.setattr(chroma_utils, "bump_collection_version", lambda collection_name: 1)
+    return collection
+
+
+def manual(pages: list) -> Source:
+    return Source(
+        name="manual.txt",
+        source_type="uploaded file",
+        content=" ".join(pages),
+        collection_name_and_assistant_id="test_assistant",
+    )
+
+
+pages = [
+    f"Page {i} explains step {i} of the procedure in detail. " * 8 for i in range(30)
+]
+
+
+def test_unchanged_source_is_not_embedded_again(collection):
+    old_version = manual(pages)
+    index_source(old_version)
+    chunk_count = len(collection.store)
+    embedded = collection.embedded
+    new_version = manual(pages)
+    index_source(new_version, replaces_source_id=old_version.id)
+    assert collection.embedded == embedded
+    assert len(collection.store) == chunk_count
+    # the kept chunks now belong to the new version of the source
+    assert {item["metadata"]["source_id"] for item in collection.store.values()} == {
+        new_version.id
+    }
+
+
+def test_only_changed_chunks_are_embedded(collection):
+    old_version = manual(pages)
+    index_source(old_version)
+    embedded = collection.embedded
+    fixed_pages = pages.copy()
+    fixed_pages[10] = "Page 10 has been corrected and now says something else. " * 8
+    new_version = manual(fixed_pages)
+    index_source(new_version, replaces_source_id=old_version.id)
+    assert 0 < collection.embedded - embedded < embedded / 4
+    indexed_text = [item["text"] for item in collection.store.values()]
+    assert any("corrected" in text for text in indexed_text)
+    assert not any("Page 10 explains" in text for text in indexed_text)
+    assert len(collection.store) == len(chroma_utils.split_document(
+        chroma_utils.source_to_document(new_version)
+    ))
+
+
+def test_source_with_the_same_name_is_indexed_separately(collection):
+    first = manual(pages)
+    index_source(first)
+    chunk_count = len(collection.store)
+    second = manual(pages)
+    index_source(second)
+    assert len(collection.store) == 2 * chunk_count
+    source_ids = [item["metadata"]["source_id"] for item in collection.store.values()]
+    assert source_ids.count(first.id) == source_ids.count(second.id) == chunk_count
+
+
+def test_failed_replacement_keeps_the_old_chunks(collection, monkeypatch):
+    old_version = manual(pages)
+    index_source(old_version)
+    old_store = {id: dict(item) for id, item in collection.store.items()}
+    fixed_pages = pages.copy()
+    fixed_pages[10] = "Page 10 has been corrected and now says something else. " * 8
+
+    def failing_embed_documents(texts):
+        raise RuntimeError("embedding failed")
+
+    monkeypatch.setattr(FakeEmbeddings, "embed_documents", staticmethod(failing_embed_documents))
+    with pytest.raises(RuntimeError):
+        index_source(manual(fixed_pages), replaces_source_id=old_version.id)
+    assert collection.store == old_store
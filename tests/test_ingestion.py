@@ -0,0 +1,137 @@
+""" test the background ingestion jobs without indexing into chroma"""
+import src.ingestion as ingestion
+from src.ingestion import submit_source, run_job, get_job, get_assistant_jobs, dismiss_job
+from src.sqlite.db_creation import close_connections, create_table_from_dataclass
+from src.basic_data_classes import IngestionJob, Source
+from pathlib import Path
+import tempfile
+import pytest
+import os
+
+
+assistants = set()
+
+
+@pytest.fixture(autouse=True)
+def database(monkeypatch):
+    """a temporary database with an ingestionjobs table"""
+    test_db_location = Path(tempfile.mkdtemp()) / "test.db"
+    monkeypatch.setenv("MAIN_DATABASE_LOCATION", str(test_db_location))
+    close_connections()  # resolve the database location again
+    create_table_from_dataclass(IngestionJob)
+    create_table_from_dataclass(Source)
+    monkeypatch.setattr(ingestion, "get_global_setting_value", lambda setting_id: 2)
+    # the assistants that exist
+    assistants.clear()
+    assistants.add("test_assistant")
+    monkeypatch.setattr(ingestion, "get_assistant", lambda assistant_id: assistant_id in assistants or None)
+    # jobs are run by the test instead of worker threads
+    monkeypatch.setattr(ingestion._queue, "put", lambda job_id: None)
+    yield
+    close_connections()
+    os.environ.pop("MAIN_DATABASE_LOCATION", None)
+
+
+def source() -> Source:
+    return Source(
+        name="manual.txt",
+        source_type="uploaded file",
+        content="some text",
+        collection_name_and_assistant_id="test_assistant",
+    )
+
+
+def test_job_reports_progress_and_completes(monkeypatch):
+    def fake_add_source(source, replaces_source_id=None, progress_callback=None):
+        progress_callback(5, 10)
+        assert get_job(job.id).chunks_done == 5
+        progress_callback(10, 10)
+
+    monkeypatch.setattr(ingestion, "add_source", fake_add_source)
+    job = submit_source(source())
+    assert get_job(job.id).status == "queued"
+    run_job(job.id)
+    done = get_job(job.id)
+    assert (done.status, done.chunks_done, done.chunks_total) == ("done", 10, 10)
+    assert done.attempts == 1
+    assert get_assistant_jobs("test_assistant") == []
+
+
+def test_job_fails_after_max_attempts(monkeypatch):
+    def failing_add_source(source, replaces_source_id=None, progress_callback=None):
+        raise ConnectionError("chroma is down")
+
+    monkeypatch.setattr(ingestion, "add_source", failing_add_source)
+    timers = []
+
+    class FakeTimer:
+        def __init__(self, interval, function, args):
+            timers.append(interval)
+
+        def start(self):
+            pass
+
+    monkeypatch.setattr(ingestion.threading, "Timer", FakeTimer)
+    job = submit_source(source())
+    run_job(job.id)
+    assert get_job(job.id).status == "queued"
+    assert timers == [20]
+    run_job(job.id)
+    failed = get_job(job.id)
+    assert (failed.status, failed.attempts) == ("failed", 2)
+    assert "chroma is down" in failed.error
+    assert [j.id for j in get_assistant_jobs("test_assistant")] == [job.id]
+
+
+def test_replaced_source_is_passed_on(monkeypatch):
+    replaced = []
+    monkeypatch.setattr(
+        ingestion,
+        "add_source",
+        lambda source, replaces_source_id=None, progress_callback=None: replaced.append(replaces_source_id),
+    )
+    run_job(submit_source(source(), replaces_source_id="old_source").id)
+    run_job(submit_source(source()).id)
+    assert replaced == ["old_source", None]
+
+
+def test_dismissed_job_removes_its_chunks(monkeypatch):
+    def failing_add_source(source, replaces_source_id=None, progress_callback=None):
+        raise ValueError("not a pdf")
+
+    removed = []
+    monkeypatch.setattr(ingestion, "add_source", failing_add_source)
+    monkeypatch.setattr(ingestion, "remove_source", lambda source: removed.append(source.id))
+    monkeypatch.setattr(ingestion, "get_global_setting_value", lambda setting_id: 1)
+    job = submit_source(source(), replaces_source_id="old_source")
+    run_job(job.id)
+    assert get_job(job.id).status == "failed"
+    dismiss_job(job.id)
+    assert get_job(job.id) is None
+    assert removed == [job.source_id]
+    assert get_assistant_jobs("test_assistant") == []
+
+
+def test_jobs_of_deleted_assistants_are_dropped(monkeypatch):
+    indexed, deleted = [], []
+    monkeypatch.setattr(
+        ingestion,
+        "add_source",
+        lambda source, replaces_source_id=None, progress_callback=None: indexed.append(source.id),
+    )
+    monkeypatch.setattr(ingestion, "delete_assistant", deleted.append)
+    queued = submit_source(source())
+    assistants.clear()
+    run_job(queued.id)
+    assert indexed == [] and get_job(queued.id) is None
+
+    # the assistant is deleted while its source is indexed
+    assistants.add("test_assistant")
+    running = submit_source(source())
+    monkeypatch.setattr(
+        ingestion,
+        "add_source",
+        lambda source, replaces_source_id=None, progress_callback=None: assistants.clear(),
+    )
+    run_job(running.id)
+    assert deleted == ["test_assistant"]
@@ -72,10 +72,10 @@ def test_split_document_uniqueness():
         chunks = split_document(document=doc)
         assert len(chunks)  == len(set([c.page_content for c in chunks])) , f"{doc.metadata['name']} not split into unique chunks"
 
-def test_chain_chunks():
-    for chunks in cache["doc_chunks"]:
+def test_chunk_offsets():
+    for doc, chunks in zip(cache["docs"], cache["doc_chunks"]):
         for chunk in chunks:
-            assert chunk.page_content in chunk.metadata['chained_content'] , f"chunk {chunk.metadata['chunk_id']} not in chained content"
+            assert doc.page_content[chunk.metadata['start']:chunk.metadata['end']] == chunk.page_content , f"chunk {chunk.metadata['chunk_id']} not at its offsets"
 
 def test_img_ref_preservation():
     """ test if chunking and retrieving txt file containing image references preserves the image references"""
@@ -142,7 +142,7 @@ def test_add_context_from_zero_queries(collection):
 #     test_source_to_document()
 #     test_split_document_basic()
 #     test_split_document_uniqueness()
-#     test_chain_chunks()
+#     test_chunk_offsets()
 #     test_img_ref_preservation()
 #     test_chunk_indexing()
     
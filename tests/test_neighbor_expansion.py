@@ -0,0 +1,100 @@
+""" test expanding retrieved chunks with their neighbors and stitching them into passages"""
+import src.chroma_utils as chroma_utils
+from src.chroma_utils import get_neighbor_chunks
+from src.query_chain import stitch_chunks
+from src.chunking import iter_chunks
+from src.basic_data_classes import RetrievalResult
+from chromadb.config import Settings
+import chromadb
+import pytest
+
+text = " ".join(f"Sentence {i} is about the history of jazz and blues." for i in range(200))
+
+
+@pytest.fixture
+def chunks(monkeypatch):
+    """the chunks of two sources indexed in an in memory collection"""
+    client = chromadb.EphemeralClient(
+        settings=Settings(anonymized_telemetry=False, allow_reset=True)
+    )
+    client.reset()
+    collection = client.create_collection("assistant1")
+    chunks = list(iter_chunks(text, "source1", "jazz.txt")) + list(
+        iter_chunks(text, "source2", "blues.txt")
+    )
+    collection.add(
+        ids=[f"{c.metadata['source_id']}-{c.metadata['chunk_id']}" for c in chunks],
+        embeddings=[[float(i), 1.0] for i in range(len(chunks))],
+        documents=[c.page_content for c in chunks],
+        metadatas=[c.metadata for c in chunks],
+    )
+    monkeypatch.setattr(
+        chroma_utils,
+        "get_chroma_collection",
+        lambda collection_name: collection,
+    )
+    return chunks
+
+
+def chunk(chunks, source_id, chunk_id, score=0.5):
+    """the retrieval result for a chunk"""
+    document = next(
+        c
+        for c in chunks
+        if c.metadata["source_id"] == source_id and c.metadata["chunk_id"] == chunk_id
+    )
+    return RetrievalResult.from_chunk(document.page_content, document.metadata, score)
+
+
+def ids(expanded):
+    return [result.key for result in expanded]
+
+
+def test_hits_are_expanded_within_their_source(chunks):
+    hits = [chunk(chunks, "source2", 0), chunk(chunks, "source1", 5), chunk(chunks, "source1", 7)]
+    expanded = get_neighbor_chunks("assistant1", hits, window=1)
+    assert sorted(ids(expanded)) == [
+        ("source1", 4),
+        ("source1", 5),
+        ("source1", 6),
+        ("source1", 7),
+        ("source1", 8),
+        ("source2", 0),
+        ("source2", 1),
+    ]
+
+
+def test_window_zero_keeps_the_hits(chunks):
+    hits = [chunk(chunks, "source1", 5), chunk(chunks, "source1", 2)]
+    assert ids(get_neighbor_chunks("assistant1", hits, window=0)) == [
+        ("source1", 2),
+        ("source1", 5),
+    ]
+
+
+def test_neighbors_are_stitched_without_overlap(chunks):
+    expanded = get_neighbor_chunks("assistant1", [chunk(chunks, "source1", 5)], window=2)
+    ((passage, score),) = stitch_chunks(expanded)
+    assert passage == text[expanded[0].start : expanded[-1].end]
+    assert score == 0.5
+    # only the retrieved chunk has a score
+    assert [result.score for result in expanded] == [None, None, 0.5, None, None]
+
+
+def test_chunk_within_its_predecessor_is_left_out():
+    def result(chunk_id, start, end, score=None):
+        return RetrievalResult(
+            source_id="source1", chunk_id=chunk_id, text=text[start:end], start=start, end=end, score=score
+        )
+
+    # the second chunk lies entirely within the first one
+    results = [result(0, 0, 100, 0.5), result(1, 40, 90), result(2, 80, 150)]
+    ((passage, score),) = stitch_chunks(results)
+    assert passage == text[0:150]
+    assert score == 0.5
+
+
+def test_separate_runs_become_separate_passages(chunks):
+    hits = [chunk(chunks, "source1", 2), chunk(chunks, "source1", 9), chunk(chunks, "source2", 2)]
+    expanded = get_neighbor_chunks("assistant1", hits, window=1)
+    assert len(stitch_chunks(expanded)) == 3
@@ -1,4 +1,4 @@
-from src.openai_utils import llm_api_test , generate_response
+from src.openai_utils import llm_api_test , generate_response, generate_response_stream, connect_to_client, invalidate_client
 from src.mock_api import _start_mockup_api, _test_llm
 import subprocess
 import pytest
@@ -27,3 +27,26 @@ def test_special_characters_prompt(testLLM):
     """
     result = generate_response(prompt_input=prompt, llm=testLLM)
     assert result
+
+
+def test_streamed_response(testLLM):
+    """test that the streamed deltas add up to the full response."""
+    deltas = list(generate_response_stream(prompt_input="test", llm=testLLM))
+    assert len(deltas) > 1
+    assert "".join(deltas).strip() == generate_response(prompt_input="test", llm=testLLM).strip()
+
+
+def test_client_is_reused(testLLM):
+    """test that a client is cached per llm until the llm is updated or invalidated."""
+    client = connect_to_client(testLLM)
+    assert connect_to_client(testLLM) is client
+    invalidate_client(testLLM.id)
+    assert connect_to_client(testLLM) is not client
+
+
+def test_edited_model_is_tested_with_a_new_client(testLLM):
+    """test that an edited llm is not tested with the client cached for its old settings."""
+    connect_to_client(testLLM)
+    edited = testLLM.model_copy(update={"enpoint_or_base_url": "http://localhost:1/v1"})
+    result, _ = llm_api_test(edited)
+    assert not result
@@ -0,0 +1,25 @@
+""" test running chroma in process instead of over http"""
+import src.chroma_utils as chroma_utils
+from src.chroma_utils import start_chroma_server, start_chroma_client
+import tempfile
+import pytest
+
+
+@pytest.fixture
+def persistent_mode(monkeypatch):
+    monkeypatch.setattr(chroma_utils, "chromadb_mode", "persistent")
+    monkeypatch.setattr(chroma_utils, "vector_db_location", tempfile.mkdtemp())
+    monkeypatch.setattr(chroma_utils, "_persistent_client", None)
+
+
+def test_no_server_is_started(persistent_mode, monkeypatch):
+    monkeypatch.setattr(chroma_utils.subprocess, "Popen", pytest.fail)
+    assert start_chroma_server.__wrapped__() is None
+
+
+def test_client_is_shared(persistent_mode):
+    client = start_chroma_client()
+    assert start_chroma_client() is client
+    collection = client.get_or_create_collection("assistant1")
+    collection.add(ids=["a"], embeddings=[[1.0, 0.0]], documents=["chunk a"])
+    assert start_chroma_client().get_collection("assistant1").count() == 1
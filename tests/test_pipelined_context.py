@@ -0,0 +1,74 @@
+""" test retrieving on the prompt while the search queries are generated"""
+import src.query_chain as query_chain
+from src.query_chain import build_context_pipelined, merge_results
+from src.basic_data_classes import RetrievalResult
+import threading
+import time
+import pytest
+
+
+class Searched(list):
+    """the queries searched for, and an event set when the prompt has been searched for"""
+
+    prompt_searched: threading.Event
+
+
+def result(source_id, chunk_id, score):
+    return RetrievalResult(source_id=source_id, chunk_id=chunk_id, text="", score=score)
+
+
+@pytest.fixture
+def searched(monkeypatch):
+    """fake retrieval returning one result per query, and context building returning the results"""
+    searched = Searched()
+    searched.prompt_searched = threading.Event()
+
+    def fake_retrieve_results(assistant, queries, top_k):
+        searched.append(list(queries))
+        if searched == [["prompt"]]:
+            searched.prompt_searched.set()
+        return [result("source1", len(q), 0.5) for q in queries]
+
+    monkeypatch.setattr(query_chain, "retrieve_results", fake_retrieve_results)
+    monkeypatch.setattr(
+        query_chain,
+        "build_context_from_results",
+        lambda assistant, results: ("context", {"results": [r.key for r in results]}),
+    )
+    monkeypatch.setattr(query_chain, "get_global_setting_value", lambda setting_id: 4)
+    return searched
+
+
+def test_prompt_is_searched_while_queries_are_generated(monkeypatch, searched):
+    def generate_search_queries(prompt_input, messages):
+        # only returns once the prompt has been searched for
+        assert searched.prompt_searched.wait(timeout=5)
+        return ["prompt", "first query", "second"]
+
+    monkeypatch.setattr(query_chain, "generate_search_queries", generate_search_queries)
+    _, report = build_context_pipelined("assistant", "prompt", messages=[], timeout=5)
+    assert searched == [["prompt"], ["first query", "second"]]
+    assert report["queries"] == ["prompt", "first query", "second"]
+    assert report["results"] == [("source1", 6), ("source1", 11)]
+    assert not report["query_maker_timed_out"]
+
+
+def test_timeout_proceeds_with_the_prompt(monkeypatch, searched):
+    def generate_search_queries(prompt_input, messages):
+        time.sleep(1)
+        return ["a slow query"]
+
+    monkeypatch.setattr(query_chain, "generate_search_queries", generate_search_queries)
+    started = time.monotonic()
+    _, report = build_context_pipelined("assistant", "prompt", messages=[], timeout=0.1)
+    assert time.monotonic() - started < 1
+    assert report["queries"] == ["prompt"]
+    assert report["query_maker_timed_out"]
+
+
+def test_merged_results_keep_the_best_score():
+    merged = merge_results(
+        [result("source1", 2, 0.4), result("source1", 1, 0.9)],
+        [result("source1", 1, 0.2)],
+    )
+    assert [(r.key, r.score) for r in merged] == [(("source1", 1), 0.2), (("source1", 2), 0.4)]
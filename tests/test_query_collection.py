@@ -0,0 +1,72 @@
+""" test that multi-query retrieval embeds and searches all queries in one batch"""
+import src.chroma_utils as chroma_utils
+from src.chroma_utils import query_collection
+import src.retrieval_cache as retrieval_cache
+from src.retrieval_cache import clear_retrieval_cache
+import pytest
+
+
+class FakeEmbeddings:
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(t))] for t in texts]
+
+
+class FakeChromaCollection:
+    """answers every query embedding with the same two chunks at different distances"""
+
+    def __init__(self):
+        self.calls = []
+
+    def query(self, query_embeddings, n_results, include):
+        self.calls.append(query_embeddings)
+        n = len(query_embeddings)
+        return {
+            "ids": [["a", "b"] for _ in range(n)],
+            "documents": [["chunk a", "chunk b"] for _ in range(n)],
+            "metadatas": [[{"chunk_id": 0}, {"chunk_id": 1}] for _ in range(n)],
+            "distances": [[0.1 * (i + 1), 0.5 - 0.1 * i] for i in range(n)],
+        }
+
+
+@pytest.fixture
+def fakes(monkeypatch):
+    embeddings = FakeEmbeddings()
+    collection = FakeChromaCollection()
+    monkeypatch.setattr(chroma_utils, "get_embedding_function", lambda: embeddings)
+    monkeypatch.setattr(
+        chroma_utils, "get_chroma_collection", lambda collection_name: collection
+    )
+    # the collection versions and the cache size are not read from the main database
+    monkeypatch.setattr(chroma_utils, "get_collection_version", lambda collection_name: 0)
+    monkeypatch.setattr(retrieval_cache, "get_global_setting_value", lambda setting_id: 100)
+    # results cached by other tests are not used
+    clear_retrieval_cache()
+    return embeddings, collection
+
+
+def test_queries_are_batched_and_deduplicated(fakes):
+    embeddings, collection = fakes
+    queries = ["who invented jazz", "Who invented  jazz", "when was jazz invented"]
+    per_query_hits, merged_hits = query_collection("test", queries, k=2)
+    assert embeddings.calls == [["who invented jazz", "when was jazz invented"]]
+    assert len(collection.calls) == 1
+    assert len(per_query_hits) == len(queries)
+    assert per_query_hits[0] == per_query_hits[1]
+
+
+def test_merged_ranking_keeps_best_distance(fakes):
+    _, merged_hits = query_collection("test", ["query 1", "query 2"], k=2)
+    assert [(d.page_content, round(s, 2)) for d, s in merged_hits] == [
+        ("chunk a", 0.1),
+        ("chunk b", 0.4),
+    ]
+
+
+def test_no_queries(fakes):
+    embeddings, collection = fakes
+    assert query_collection("test", [], k=2) == ([], [])
+    assert embeddings.calls == [] and collection.calls == []
@@ -0,0 +1,95 @@
+""" test the query cache and the fast-path for self-contained questions"""
+import src.query_generation as query_generation
+import src.query_chain as query_chain
+from src.query_generation import (
+    is_self_contained,
+    normalize_conversation_tail,
+    get_query_generation_stats,
+    clear_query_cache,
+)
+from src.query_chain import generate_search_queries
+from src.basic_data_classes import LLM
+import pytest
+
+settings = {
+    "query_maker_llm_id": "",
+    "query_maker_max_tokens": 400,
+    "query_cache_size": 2,
+    "query_cache_ttl_minutes": 60,
+    "query_fast_path_max_words": 8,
+}
+conversation = [
+    {"role": "system", "content": "Du er en hjælpsom assistent."},
+    {"role": "assistant", "content": "Hej, hvordan kan jeg hjælpe dig?"},
+    {"role": "user", "content": "Hvordan opretter jeg en gruppe i Aula?"},
+    {"role": "assistant", "content": "Du klikker på Grupper og vælger Opret."},
+]
+long_question = "Kan du forklare trin for trin hvordan jeg tilføjer forældre og medarbejdere til en gruppe?"
+
+
+class FakeClient:
+    """a client answering with the same three queries"""
+
+    def __init__(self):
+        self.calls = 0
+        self.chat = self
+        self.completions = self
+
+    def create(self, **kwargs):
+        self.calls += 1
+        content = '{"søgeforespørgsler": ["forældre i grupper", "medarbejdere i grupper", "tilføj til gruppe"]}'
+        message = type("Message", (), {"content": content})
+        return type("Response", (), {"choices": [type("Choice", (), {"message": message})]})
+
+
+@pytest.fixture(autouse=True)
+def client(monkeypatch):
+    client = FakeClient()
+    llm = LLM(name="gpt-4", deployment="gpt-4", api_type="openai", enpoint_or_base_url="http://localhost")
+    monkeypatch.setattr(query_generation, "get_global_setting_value", settings.get)
+    monkeypatch.setattr(query_chain, "get_global_setting_value", settings.get)
+    monkeypatch.setattr(query_generation, "get_active_llms", lambda: [llm])
+    monkeypatch.setattr(query_chain, "connect_to_client", lambda llm: client)
+    clear_query_cache()
+    yield client
+    clear_query_cache()
+
+
+def test_short_questions_are_self_contained():
+    assert is_self_contained("Hvordan sletter jeg et billede?", conversation)
+    assert is_self_contained("Hvad er det?", conversation[:2])
+    assert not is_self_contained("Hvordan sletter jeg det?", conversation)
+    assert not is_self_contained("Og for medarbejdere?", conversation)
+    assert not is_self_contained(long_question, conversation)
+
+
+def test_tail_is_normalized():
+    assert normalize_conversation_tail("Hvad  med\nBØRN?", conversation) == (
+        normalize_conversation_tail("hvad med børn", conversation)
+    )
+
+
+def test_fast_path_skips_the_query_maker(client):
+    assert generate_search_queries("Hvordan sletter jeg et billede?", conversation) == [
+        "Hvordan sletter jeg et billede?"
+    ]
+    assert client.calls == 0
+    assert get_query_generation_stats()["fast_path"] == 1
+
+
+def test_queries_are_cached_by_conversation_tail(client):
+    first = generate_search_queries(long_question, conversation)
+    second = generate_search_queries(long_question.upper(), conversation)
+    assert first == second == ["forældre i grupper", "medarbejdere i grupper", "tilføj til gruppe"]
+    assert client.calls == 1
+    stats = get_query_generation_stats()
+    assert (stats["cache_hits"], stats["cache_misses"], stats["llm_calls"]) == (1, 1, 1)
+    assert stats["cache_hit_rate"] == 0.5
+
+
+def test_least_recently_used_queries_are_evicted(client):
+    for question in (long_question, long_question + " Tak", long_question + " Hilsen"):
+        generate_search_queries(question, conversation)
+    generate_search_queries(long_question, conversation)
+    assert client.calls == 4
+    assert get_query_generation_stats()["cached_entries"] == 2
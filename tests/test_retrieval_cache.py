@@ -0,0 +1,76 @@
+""" test that repeated searches skip the vector search until the collection changes"""
+import src.chroma_utils as chroma_utils
+import src.retrieval_cache as retrieval_cache
+from src.chroma_utils import query_collection
+from src.retrieval_cache import (
+    get_collection_version,
+    bump_collection_version,
+    get_retrieval_cache_stats,
+    clear_retrieval_cache,
+)
+from src.sqlite.db_creation import close_connections, create_table_from_dataclass
+from src.basic_data_classes import CollectionVersion
+from tests.test_query_collection import FakeEmbeddings, FakeChromaCollection
+from pathlib import Path
+import tempfile
+import os
+import pytest
+
+
+@pytest.fixture
+def fakes(monkeypatch):
+    """a temporary database with a collectionversions table and a fake collection"""
+    monkeypatch.setenv("MAIN_DATABASE_LOCATION", str(Path(tempfile.mkdtemp()) / "test.db"))
+    close_connections()  # resolve the database location again
+    create_table_from_dataclass(CollectionVersion)
+    embeddings = FakeEmbeddings()
+    collection = FakeChromaCollection()
+    monkeypatch.setattr(chroma_utils, "get_embedding_function", lambda: embeddings)
+    monkeypatch.setattr(
+        chroma_utils, "get_chroma_collection", lambda collection_name: collection
+    )
+    monkeypatch.setattr(retrieval_cache, "get_global_setting_value", lambda setting_id: 10)
+    clear_retrieval_cache()
+    yield embeddings, collection
+    clear_retrieval_cache()
+    close_connections()
+    os.environ.pop("MAIN_DATABASE_LOCATION", None)
+
+
+def test_versions_are_counted(fakes):
+    assert get_collection_version("assistant1") == 0
+    assert bump_collection_version("assistant1") == 1
+    assert bump_collection_version("assistant1") == 2
+    assert get_collection_version("assistant1") == 2
+    assert get_collection_version("assistant2") == 0
+
+
+def test_repeated_queries_skip_the_search(fakes):
+    embeddings, collection = fakes
+    first = query_collection("assistant1", ["who invented jazz"], k=2)
+    # only the new query is embedded and searched
+    second = query_collection("assistant1", ["Who invented jazz", "when was jazz invented"], k=2)
+    assert embeddings.calls == [["who invented jazz"], ["when was jazz invented"]]
+    assert len(collection.calls) == 2
+    assert second[0][0] == first[0][0]
+    query_collection("assistant1", ["who invented jazz", "when was jazz invented"], k=2)
+    assert len(collection.calls) == 2
+    assert get_retrieval_cache_stats()["hits"] == 3
+
+
+def test_changed_collection_is_searched_again(fakes):
+    embeddings, collection = fakes
+    query_collection("assistant1", ["who invented jazz"], k=2)
+    bump_collection_version("assistant1")
+    query_collection("assistant1", ["who invented jazz"], k=2)
+    # other collections and other k are cached separately
+    query_collection("assistant2", ["who invented jazz"], k=2)
+    query_collection("assistant1", ["who invented jazz"], k=3)
+    assert len(collection.calls) == 4
+
+
+def test_cached_hits_are_not_changed_by_callers(fakes):
+    per_query_hits, _ = query_collection("assistant1", ["who invented jazz"], k=2)
+    per_query_hits[0][0][0].metadata["chunk_id"] = 99
+    per_query_hits, _ = query_collection("assistant1", ["who invented jazz"], k=2)
+    assert per_query_hits[0][0][0].metadata["chunk_id"] == 0
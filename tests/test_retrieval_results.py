@@ -0,0 +1,70 @@
+""" test that retrieval keeps the results of every source of a multi-document assistant"""
+import src.query_chain as query_chain
+from src.query_chain import retrieve_results, add_context_from_queries, merge_multiple_strings
+from src.basic_data_classes import Assistant, RetrievalResult
+from langchain_core.documents import Document
+import pytest
+
+assistant = Assistant(
+    id="assistant1",
+    name="test",
+    chat_model_name="model",
+    system_prompt="you are a helpful assistant",
+    owner_id="owner",
+    neighbor_window=0,
+)
+
+
+def hit(source_id, chunk_id, text, distance):
+    metadata = {
+        "source_id": source_id,
+        "name": f"{source_id}.txt",
+        "chunk_id": chunk_id,
+        "start": chunk_id * 100,
+        "end": chunk_id * 100 + len(text),
+        "content_hash": text,
+        "chained_content": "",
+    }
+    return (Document(page_content=text, metadata=metadata), distance)
+
+
+@pytest.fixture(autouse=True)
+def hits(monkeypatch):
+    """the first chunk of two documents and the same chunk found by two queries"""
+    monkeypatch.setattr(query_chain, "get_llm", lambda llm_id: None)
+    merged_hits = [
+        hit("manual", 0, "The manual starts here.", 0.2),
+        hit("policy", 0, "The policy starts here.", 0.3),
+        hit("policy", 4, "The policy ends here.", 0.4),
+        hit("policy", 4, "The policy ends here.", 0.1),
+    ]
+    monkeypatch.setattr(
+        query_chain,
+        "query_collection",
+        lambda collection_name, queries, k: ([merged_hits] * len(queries), merged_hits),
+    )
+
+
+def test_same_chunk_id_in_different_sources_is_kept():
+    results = retrieve_results(assistant, ["query 1", "query 2"])
+    assert [(r.source_id, r.chunk_id, r.score) for r in results] == [
+        ("manual", 0, 0.2),
+        ("policy", 0, 0.3),
+        ("policy", 4, 0.1),
+    ]
+
+
+def test_context_holds_every_source():
+    messages = add_context_from_queries([], ["query"], assistant)
+    context = messages[-1]["content"]
+    for text in ["The manual starts here.", "The policy starts here.", "The policy ends here."]:
+        assert text in context
+
+
+def test_legacy_chunks_of_different_sources_are_not_merged():
+    same_words = "a b c d e f g h"
+    results = [
+        RetrievalResult(source_id="manual", chunk_id=1, text="", chained_content=same_words),
+        RetrievalResult(source_id="policy", chunk_id=2, text="", chained_content="... " + same_words),
+    ]
+    assert merge_multiple_strings(results) == [(same_words, None), ("... " + same_words, None)]
@@ -61,7 +61,6 @@ def init_chat():
             {"role": "assistant", "content": test_assistant.welcome_message},
         ],
     )
-    at.session_state["number_of_sources"] = 0
     return at
 
 
@@ -0,0 +1,95 @@
+""" test fetching url sources against a local http server"""
+import src.url_fetching as url_fetching
+from src.url_fetching import fetch_urls, load_url_sources, refresh_url_sources
+from src.document_loading import content_hash
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import pytest
+
+ETAG = '"v1"'
+requests_seen = []
+
+
+class Handler(BaseHTTPRequestHandler):
+    """serves a page with an etag and answers 304 when the etag matches"""
+
+    def do_GET(self):
+        requests_seen.append(self.path)
+        if self.path == "/missing":
+            self.send_response(404)
+            self.end_headers()
+            return
+        if self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = f"<html><body><h1>Page {self.path}</h1><p>Some  text</p></body></html>"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("ETag", ETAG)
+        self.send_header("Last-Modified", "Mon, 01 Jan 2024 00:00:00 GMT")
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def base_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setattr(url_fetching, "get_global_setting_value", lambda id: 2)
+    requests_seen.clear()
+
+
+def test_urls_are_loaded_with_validators(base_url):
+    urls = [f"{base_url}/page{i}" for i in range(5)]
+    results = load_url_sources(urls, "test_assistant")
+    assert [url for url, _ in results] == urls
+    source = results[3][1]
+    assert source.content == "Page /page3Some text"
+    assert source.etag == ETAG
+    assert source.last_modified == "Mon, 01 Jan 2024 00:00:00 GMT"
+    assert sorted(requests_seen) == sorted(f"/page{i}" for i in range(5))
+
+
+def test_errors_are_reported_per_url(base_url):
+    (_, ok), (_, missing) = load_url_sources(
+        [f"{base_url}/page", f"{base_url}/missing"], "test_assistant"
+    )
+    assert ok.content
+    assert isinstance(missing, ConnectionError) and "404" in str(missing)
+
+
+def test_unchanged_source_is_not_refetched(base_url):
+    (_, source), = load_url_sources([f"{base_url}/page"], "test_assistant")
+    assert refresh_url_sources([source]) == [None]
+    (result,) = fetch_urls([(source.name, source.etag, "")])
+    assert result.not_modified and result.text == ""
+
+
+def test_changed_source_is_refetched(base_url):
+    (_, source), = load_url_sources([f"{base_url}/page"], "test_assistant")
+    source.etag = '"v0"'
+    source.content = "an older version"
+    source.content_hash = content_hash(source.content)
+    (new_source,) = refresh_url_sources([source])
+    assert new_source.content == "Page /pageSome text"
+    assert new_source.etag == ETAG
+    assert new_source.id == source.id
+
+
+def test_validators_of_unchanged_source_are_kept(base_url):
+    (_, source), = load_url_sources([f"{base_url}/page"], "test_assistant")
+    # a source stored before the server sent validators
+    source.etag, source.last_modified = "", ""
+    assert refresh_url_sources([source]) == [None]
+    assert source.etag == ETAG
+    assert source.last_modified == "Mon, 01 Jan 2024 00:00:00 GMT"
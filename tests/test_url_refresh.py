@@ -0,0 +1,91 @@
+""" test which url sources the scheduler refreshes and what it does with changed pages"""
+import src.url_refresh as url_refresh
+from src.url_refresh import get_sources_due, refresh_due_sources
+from src.sqlite.db_creation import close_connections, create_table_from_dataclass
+from src.sqlite.queries import insert, select_one
+from src.sqlite.db_utils import get_assistant_sources
+from src.basic_data_classes import Assistant, Source, SourceSummary
+from datetime import datetime, timedelta
+from pathlib import Path
+import tempfile
+import pytest
+import os
+
+now = datetime(2024, 6, 1, 12, 0)
+
+
+@pytest.fixture(autouse=True)
+def database(monkeypatch):
+    test_db_location = Path(tempfile.mkdtemp()) / "test.db"
+    monkeypatch.setenv("MAIN_DATABASE_LOCATION", str(test_db_location))
+    close_connections()  # resolve the database location again
+    create_table_from_dataclass(Assistant)
+    create_table_from_dataclass(Source)
+    monkeypatch.setattr(url_refresh, "get_global_setting_value", lambda id: 2)
+    yield
+    close_connections()
+    os.environ.pop("MAIN_DATABASE_LOCATION", None)
+
+
+def add_assistant(url_refresh_hours: int) -> Assistant:
+    assistant = Assistant(
+        name="test",
+        chat_model_name="model",
+        system_prompt="you are a helpful assistant",
+        owner_id="owner",
+        url_refresh_hours=url_refresh_hours,
+    )
+    insert(assistant)
+    return assistant
+
+
+def add_url_source(assistant, name, hours_ago, source_type="url") -> Source:
+    source = Source(
+        name=name,
+        source_type=source_type,
+        content="old text",
+        collection_name_and_assistant_id=assistant.id,
+        last_fetched=now - timedelta(hours=hours_ago),
+    )
+    insert(source)
+    return source
+
+
+def test_sources_due_follow_the_assistant_interval():
+    daily = add_assistant(24)
+    never = add_assistant(0)
+    due = add_url_source(daily, "https://a.dk/due", hours_ago=25)
+    add_url_source(daily, "https://a.dk/recent", hours_ago=2)
+    add_url_source(daily, "file.txt", hours_ago=25, source_type="uploaded file")
+    add_url_source(never, "https://a.dk/never", hours_ago=1000)
+    # the due sources are loaded with their content, the listed sources without it
+    assert get_sources_due(now) == [due]
+    listed = get_assistant_sources(daily.id)
+    assert len(listed) == 3 and all(isinstance(s, SourceSummary) for s in listed)
+
+
+def test_only_changed_sources_are_queued(monkeypatch):
+    assistant = add_assistant(1)
+    sources = [add_url_source(assistant, f"https://a.dk/{i}", hours_ago=3) for i in range(5)]
+    batches, submitted = [], []
+
+    def fake_refresh(batch):
+        batches.append(len(batch))
+        # the server sends validators for the unchanged pages
+        for s in batch:
+            s.etag = '"v2"'
+        # only the page https://a.dk/3 has changed
+        return [
+            s.model_copy(update={"content": "new text"}) if s.name.endswith("3") else None
+            for s in batch
+        ]
+
+    monkeypatch.setattr(url_refresh, "refresh_url_sources", fake_refresh)
+    monkeypatch.setattr(url_refresh, "submit_source", submitted.append)
+    assert refresh_due_sources(now) == 1
+    assert batches == [2, 2, 1]
+    assert [s.name for s in submitted] == ["https://a.dk/3"]
+    assert submitted[0].last_fetched == now
+    assert all(select_one(Source, s.id).last_fetched == now for s in sources)
+    assert all(select_one(Source, s.id).etag == '"v2"' for s in sources)
+    assert get_sources_due(now) == []
@@ -0,0 +1,93 @@
+""" test that the chroma and hnswlib vector stores behave the same"""
+import src.chroma_utils as chroma_utils
+from src.chroma_utils import ChromaVectorStore
+from src.vector_stores import HnswVectorStore
+from src.basic_data_classes import ChunkMetadata
+from chromadb.config import Settings
+import chromadb
+import tempfile
+import pytest
+
+
+def chunk_metadata(source_id: str, chunk_id: int) -> dict:
+    return ChunkMetadata(
+        source_id=source_id, name=f"{source_id}.txt", chunk_id=chunk_id, content_hash=f"hash{chunk_id}"
+    ).model_dump()
+
+
+def add_chunks(store, source_id: str, n: int, offset: float = 0.0):
+    """n chunks along a line, chunk i is embedded at (i + offset, 1)"""
+    store.add(
+        ids=[f"{source_id}-{i}" for i in range(n)],
+        embeddings=[[float(i) + offset, 1.0] for i in range(n)],
+        documents=[f"{source_id} chunk {i}" for i in range(n)],
+        metadatas=[chunk_metadata(source_id, i) for i in range(n)],
+    )
+
+
+@pytest.fixture(params=["chroma", "hnswlib"])
+def store(request, monkeypatch):
+    if request.param == "hnswlib":
+        return HnswVectorStore(tempfile.mkdtemp())
+    client = chromadb.EphemeralClient(
+        settings=Settings(anonymized_telemetry=False, allow_reset=True)
+    )
+    client.reset()
+    monkeypatch.setattr(chroma_utils, "start_chroma_client", lambda: client)
+    monkeypatch.setattr(chroma_utils, "get_embedding_function", lambda: None)
+    monkeypatch.setattr(chroma_utils, "get_global_setting_value", lambda setting_id: 10)
+    monkeypatch.setattr(chroma_utils, "bump_collection_version", lambda collection_name: 1)
+    monkeypatch.setattr(chroma_utils, "_collection_handles", chroma_utils.OrderedDict())
+    return ChromaVectorStore("assistant1")
+
+
+def test_nearest_chunks_are_found(store):
+    add_chunks(store, "source1", 20)
+    add_chunks(store, "source2", 5, offset=100.0)
+    response = store.query([[3.1, 1.0], [101.2, 1.0]], k=2)
+    assert response["ids"] == [["source1-3", "source1-4"], ["source2-1", "source2-2"]]
+    assert response["documents"][0][0] == "source1 chunk 3"
+    assert response["metadatas"][1][0] == chunk_metadata("source2", 1)
+    assert response["distances"][0][0] == pytest.approx(0.01, abs=1e-4)
+    assert store.count() == 25
+
+
+def test_chunks_are_filtered(store):
+    add_chunks(store, "source1", 20)
+    add_chunks(store, "source2", 5)
+    assert len(store.get(name="source2.txt")["ids"]) == 5
+    neighbors = store.get(source_id="source1", chunk_ranges=[(2, 3), (10, 11)])
+    assert sorted(m["chunk_id"] for m in neighbors["metadatas"]) == [2, 3, 10, 11]
+
+
+def test_metadata_is_updated_and_sources_deleted(store):
+    add_chunks(store, "source1", 5)
+    add_chunks(store, "source2", 5, offset=100.0)
+    store.update_metadatas(["source1-0"], [chunk_metadata("source3", 0)])
+    assert store.get(source_id="source3")["ids"] == ["source1-0"]
+    assert store.delete_source("source1") == 4
+    assert store.count() == 6
+    # deleted chunks are not found any more
+    assert store.query([[0.0, 1.0]], k=2)["ids"] == [["source1-0", "source2-0"]]
+
+
+def test_empty_store(store):
+    assert store.query([[0.0, 1.0]], k=4)["ids"] == [[]]
+    assert store.count() == 0
+
+
+def test_hnswlib_store_is_reopened_from_disk():
+    directory = tempfile.mkdtemp()
+    store = HnswVectorStore(directory)
+    add_chunks(store, "source1", 1500)
+    store.delete(["source1-7"])
+    # nothing is written before the store is flushed
+    assert HnswVectorStore(directory).count() == 0
+    store.flush()
+    reopened = HnswVectorStore(directory)
+    assert reopened.count() == 1499
+    assert reopened.query([[6.9, 1.0]], k=1)["ids"] == [["source1-6"]]
+    # the slot of the deleted chunk is reused
+    add_chunks(reopened, "source2", 1, offset=7.0)
+    assert reopened.query([[7.0, 1.0]], k=1)["ids"] == [["source2-0"]]
+    reopened.drop()